@@ -7,16 +7,19 @@
 
 # Import modules needed
 import ee
-import time
+import os
+from flood_detection import session
+from flood_detection.utils import assets, scheduler
 
 # Authenticate to GEE
 ee.Authenticate()
 
 # Initialise the GEE API - connect to the hydrafloods project on Google Earth Engine
-ee.Initialize(project='moz-hydrafloods')
+session.initialize('moz-hydrafloods')
 
 # Define the region of interest (Mozambique) using a bounding box (approximate)
-mozambique = ee.Geometry.Rectangle([29.711948, -27.367828, 41.339403, -9.972775])
+mozambique_bounds = [29.711948, -27.367828, 41.339403, -9.972775]
+mozambique = ee.Geometry.Rectangle(mozambique_bounds)
 
 # Filter the MODIS MCD12Q1 dataset by date (2008-2022) and select the LC_Prop2 band (FAO-LCCS2 land use layer)
 
@@ -27,6 +30,10 @@ dataset = ee.ImageCollection('MODIS/061/MCD12Q1') \
     .map(lambda image: image.clip(mozambique))
 
 
+# Export queue - the exports are started within the GEE limits (rate of task starts, tasks running
+# at once) and tracked in this file. A year is only exported again when its export settings change
+export_queue = scheduler.open_queue(os.path.join("results", "export_queue_01.json"))
+
 # Loop over the years 2008-2022
 for year in range(2008, 2023):
     # Filter the dataset for the current year
@@ -36,7 +43,7 @@ for year in range(2008, 2023):
     image = year_dataset.first()
 
     # Define the export task to Google Drive for the current year
-    export_task = ee.batch.Export.image.toDrive(
+    export_params = dict(
         image=image,
         description=f'MODIS_Land_Cover_{year}',  # Dynamic name for each year
         folder='GEE_Exports',  # Folder name in Google Drive
@@ -45,8 +52,22 @@ for year in range(2008, 2023):
         crs='EPSG:4326'  # Coordinate reference system (WGS84)
     )
 
-    # Start the export task
-    export_task.start()
+    # Queue the export task - skipped if the same export was completed by an earlier run
+    fingerprint = assets.export_fingerprint(f'MODIS/061/MCD12Q1/LC_Prop2/{year}',
+                                            mozambique_bounds, 500, crs='EPSG:4326')
+    state = scheduler.submit(export_queue, f'MODIS_Land_Cover_{year}', "image.toDrive", export_params,
+                             fingerprint)
+    if state == "completed":
+        print(f"MODIS Land Cover {year} already exported.")
+    elif state == "running":
+        print(f"Export task for MODIS Land Cover {year} still running from an earlier run.")
+    else:
+        print(f"Export task queued for MODIS Land Cover {year}.")
+
+# Start the exports and wait for them - failures are retried with backoff
+scheduler.run_queue(export_queue, scheduler.ee_task_service())
 
-    print(f"Export task started for MODIS Land Cover {year}.")
+# Report the exports that failed for good - they are tried again on the next run
+for key, error in scheduler.failed_tasks(export_queue):
+    print(f"Export failed: {key} ({error})")
 
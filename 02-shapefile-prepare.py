@@ -10,6 +10,7 @@ import arcpy
 import os
 from arcpy import env
 from arcpy.sa import *
+from flood_exposure import dissolve, zones
 
 #overwrite existing data. 
 arcpy.env.overwriteOutput = True 
@@ -52,6 +53,12 @@ moz_admin3_shp_results = "moz_admin3_shp.shp"
 # Shapefile format for admin level 3 
 moz_admin1_shp_results = "moz_admin1_shp.shp"
 
+# Table of admin 3 codes with their admin 2 and admin 1 codes and names
+admin_code_mapping = "admin_code_mapping.csv"
+
+# Administrative levels from the finest to the coarsest - code field and the name field to keep
+admin_levels = [("PA_ID", "Posto"), ("ID_DIST", "Distrito"), ("CodProv", "Provincia")]
+
 # Environment settings #####################################
 
 # Set ArcGIS workspace to the flood folder (where input data is found). 
@@ -71,66 +78,44 @@ for field in fields:
     print(f"Field Name: {field.name}, Field Type: {field.type}")
 
 
-# Dissolve the EA-level shapefile at admin 3 level and save in the geodatabase. Keep the Posto character name 
-arcpy.management.Dissolve(EA_level_shapefile_moz, moz_admin3_shp, "PA_ID", statistics_fields=[("Posto", "MAX")])
-
-# Double check the fields in the admin level 3 shapefile
-fields2 = arcpy.ListFields(moz_admin3_shp)
-
-# Print fields
-for field in fields2:
-    print(f"Field Name: {field.name}, Field Type: {field.type}")
-
-# Rename the "MAX_Posto" column 
-old_field_name = "MAX_Posto" 
-new_field_name = "Posto"
-
-# Rename the field
-arcpy.management.AlterField(moz_admin3_shp, old_field_name, new_field_name)    
-
-# Create an admin 1 (province level shapefile)
-arcpy.management.Dissolve(EA_level_shapefile_moz, moz_admin1_shp, "CodProv", statistics_fields=[("Provincia", "MAX")])
-
-# Rename the "MAX_Provincia" column 
-old_field_name = "MAX_Provincia" 
-new_field_name = "Provincia"
-
-# Rename the field
-arcpy.management.AlterField(moz_admin1_shp, old_field_name, new_field_name)    
+# Dissolve the EA-level shapefile at admin 3 level (PA_ID), then build admin 2 (ID_DIST) from the admin 3
+# polygons and admin 1 (CodProv) from the admin 2 polygons - one pass over the EAs instead of three Dissolves.
+# Borders shared by polygons of the same unit cancel out, so no general polygon union is needed.
+# (A level whose codes do not nest in the level below is dissolved from the EAs instead, as Dissolve did.)
+# Keep the character names (MAX of the EA names, as statistics_fields=[(..., "MAX")] did)
+ea_geoms, ea_records, ea_crs = zones.read_zones(EA_level_shapefile_moz)
+(admin3_geoms, admin3_records), (admin2_geoms, admin2_records), (admin1_geoms, admin1_records) = \
+    dissolve.dissolve_hierarchy(ea_geoms, ea_records, admin_levels)
 
 # Province names in the shapefile: "Niassa", "Cabo Delgado", "Nampula", "Zambezia", "Tete", "Manica", "Sofala", "Inhambane",
 # "Gaza", "Maputo Provincia", "Maputo Cidade"
-
-# Dissolve the EA-level shapefile at administrative level 2 (district)
-# Variable to use: ID_DIST (unique district codes)
-arcpy.management.Dissolve(EA_level_shapefile_moz, moz_admin2_shp, "ID_DIST", statistics_fields=[("Distrito", "MAX")]) # keep character district name
-
-# Double check the fields in the admin level 2 shapefile
-fields3 = arcpy.ListFields(moz_admin2_shp)
-
-# Print fields
-for field in fields3:
-    print(f"Field Name: {field.name}, Field Type: {field.type}")
-
-# Rename the "MAX_Distrito" column 
-old_field_name = "MAX_Distrito" 
-new_field_name = "Distrito"
-
-# Rename the field
-arcpy.management.AlterField(moz_admin2_shp, old_field_name, new_field_name)
+print("Dissolved " + str(len(ea_geoms)) + " EAs to " + str(len(admin3_geoms)) + " postos, " +
+      str(len(admin2_geoms)) + " districts and " + str(len(admin1_geoms)) + " provinces")
 
 # Get current working directory
 cwd = os.getcwd()
 
 # Save in the results folder 
-arcpy.CopyFeatures_management(moz_admin2_shp, os.path.join(cwd, results_folder, moz_admin2_shp_results))
+dissolve.write_shapefile(os.path.join(cwd, results_folder, moz_admin2_shp_results), admin2_geoms, admin2_records, ea_crs)
 
 # Save admin level 3 shapefile
-arcpy.CopyFeatures_management(moz_admin3_shp, os.path.join(cwd, results_folder, moz_admin3_shp_results))
+dissolve.write_shapefile(os.path.join(cwd, results_folder, moz_admin3_shp_results), admin3_geoms, admin3_records, ea_crs)
 
 # Finally, admin level 1
-arcpy.CopyFeatures_management(moz_admin1_shp, os.path.join(cwd, results_folder, moz_admin1_shp_results))
+dissolve.write_shapefile(os.path.join(cwd, results_folder, moz_admin1_shp_results), admin1_geoms, admin1_records, ea_crs)
 
+# Save the code mapping (posto -> district -> province) - used to roll results up the admin levels
+dissolve.write_code_mapping(os.path.join(cwd, results_folder, admin_code_mapping),
+                            dissolve.code_mapping(ea_records, admin_levels), admin_levels)
 
+# Copy the shapefiles to the geodatabase
+arcpy.CopyFeatures_management(os.path.join(cwd, results_folder, moz_admin3_shp_results), moz_admin3_shp)
+arcpy.CopyFeatures_management(os.path.join(cwd, results_folder, moz_admin2_shp_results), moz_admin2_shp)
+arcpy.CopyFeatures_management(os.path.join(cwd, results_folder, moz_admin1_shp_results), moz_admin1_shp)
 
+# Double check the fields in the admin level 3 shapefile
+fields2 = arcpy.ListFields(moz_admin3_shp)
 
+# Print fields
+for field in fields2:
+    print(f"Field Name: {field.name}, Field Type: {field.type}")
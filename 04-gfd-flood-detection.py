@@ -12,16 +12,16 @@
 
 # Import modules needed
 import ee
-from flood_detection import modis    # this is the flood_detection folder from the repo, which contains all the tools 
-from flood_detection.utils import export, misc
+from flood_detection import modis, session    # this is the flood_detection folder from the repo, which contains all the tools 
+from flood_detection.utils import assets, export, fetch, misc, scheduler
 
-import time, os, csv
+import os, csv
 
 # Authenticate to GEE
 ee.Authenticate()
 
 # Initialise the GEE API - connect to the hydrafloods project on Google Earth Engine
-ee.Initialize(project='moz-hydrafloods')
+session.initialize('moz-hydrafloods')
 
 # INPUTS
 # Enter the ID of the GEE Asset that contains the list of events to be mapped
@@ -32,22 +32,50 @@ ee.Initialize(project='moz-hydrafloods')
 # event over.
 
 # This GEE Asset is the DFO archive for Mozambique between 14-01-2018 - 20-02-2021
-#event_db = ee.FeatureCollection("projects/moz-hydrafloods/assets/dfo_moz_flood_shp").sort("ID")
+#event_db_asset = "projects/moz-hydrafloods/assets/dfo_moz_flood_shp"
 
 # This GEE Asset is the EM-DAT archive with flood events for Mozambique in 2022
-event_db = ee.FeatureCollection("projects/moz-hydrafloods/assets/emdat_moz_flood_shp").sort("ID")
+event_db_asset = "projects/moz-hydrafloods/assets/emdat_moz_flood_shp"
+event_db = ee.FeatureCollection(event_db_asset).sort("ID")
 
 # GEE Asset folder and Google Cloud Storage for image collection
 gcs_folder = "gfd_mozambique"
 asset_path = "projects/moz-hydrafloods/assets"  # Upload shapefile with events as an asset here 
 
+# Cache of the event properties fetched from GEE (dates, watershed bounds, countries) - the dates of
+# all events are fetched in one request and the watersheds / countries a few events at a time. A rerun
+# with the same version of the event table reads them from here. None fetches them every run
+info_cache_folder = os.path.join("results", "cache", "gee_info")
+
+# Export queue - the exports are started by the scheduler within the GEE limits (a rate of task
+# starts and a cap on the tasks running at once) and tracked in this file, so a restarted run
+# does not export the same event twice
+export_queue_file = os.path.join("results", "export_queue_04.json")
+
 #-------------------------------------------------------------------------------
 # PROCESSING STARTS HERE
 
+# Use polygon from event GEE Asset to select watersheds from global
+# HydroSheds data choose level3, level4, or level5
+def event_watershed(flood_event):
+    return misc.get_watersheds_level4(flood_event.geometry()).union().geometry()
+    # return misc.get_islands(flood_event.geometry()).union().geometry()
+
+# Values fetched with the properties of each event - the watershed bounds (export region) and the
+# countries within the watershed boundary
+def event_extras(flood_event):
+    watershed = event_watershed(flood_event)
+    cc_list, country_list = misc.country_lists(watershed)
+    return {"region": watershed.bounds().coordinates(),
+            "cc_list": cc_list, "country_list": country_list}
+
+# Properties of all the events (instead of several requests per event). The cache is keyed by the
+# version of the event table, so an edited table is fetched again
+event_info = fetch.event_table(event_db, event_extras, info_cache_folder,
+                               version=fetch.asset_version(event_db_asset))
+
 # Create list of events from input gee asset
-event_ids = ee.List(event_db.filterMetadata("ID", "greater_than", 0).aggregate_array('ID')).sort() # first asset ID for EM-DAT is 1
-id_list = event_ids.getInfo()
-id_list = [int(i) for i in id_list]
+id_list = sorted(i for i in event_info if i > 0) # first asset ID for EM-DAT is 1
 
 # NOTE: Code snippet for when you are re-running floods in error log
 # errors = "error_logs\\gfd_v3\\3Day_otsu_error_log_23_07_2019_1.csv"
@@ -67,26 +95,32 @@ id_list = [int(i) for i in id_list]
 #            4272,4314,4315,4325,4339,4340,4346,4357,4364,4427,4428,4435,4444,
 #            4464,4507,4516]
 
-snooze_button = 1
+# Exports are submitted to the queue as the events are mapped, and started by the scheduler
+export_queue = scheduler.open_queue(export_queue_file)
+task_service = scheduler.ee_task_service()
+
+# DFO assets already in the asset folder - they are not exported again (GEE cannot overwrite an asset)
+existing_assets = {a["name"] for a in assets.list_assets(asset_path)}
+
 for event in id_list:
 
-    # Check if we have worn out GEE
-    if snooze_button%50==0: #if true - hit the snooze button
-        print("---------------------Giving GEE a breather for 15 mins--------------------")
-        time.sleep(900)
+    # Watershed bounds and countries could not be fetched (e.g. a timeout) - move onto the next event
+    if 'extras_error' in event_info[event]:
+        print("Event Info Error {0} - {1} - Cataloguing and moving onto next event".format(
+            event, event_info[event]['extras_error']))
+        print("-------------------------------------------------")
+        continue
 
-    # Get event date range
+    # Get event date range - already fetched
     flood_event = ee.Feature(event_db.filterMetadata('ID', 'equals', event).first())
-    began = str(ee.Date(flood_event.get('BEGAN')).format('yyyy-MM-dd').getInfo())
-    ended = str(ee.Date(flood_event.get('ENDED')).format('yyyy-MM-dd').getInfo())
+    began = str(event_info[event]['began'])
+    ended = str(event_info[event]['ended'])
     #thresh_type = str(flood_event.get('ThreshType').getInfo())
 
     thresh_type = 'standard' # Threshold options are 'standard' or 'otsu'
 
-    # Use polygon from event GEE Asset to select watersheds from global
-    # HydroSheds data choose level3, level4, or level5
-    watershed = misc.get_watersheds_level4(flood_event.geometry()).union().geometry()
-    # watershed = misc.get_islands(flood_event.geometry()).union().geometry()
+    # Watershed of the event (see event_watershed above)
+    watershed = event_watershed(flood_event)
 
     try:
         # Map the event. Returns 4 band image: 'flooded', 'duration',
@@ -103,8 +137,9 @@ for event in id_list:
         perm_water = misc.get_jrc_perm(watershed)
         print("Returned the permanent water mask")
 
-        # Get countries within the watershed boundary
-        country_info = misc.get_countries(watershed)
+        # Countries within the watershed boundary - already fetched
+        country_info = ([str(c) for c in event_info[event]['cc_list']],
+                        [str(c) for c in event_info[event]['country_list']])
         print("Got country info")
 
         # Add permanent and seasonal water as bands to image
@@ -122,7 +157,6 @@ for event in id_list:
 
         print("DFO Algorithm Error {0} - Cataloguing and moving onto next event".format(event))
         print("-------------------------------------------------")
-        snooze_button+=1
         continue
 
     # Try exporting to your Google Drive 
@@ -134,22 +168,28 @@ for event in id_list:
     #     the resolution (in meters) to save it (default = 250m)
     #     Remember to set the "threshold" parameter in the export function - standard or otsu
 
-        export.to_asset(dfo_final, watershed.bounds(), asset_path, 250)
+        if not export.to_asset(dfo_final, watershed.bounds(), asset_path, 250, event_info[event],
+                               queue=export_queue, existing_assets=existing_assets):
+            print("-------------------------------------------------")
+            continue
 
-        print("Exported asset")
+        print("Queued asset export")
         
         # Google Cloud Storage incurs a charge - leave out for now
-        #export.to_gcs(dfo_final, watershed.bounds(), gcs_folder, 'DFO', 250)
+        #export.to_gcs(dfo_final, watershed.bounds(), gcs_folder, 'DFO', 250, queue=export_queue)
 
         print("Uploading DFO {0} to GEE Assets & GCS".format(event))
         print("-------------------------------------------------")
 
+        # Start the exports that the rate limit allows so far (does not wait)
+        scheduler.step(export_queue, task_service)
+
     except Exception as e:
         s = str(e)
         print("Export Error DFO {0} - Cataloguing and moving onto next event".format(event))
         print("-------------------------------------------------")
 
-    # Add to the snooze_button so we don't make Noel angry.
-    snooze_button+=1
+# Wait for the remaining exports - started as the rate limit allows, failures retried with backoff
+scheduler.run_queue(export_queue, task_service)
 
 
@@ -4,49 +4,84 @@
 
 # Import the needed libraries
 import ee
+import os
+from flood_detection import session
+from flood_detection.utils import assets, scheduler
 
 # Authenticate to GEE
 ee.Authenticate()
 
 # Initialise the GEE API - connect to the hydrafloods project on Google Earth Engine
-ee.Initialize(project='moz-hydrafloods')
+session.initialize('moz-hydrafloods')
 
 # Path to the GEE asset folder
 project_path = 'projects/moz-hydrafloods/assets/'
 
-# List all assets in the folder
-assets = ee.data.listAssets({'parent': project_path}).get('assets', [])
+# List all assets in the folder - all pages, cached for an hour in the results folder
+asset_list = assets.list_assets(project_path, os.path.join("results", "cache", "asset_list_05.json"))
 
 # Version 1: All flood events from DFO archive
 # Filter assets starting with 'DFO'
-#dfo_assets = [a for a in assets if a['name'].split('/')[-1].startswith('DFO')]
+#dfo_assets = [a for a in asset_list if a['name'].split('/')[-1].startswith('DFO')]
 
 # Version 2: export only EM-DAT flood layers (files starting with: DFO_1 DFO_2 DFO_3)
 allowed_prefixes = ("DFO_1", "DFO_2", "DFO_3")
 
 dfo_assets = [
-    a for a in assets
+    a for a in asset_list
     if a['name'].split('/')[-1].startswith(allowed_prefixes)
 ]
 
 # Check which assets were picked up
 print(dfo_assets)
 
+# Export settings - scale (m), output CRS (None keeps the CRS of the asset), region ([xmin, ymin, xmax,
+# ymax] in degrees; None exports the footprint of each asset), Drive folder and pixel limit
+export_scale = 250 # 250m spatial resolution - MODIS
+export_crs = None
+export_region = None
+export_folder = 'GEE_Exports'
+export_max_pixels = 1e13
+
+# Export queue - the exports are started within the GEE limits (rate of task starts, tasks running
+# at once) and tracked in this file. An asset is only exported again when the export would differ:
+# the asset was updated since (updateTime) or the export settings above changed. The footprint of an
+# asset only changes with the asset itself (updateTime)
+export_queue = scheduler.open_queue(os.path.join("results", "export_queue_05.json"))
+
 # Export each DFO asset to Google Drive
 for asset in dfo_assets:
     asset_id = asset['name']
     asset_name = asset_id.split('/')[-1]
     image = ee.Image(asset_id).uint16()
 
-    task = ee.batch.Export.image.toDrive(
+    export_params = dict(
         image=image,
         description=f'Export_{asset_name}',
-        folder='GEE_Exports',
+        folder=export_folder,
         fileNamePrefix=asset_name,
-        scale=250, # 250m spatial resolution - MODIS
-        region=image.geometry(),
-        maxPixels=1e13
+        scale=export_scale,
+        region=image.geometry() if export_region is None else ee.Geometry.Rectangle(export_region),
+        maxPixels=export_max_pixels
     )
+    if export_crs is not None:
+        export_params['crs'] = export_crs
+
+    fingerprint = assets.export_fingerprint(asset_id, export_region or "asset footprint", export_scale,
+                                            crs=export_crs, dtype="uint16", version=asset.get('updateTime'),
+                                            settings={"folder": export_folder, "fileNamePrefix": asset_name,
+                                                      "maxPixels": export_max_pixels})
+    state = scheduler.submit(export_queue, asset_id, "image.toDrive", export_params, fingerprint)
+    if state == "completed":
+        print(f'Already exported: {asset_name}')
+    elif state == "running":
+        print(f'Still running from an earlier run: {asset_name}')
+    else:
+        print(f'Queued export: {asset_name}')
+
+# Start the exports and wait for them - failures are retried with backoff
+scheduler.run_queue(export_queue, scheduler.ee_task_service())
 
-    task.start()
-    print(f'Started export: {asset_name}')
\ No newline at end of file
+# Report the exports that failed for good - they are tried again on the next run
+for key, error in scheduler.failed_tasks(export_queue):
+    print(f'Export failed: {key.split("/")[-1]} ({error})')
\ No newline at end of file
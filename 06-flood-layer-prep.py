@@ -13,6 +13,7 @@ import arcpy
 import os
 from arcpy import env
 from arcpy.sa import *
+from flood_exposure import cube, events, raster
 
 #overwrite existing data. 
 arcpy.env.overwriteOutput = True 
@@ -29,6 +30,12 @@ moz_country_shapefile_geo = "MOZ_2017_country"
 # Folders with flood extents 
 flood_folder = r"C:\Users\idabr\OneDrive - University of Southampton\05 Paper 1\02 Data\03 Flood\01 Global Flood Database"
 
+# Output - folder for GeoTIFF copies of the flood layers (read by the NumPy exposure scripts)
+flood_tif_folder = os.path.join(os.getcwd(), "results", "flood_layers")
+
+# Output - bit-packed cube with all flood layers (one bit per pixel and event)
+flood_cube_folder = os.path.join(os.getcwd(), "results", "flood_cube")
+
 # Number of raster band that contains the "flooded" layer - in this case Band 1 
 flood_band_index = 1  
 
@@ -44,6 +51,9 @@ arcpy.env.extent = moz_country_shapefile_geo
 # This will allow me to use the flood layer as a mask later on 
 remap = RemapValue([[1, 1]])
 
+# Create the GeoTIFF output folder
+os.makedirs(flood_tif_folder, exist_ok=True)
+
 # Loop through nested folders
 for root, dirs, files in os.walk(flood_folder):
     for file in files:
@@ -62,5 +72,21 @@ for root, dirs, files in os.walk(flood_folder):
             # Step 3: Recode 0 values to missing 
             output_name = raster_name + "_masked" 
             Reclassify(masked_raster, "VALUE", remap, "NODATA").save(output_name)
+
+            # Step 4: Save a GeoTIFF copy for 08-population-exposed.py
+            arcpy.management.CopyRaster(output_name, os.path.join(flood_tif_folder, output_name + ".tif"))
             
-            print(f"Saved: {output_name}")
\ No newline at end of file
+            print(f"Saved: {output_name}")
+
+# Store all flood layers in one bit-packed event cube #####################################
+# All layers are masked to the same Mozambique extent, so the grid of the first layer is the common grid.
+# Each event takes 1 bit per pixel, with its ID, start/end dates and source (GFD/DFO/EM-DAT)
+flood_layers = sorted(f for f in os.listdir(flood_tif_folder) if f.startswith("DFO_") and f.endswith(".tif"))
+flood_paths = [os.path.join(flood_tif_folder, f) for f in flood_layers]
+flood_events = [events.parse_event_name(os.path.splitext(f)[0]) for f in flood_layers]
+
+if flood_paths:
+    cube.build_cube(flood_cube_folder, flood_paths, flood_events, raster.read_grid(flood_paths[0]))
+    print(f"Saved flood cube with {len(flood_events)} events: {flood_cube_folder}")
+else:
+    print(f"No DFO_* flood layers in {flood_tif_folder}. Skipping the flood cube")
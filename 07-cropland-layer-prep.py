@@ -30,6 +30,9 @@ moz_country_shapefile_geo = "MOZ_2017_country"
 # Folder with land cover layers 
 land_cover_folder = r"C:\Users\idabr\OneDrive - University of Southampton\05 Paper 1\02 Data\03 Flood\04 Land cover class\MODIS Land Cover MCD12 GEE"
 
+# Output - folder for GeoTIFF copies of the cropland layers (read by the NumPy exposure scripts)
+cropland_tif_folder = os.path.join(os.getcwd(), "results", "cropland_layers")
+
 # Environment settings #####################################
 
 # Set ArcGIS workspace to the ArcGIS geodatabase 
@@ -41,6 +44,9 @@ arcpy.env.extent = moz_country_shapefile_geo
 # Set condition value - cropland pixel values according to FAO-LCCS2 land use classification system
 remap = RemapValue([[25, 1], [35, 1], [36, 1]])
 
+# Create the GeoTIFF output folder
+os.makedirs(cropland_tif_folder, exist_ok=True)
+
 # Loop through nested folders
 for root, dirs, files in os.walk(land_cover_folder):
     for file in files:
@@ -57,4 +63,7 @@ for root, dirs, files in os.walk(land_cover_folder):
             raster_output = raster_name + "_cropland"
             Reclassify(masked_raster, "VALUE", remap, "NODATA").save(raster_output)
 
+            # Step 3: Save a GeoTIFF copy for 09-cropland-flooded.py
+            arcpy.management.CopyRaster(raster_output, os.path.join(cropland_tif_folder, raster_output + ".tif"))
+
             print(f"Saved: {raster_output}")
@@ -3,56 +3,74 @@
 # This script calculates the number of people affected in each flood event at the posto level 
 # (as well as a % of total posto population)
 
+# Zonal statistics are computed with NumPy (see the flood_exposure folder) instead of
+# arcpy.sa.ZonalStatisticsAsTable, so this script runs without an ArcGIS licence.
+
 # Import modules needed 
-import arcpy
 import os
-from arcpy import env
-from arcpy.sa import *
+import numpy as np
+from flood_exposure import hierarchy, manifest, parallel, pixel_index, raster, results, summary, zones
 
-#overwrite existing data. 
-arcpy.env.overwriteOutput = True 
+# Set global variables #####################################
 
-# Check out the ArcGIS Spatial Analyst extension license
-arcpy.CheckOutExtension("Spatial")
+# Results folder
+results_folder = "results"
 
-# Set global variables #####################################
-moz_des_flood_arcgis = r"C:\Users\idabr\OneDrive - University of Southampton\05 Paper 1\06 GIS\Descriptive_analysis_flood_poverty_Mozambique\Descriptive_analysis_flood_poverty_Mozambique.gdb"
+# Admin 3 shapefile for Mozambique - saved in the results folder by 02-shapefile-prepare.py
+moz_admin3_shp = os.path.join(results_folder, "moz_admin3_shp.shp")
 
-# Admin 3 shapefile for Mozambique 
-moz_admin3_shp = "moz_admin3_shp"
+# Code mapping (posto -> district -> province) - saved in the results folder by 02-shapefile-prepare.py.
+# Without it only the posto table is written
+admin_code_mapping = os.path.join(results_folder, "admin_code_mapping.csv")
 
 # Folder with population count layers 
 moz_pop_count_folder = r"C:\Users\idabr\OneDrive - University of Southampton\05 Paper 1\02 Data\04 WorldPop Population density\02 Population counts - unconstrained"
 
-# Output - admin 3 shapefile with population flooded stats
-adm3_pop_flooded_shp = "adm3_pop_flooded_shp"
+# Folder with flood layers - GeoTIFF copies saved by 06-flood-layer-prep.py
+moz_flood_folder = os.path.join(results_folder, "flood_layers")
 
-# Output - zonal statistics table with total population per posto
-adm3_total_pop_table = "adm3_total_pop_table"
+# Cache folder - posto label grids, shared with 09-cropland-flooded.py
+cache_folder = os.path.join(results_folder, "cache")
 
-# Output - raster with population flooded 
-moz_pop_flooded = "moz_pop_flooded"
+# Run folder - manifest of the events already computed and their results, so a rerun only
+# computes new or modified events
+run_folder = os.path.join(results_folder, "runs", "08-population-exposed")
 
-# Output - zonal statistics table with flooded population per posto
-adm3_pop_flood_table = "adm3_pop_flood_table"
+# Tile size (cells along each side) for streaming execution. None processes whole rasters;
+# a tile size (e.g. 2048) keeps peak memory bounded by the tile rather than the national grid
+tile_size = None
 
-# Results folder
-results_folder = "results"
+# Postos to compute - PA_ID values (from 02-shapefile-prepare.py), e.g. the postos of a province for a
+# rapid response. Only the pixels of these postos are read, through the posto pixel index
+# (flood_exposure/pixel_index.py), and only the posto table is written for them. None computes every posto
+zone_ids = None
+
+# Number of worker processes - the years are computed in parallel (None uses every core).
+# 1 runs everything in this process. More than 1 worker needs Linux (workers are forked)
+n_workers = 1
 
 # Output - table with posto-level flood exposure stats for each event
 adm3_pop_flooded_stats = "adm3_pop_flooded_stats.csv"
 
-# Environment settings #####################################
+# Outputs - the same table for districts (admin 2) and provinces (admin 1), rolled up from the postos
+adm2_pop_flooded_stats = "adm2_pop_flooded_stats.csv"
+adm1_pop_flooded_stats = "adm1_pop_flooded_stats.csv"
 
-# Set ArcGIS workspace to the ArcGIS geodatabase 
-env.workspace = moz_des_flood_arcgis
+# Extra summaries over windows of events - name -> optional (first, last) "years" and list of "sources"
+# ("GFD", "DFO", "EM-DAT"), e.g. {"GFD_2008_2017": {"years": (2008, 2017), "sources": ["GFD"]}}
+summary_windows = {}
 
-# Set extent to Mozambique
-arcpy.env.extent = moz_admin3_shp
+# Optional outputs - the same table as Parquet (needs pyarrow, e.g. "adm3_pop_flooded_stats.parquet")
+# and joined to the posto polygons (e.g. "adm3_pop_flooded.gpkg", not written with zone_ids). None skips them
+adm3_pop_flooded_parquet = None
+adm3_pop_flooded_layer = None
 
-# Flood layers - DFO_* file name. Flood layers are already in the geodatabase 
+# Load data #####################################
+
+# Flood layers - DFO_* file name
 # Create a list of raster names that start with "DFO_"
-raster_list = arcpy.ListRasters("DFO_*")
+raster_list = sorted(os.path.splitext(f)[0] for f in os.listdir(moz_flood_folder)
+                     if f.startswith("DFO_") and f.lower().endswith(".tif"))
 print(raster_list)
 
 # Check length of list - we should have 24 events 
@@ -66,260 +84,227 @@ pop_count_tif_files = [f for f in os.listdir(moz_pop_count_folder) if f.lower().
 for tif_file in pop_count_tif_files:
     print(tif_file)
 
-# Copy the admin 3 shapefile - this is where the population flooded stats will be stored
-arcpy.CopyFeatures_management(moz_admin3_shp, adm3_pop_flooded_shp)     
+# Read the admin 3 polygons - this is where the population flooded stats will be stored
+# Zone i + 1 in the label grid is posto i in the shapefile (its OBJECTID)
+adm3_geoms, adm3_records, adm3_crs = zones.read_zones(moz_admin3_shp)
+n_postos = len(adm3_geoms)
+
+# Attribute table of the output - one row per posto, with all the posto attributes
+adm3_pop_flooded = results.zone_table(adm3_records)
+
+# Zone labels of the postos to compute (None: every posto)
+selected_postos = None if zone_ids is None else pixel_index.zones_by_attribute(adm3_records, zone_ids)
 
 # First run - since we don't have the 2021 and 2022 population counts yet, drop flood events from those years 
 
 #raster_list = [r for r in raster_list if "From_2021" not in r and "From_2022" not in r]
 
-## LOOP THROUGH FLOOD EVENTS WILL START HERE   
-
-for raster in raster_list:
+## STEP 1: GATHER DATA ##
 
-    ## STEP 1: GATHER DATA ##
+# Group the flood events by year - all the events of a year use the same population raster,
+# so it only needs to be read once per year
+events_by_year = {}
 
-    # Loop through all flood events - start with just one flood raster 
-    flood_raster = raster
+for raster_name in raster_list:
 
     # Extract the start date of the flood event (year) - this will always be 4 digits after "From_" in the file name
-    flood_year = flood_raster.split("From_")[1][:4]
-
-    # Get flood event ID  
-    flood_event_id =  "DFO_" + flood_raster.split("_")[1]
-
-    # Get the population count raster that matches the year of the flood
-    pop_count_raster = os.path.join(moz_pop_count_folder, "moz_ppp_" + flood_year + ".tif")
-
-    ## STEP 2: ALIGN SPATIAL REFERENCE ##
-
-    # Check spatial reference of the population count and flood data - it should be WGS 1984  
-
-    # Flood layer
-    ref1 = arcpy.Describe(flood_raster).SpatialReference
-    print(ref1)
-
-    # Population count layer 
-    ref2 = arcpy.Describe(pop_count_raster).SpatialReference
-
-    if ref1.Name == ref2.Name:
-        print("Spatial refernce aligned between flood and population data. Continuing loop...")
-    else:
-        print("Spatial reference not aligned. Flood event " + flood_event_id)
-        continue # move on to the next flood
-
-    ## STEP 3: ALIGN SPATIAL RESOLUTION ##
-
-    # Resample the flood layer to the spatial resolution of population count data - using nearest neighbour 
-
-    # Get the cell size of the population count raster 
-    pop_count_cell_size = arcpy.Describe(pop_count_raster).meanCellWidth
-    print(pop_count_cell_size)
-
-    # Output to store the resampled flood raster 
-    flood_raster_resample = flood_raster + "_resampled"
-
-    # Resample flood layer to 100m spatial resolution using nearest neighbour
-    arcpy.management.Resample(flood_raster, flood_raster_resample, cell_size=pop_count_cell_size, resampling_type="NEAREST")
-
-    ## STEP 4: ZONAL STATS ##
-
-    # Zonal statistics as table - count all the pixels from population data per posto (SUM)
-    # This will give the total population in each posto - base for calculating the % of population flooded 
-    arcpy.sa.ZonalStatisticsAsTable(adm3_pop_flooded_shp, "OBJECTID", pop_count_raster, adm3_total_pop_table, "DATA", "SUM")
-
-    # Clean up table - round to the closest integer 
-
-    # Field to round (overwrite)
-    field_to_round = "SUM"
-
-    # Use CalculateField to round in place
-    arcpy.CalculateField_management(
-        in_table=adm3_total_pop_table,
-        field=field_to_round,
-        expression="round(!{}!)".format(field_to_round),
-        expression_type="PYTHON3"
-    )
-
-    # Join this table to the shapefile - keep only SUM column
-    # Define the fields of the join
-    shapefile_id_field = "OBJECTID"  # This is the unique ID field in the shapefile
-    table_id_field = "OBJECTID_1"   # This is the ID field in the Zonal Statistics table that corresponds to the shapefile ID
-
-    # Define the fields to join from the table
-    fields_to_join = ["SUM"] 
-
-    # Add the join
-    arcpy.management.JoinField(adm3_pop_flooded_shp, shapefile_id_field, adm3_total_pop_table, table_id_field, fields_to_join)
-
-    # Delete the table 
-    arcpy.Delete_management(adm3_total_pop_table)
-
-    # Mask the population count layer with the flood layer - get only flooded population 
-    raster_masked = ExtractByMask(pop_count_raster, flood_raster_resample)
-    raster_masked.save(moz_pop_flooded)
-
-    # Delete the resampled raster 
-    arcpy.Delete_management(flood_raster_resample)
+    flood_year = raster_name.split("From_")[1][:4]
+    events_by_year.setdefault(flood_year, []).append(raster_name)
 
-    # Zonal statistics as table - get the number of people flooded in each posto (SUM)
-    arcpy.sa.ZonalStatisticsAsTable(adm3_pop_flooded_shp, "OBJECTID", moz_pop_flooded, adm3_pop_flood_table, "DATA", "SUM")
+# Population total and flooded per posto for each event
+event_results = {}
 
-    # Field to round (overwrite)
-    field_to_round = "SUM"
+# Manifest of the previous runs
+run_manifest = manifest.open_manifest(run_folder)
 
-    # Use CalculateField to round in place
-    arcpy.CalculateField_management(
-        in_table=adm3_pop_flood_table,
-        field=field_to_round,
-        expression="round(!{}!)".format(field_to_round),
-        expression_type="PYTHON3"
-    )
+# Settings that change the results of an event - results computed with other settings are not reused
+event_params = {"stat": "population"}
+if selected_postos is not None:
+    event_params["postos"] = sorted(selected_postos)
 
-    # Rename the field 
-    old_field_name = "SUM" 
-    new_field_name = "Pop_Flood_" + flood_event_id 
+# Work still to do - one task per year - and the posto label grids it needs (one per population grid)
+year_tasks = []
+zone_grids = {}
+event_hashes = {}
 
-    # Rename the field (and alias)
-    arcpy.management.AlterField(adm3_pop_flood_table, old_field_name, new_field_name, new_field_alias=new_field_name)
+## LOOP THROUGH YEARS WILL START HERE
 
-    # Join back with the admin 3 shapefile - keep only the population flooded field
-    # Define the fields to join from the table
-    fields_to_join = [new_field_name] 
+for flood_year, year_rasters in events_by_year.items():
 
-    # Add the join
-    arcpy.management.JoinField(adm3_pop_flooded_shp, shapefile_id_field, adm3_pop_flood_table, table_id_field, fields_to_join)
-
-    # Remove the table 
-    arcpy.Delete_management(adm3_pop_flood_table)
-
-    # Clean up the population flooded field - replace missings with 0s 
-    expression = "0 if !" + new_field_name + "! is None else !" + new_field_name + "!"  
-
-    # Run the Field Calculator
-    arcpy.management.CalculateField(adm3_pop_flooded_shp, new_field_name, expression, "PYTHON3")
-
-    # Now calculate the proportion of population flooded in each posto 
-    new_field = "Pct_P_Flood_" + flood_event_id
-
-    # Add a new field to hold the percentage (as double)
-    arcpy.AddField_management(adm3_pop_flooded_shp, new_field, "DOUBLE")  
-
-    # Calculate the percentage (rounded to two decimal points)
-    expression = "round((!" + new_field_name + "! / !SUM!) * 100, 2)"  
-
-    arcpy.CalculateField_management(
-        in_table=adm3_pop_flooded_shp,
-        field=new_field,
-        expression=expression,
-        expression_type="PYTHON3"
-    )
-
-    # Delete the SUM field
-    arcpy.DeleteField_management(adm3_pop_flooded_shp, "SUM")
-
-
-
-# Aggregate table to get total number of people flooded between 2008-2020
-# Note: waiting for WorldPop population count data for 2021 and 2022
-
-# Identify fields with "Pop" in the name
-fields = arcpy.ListFields(adm3_pop_flooded_shp)
-pop_fields = [f.name for f in fields if "Pop" in f.name]
-
-# New field name
-popsum_field = "Pop_Flood_2008_2020"
-
-# Add a new field which will store the sum the total number of people flooded 2008-2022
-arcpy.AddField_management(adm3_pop_flooded_shp, popsum_field, "DOUBLE")
-
-# Build the expression: sum of all pop fields
-expression = " + ".join([f"!{f}!" for f in pop_fields])
-
-# Run the calculation
-arcpy.CalculateField_management(
-    in_table=adm3_pop_flooded_shp,
-    field=popsum_field,
-    expression=expression,
-    expression_type="PYTHON3"
-)
-
-# Field for number of flood events (which had any impact on the population)
-num_flood_field = "num_floods"
-
-# Create column for number of flood events 
-arcpy.AddField_management(adm3_pop_flooded_shp, num_flood_field, "DOUBLE", field_alias="Number of floods")
-
-# Count the number of "Pop" columns that are non-zero
-# Columns are already save in the pop_fields list
-expression = "sum([1 for x in [{}] if x and x > 0])".format(
-    ", ".join([f"!{f}!" for f in pop_fields])
-)
-
-# Run the calculation
-arcpy.CalculateField_management(
-    in_table=adm3_pop_flooded_shp,
-    field=num_flood_field,
-    expression=expression,
-    expression_type="PYTHON3"
-)
-
-# Get average number of people flooded in a flood event
-# Calculate this by diving the total number of people flooded between 2008-2020 by the number of floods in this period 
-
-# Field for average area flooded
-avg_pop_flood_field = "avg_pop_flood_2008_2020"
-
-# Create the field
-arcpy.AddField_management(adm3_pop_flooded_shp, avg_pop_flood_field, "DOUBLE", field_alias="Avg no people flooded 2008-20")
-
-# Expression - total number of people flooded between 2008-2020 over the number of floods in this period 
-# Round to the closest integer 
-expression = f"round(!{popsum_field}! / !{num_flood_field}!)"
-
-# Run the calculation
-arcpy.CalculateField_management(
-    in_table=adm3_pop_flooded_shp,
-    field=avg_pop_flood_field,
-    expression=expression,
-    expression_type="PYTHON3"
-)
-
-# Replace NA values with 0s 
-expression = "0 if !" + avg_pop_flood_field + "! is None else !" + avg_pop_flood_field + "!"  
-
-# Run the Field Calculator
-arcpy.management.CalculateField(adm3_pop_flooded_shp, avg_pop_flood_field, expression, "PYTHON3")
-
-# Final statistic - average % of population flooded between 2008-2020
-
-# Name of the field 
-avg_prop_pop_flood_field = "avg_p_pop_flood_2008_2020"
-
-# Create the field
-arcpy.AddField_management(adm3_pop_flooded_shp, avg_prop_pop_flood_field, "DOUBLE", field_alias="Avg % pop flooded 2008-20")
-
-# Expression - average of the % of population flooded across all flood events 
-
-# Get the column names that have % of population flooded
-pop_prop_fields = [f.name for f in fields if "Pct_P" in f.name]
-
-# Turn into an expression
-field_expression = ", ".join([f"!{field}!" for field in pop_prop_fields])
-
-# Generate the expression for averaging non-zero proportions 
-# Round to two decimal points 
-expression = f"""
-round(sum(v for v in [{field_expression}] if v is not None and v > 0) / (!num_floods! if !num_floods! > 0 else 1), 2)
-"""
-# Calculate field
-arcpy.CalculateField_management(
-    in_table=adm3_pop_flooded_shp,
-    field=avg_prop_pop_flood_field,
-    expression=expression,
-    expression_type="PYTHON3"
-)
+    # Get the population count raster that matches the year of the flood
+    pop_count_raster = os.path.join(moz_pop_count_folder, "moz_ppp_" + flood_year + ".tif")
+    pop_grid = raster.read_grid(pop_count_raster)
 
-# Export table 
-arcpy.conversion.ExportTable(adm3_pop_flooded_shp, os.path.join(results_folder, adm3_pop_flooded_stats))
+    ## STEP 2: ALIGN SPATIAL REFERENCE ##
 
+    # Check spatial reference of the population count and flood data - it should be WGS 1984  
+    flood_rasters = []
+
+    for raster_name in year_rasters:
+        flood_raster = os.path.join(moz_flood_folder, raster_name + ".tif")
+        flood_grid = raster.read_grid(flood_raster)
+        print(flood_grid.crs)
+
+        if raster.same_crs(flood_grid.crs, pop_grid.crs):
+            print("Spatial refernce aligned between flood and population data. Continuing loop...")
+            flood_rasters.append(raster_name)
+        else:
+            print("Spatial reference not aligned. Flood event " + "DFO_" + raster_name.split("_")[1])
+            continue # move on to the next flood
+
+    # Skip the events whose inputs (flood raster, population raster, postos) have not changed since
+    # the last run - their results are read from the run folder
+    to_compute = []
+
+    for raster_name in flood_rasters:
+        flood_raster = os.path.join(moz_flood_folder, raster_name + ".tif")
+        flood_event_id = "DFO_" + raster_name.split("_")[1]
+        event_hashes[raster_name] = manifest.event_hash([flood_raster, pop_count_raster], moz_admin3_shp,
+                                                        event_params)
+        stored = manifest.load_result(run_manifest, flood_event_id, event_hashes[raster_name])
+        if stored is not None:
+            print("Flood event " + flood_event_id + " unchanged since the last run. Skipping...")
+            event_results[raster_name] = (stored["total"], stored["flooded"])
+        else:
+            to_compute.append(raster_name)
+
+    if not to_compute:
+        continue
+
+    # Posto label grid on the population grid - rasterised once and then read from the cache. For a few
+    # postos, their pixel index is built (once, in the cache) instead and the label grid is not shared
+    zones_name = "zones_" + raster.grid_key(pop_grid)
+    if selected_postos is not None:
+        pixel_index.pixel_index(moz_admin3_shp, pop_grid, cache_folder)
+    elif zones_name not in zone_grids:
+        zone_grids[zones_name] = zones.zone_labels(moz_admin3_shp, pop_grid, cache_folder)
+
+    year_tasks.append({"zones": zones_name, "value_path": pop_count_raster,
+                       "flood_paths": [os.path.join(moz_flood_folder, r + ".tif") for r in to_compute],
+                       "grid": pop_grid, "n_zones": n_postos, "tile_size": tile_size,
+                       "events": to_compute, "postos": selected_postos, "shapefile": moz_admin3_shp,
+                       "cache_folder": cache_folder})
+
+## STEP 3: ALIGN SPATIAL RESOLUTION AND ZONAL STATS ##
+
+# Resample the flood layers to the grid of the population count data (100m) - using nearest neighbour -
+# and stack them as bit planes (one bit per event). Resampling goes through an index map between the
+# flood and population grids, computed once and reused for every event. Nothing is written to disk.
+# Then get the total population in each posto (SUM) - base for calculating the % of population flooded -
+# and the number of people flooded in each posto for every event (SUM of population masked by the flood layer).
+# All of this comes from the same pass over the population raster.
+# With a tile size, the pass streams through the grid tile by tile and merges the partial sums.
+# The years are independent, so they are spread over the worker processes; the posto label grids are
+# shared with the workers instead of being copied to each of them.
+
+# Keep the results of each year as soon as it is done - in memory for the table and in the run folder
+# for the next run
+def store_year(task, result):
+    total_pop, flooded_pops = result
+    for raster_name, flooded_pop in zip(task["events"], flooded_pops):
+        event_results[raster_name] = (total_pop, flooded_pop)
+        manifest.save_result(run_manifest, "DFO_" + raster_name.split("_")[1], event_hashes[raster_name],
+                             {"total": total_pop, "flooded": flooded_pop})
+    print("Computed the flood events of " + os.path.basename(task["value_path"]))
+
+year_task = parallel.population_year_task if selected_postos is None else parallel.pixel_index_task
+parallel.run_parallel(year_task, year_tasks, zone_grids, n_workers, store_year)
+
+## STEP 4: STORE RESULTS ##
+
+# Output tables - the postos, and the districts and provinces they roll up to. The district and
+# province results add up the posto sums of the same zonal statistics (no raster is read again)
+admin_tables = [(adm3_pop_flooded, None, n_postos, adm3_pop_flooded_stats)]
+
+# Only the selected postos - their rows of the table and of the zonal statistics. The districts and
+# provinces would only be partly covered, so they are not written
+if selected_postos is not None:
+    rows = np.array(selected_postos) - 1
+    adm3_pop_flooded = results.select_rows(adm3_pop_flooded, rows)
+    event_results = {raster_name: tuple(results.select_rows(stats, rows) for stats in event_result)
+                     for raster_name, event_result in event_results.items()}
+    admin_tables = [(adm3_pop_flooded, None, len(rows), adm3_pop_flooded_stats)]
+
+elif os.path.exists(admin_code_mapping):
+    code_mapping = hierarchy.read_code_mapping(admin_code_mapping)
+    for (code_field, name_field), output in [(("ID_DIST", "Distrito"), adm2_pop_flooded_stats),
+                                             (("CodProv", "Provincia"), adm1_pop_flooded_stats)]:
+        admin_units, parents = hierarchy.parent_units(adm3_pop_flooded["PA_ID"], code_mapping,
+                                                      "PA_ID", code_field, name_field)
+        admin_tables.append((admin_units, parents, len(admin_units[code_field]), output))
+
+computed_events = [r for r in raster_list if r in event_results]
+
+for admin_table, parents, n_units, output in admin_tables:
+
+    # Results of all events in one (unit x event x metric) matrix - the table is only built at the end
+    pop_matrix = results.result_matrix(n_units, ["DFO_" + r.split("_")[1] for r in computed_events],
+                                       ["Pop_Flood", "Pct_P_Flood"])
+
+    for raster_name in computed_events:
+        total_pop, flooded_pop = event_results[raster_name]
+
+        # Districts / provinces - add up the sums of their postos. The % below is then the rolled-up
+        # number of people flooded over the rolled-up population, not an average of posto %
+        if parents is not None:
+            total_pop = hierarchy.roll_up(total_pop, parents, n_units)
+            flooded_pop = hierarchy.roll_up(flooded_pop, parents, n_units)
+
+        # Get flood event ID
+        flood_event_id =  "DFO_" + raster_name.split("_")[1]
+
+        # Clean up - round to the closest integer. Postos without population data get no total (as
+        # ZonalStatisticsAsTable leaves them out) and 0 people flooded
+        has_data = total_pop["COUNT"] > 0
+        pop_total = np.where(has_data, np.round(total_pop["SUM"]), np.nan)
+        pop_flood = np.where(has_data, np.round(flooded_pop["SUM"]), 0)
+
+        # Store the number of people flooded
+        results.set_result(pop_matrix, flood_event_id, "Pop_Flood", pop_flood)
+
+        # Now calculate the proportion of population flooded in each unit (rounded to two decimal points)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            pct_pop_flood = np.round(pop_flood / np.where(pop_total > 0, pop_total, np.nan) * 100, 2)
+        results.set_result(pop_matrix, flood_event_id, "Pct_P_Flood", pct_pop_flood)
+
+    # Add the columns in the order of the flood events - Pop_Flood_<event ID> and Pct_P_Flood_<event ID>
+    admin_table.update(results.wide_columns(pop_matrix))
+
+    # Aggregate table to get total number of people flooded between 2008-2020
+    # Note: waiting for WorldPop population count data for 2021 and 2022
+
+    # Sums, counts and averages over the event axis of the result matrix, for all units at once
+    pop_summary = summary.summarise(pop_matrix, "Pop_Flood", "Pct_P_Flood")
+
+    # Total number of people flooded 2008-2020
+    admin_table["Pop_Flood_2008_2020"] = pop_summary["total"]
+
+    # Number of flood events (which had any impact on the population)
+    admin_table["num_floods"] = pop_summary["num_floods"]
+
+    # Average number of people flooded in a flood event - total number of people flooded
+    # between 2008-2020 over the number of floods in this period. Round to the closest integer
+    admin_table["avg_pop_flood_2008_2020"] = pop_summary["avg"]
+
+    # Average % of population flooded across all flood events (non-zero proportions)
+    # Round to two decimal points
+    admin_table["avg_p_pop_flood_2008_2020"] = pop_summary["avg_pct"]
+
+    # The same for each window of events in summary_windows - no zonal statistics are re-run
+    for window_name, window in summary_windows.items():
+        selected = summary.event_window(computed_events, window.get("years"), window.get("sources"))
+        window_summary = summary.summarise(pop_matrix, "Pop_Flood", "Pct_P_Flood", selected)
+        admin_table["Pop_Flood_" + window_name] = window_summary["total"]
+        admin_table["num_floods_" + window_name] = window_summary["num_floods"]
+        admin_table["avg_pop_flood_" + window_name] = window_summary["avg"]
+        admin_table["avg_p_pop_flood_" + window_name] = window_summary["avg_pct"]
+
+    # Export table - written once, at the end
+    results.write_csv(os.path.join(results_folder, output), admin_table)
+
+if adm3_pop_flooded_parquet:
+    results.write_parquet(os.path.join(results_folder, adm3_pop_flooded_parquet), adm3_pop_flooded)
+
+# Join the table to the posto polygons - a single join of all the columns (every posto only)
+if adm3_pop_flooded_layer and selected_postos is None:
+    results.join_zones(moz_admin3_shp, os.path.join(results_folder, adm3_pop_flooded_layer), adm3_pop_flooded)
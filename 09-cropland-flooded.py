@@ -3,384 +3,348 @@
 # This script calculates the area of cropland flooded in each flood event at the posto level 
 # (as well as a % of total posto cropland that was flooded)
 
+# Zonal statistics are computed with NumPy (see the flood_exposure folder) instead of
+# arcpy.sa.ZonalStatisticsAsTable, so this script runs without an ArcGIS licence.
+
 # Import modules needed 
-import arcpy
 import os
-from arcpy import env
-from arcpy.sa import *
-
-#overwrite existing data. 
-arcpy.env.overwriteOutput = True 
-
-# Check out the ArcGIS Spatial Analyst extension license
-arcpy.CheckOutExtension("Spatial")
+import numpy as np
+from flood_exposure import (baseline, cell_area, coverage, hierarchy, manifest, parallel, parity, pixel_index, raster,
+                            results, summary, zones)
 
 # Set global variables #####################################
-moz_des_flood_arcgis = r"C:\Users\idabr\OneDrive - University of Southampton\05 Paper 1\06 GIS\Descriptive_analysis_flood_poverty_Mozambique\Descriptive_analysis_flood_poverty_Mozambique.gdb"
-
-# Admin 3 shapefile for Mozambique 
-moz_admin3_shp = "moz_admin3_shp"
-
-# Output - admin 3 shapefile with cropland flooded stats 
-adm3_crop_flooded_shp = "adm3_crop_flooded_shp"
-
-# Output - reprojected admin 3 shapefile
-adm3_crop_flooded_shp_proj = "adm3_crop_flooded_shp_proj"
 
 # Results folder
 results_folder = "results"
 
-# Output - csv table with posto-level cropland flooded stats
-adm3_crop_flooded_table = "adm3_crop_flooded_table.csv"
-
-# Environment settings #####################################
-
-# Set ArcGIS workspace to the ArcGIS geodatabase 
-env.workspace = moz_des_flood_arcgis
-
-# Set extent to Mozambique
-arcpy.env.extent = moz_admin3_shp
-
-# Flood layers - DFO_* file name. Flood layers are already in the geodatabase 
-# Create a list of raster names that start with "DFO_"
-raster_list = arcpy.ListRasters("DFO_*")
-print(raster_list)
-
-# Check length of list - we should have 24 events 
-length_list = len(raster_list)
-print(length_list)
-
-# Copy the admin 3 shapefile - this is where the cropland flooded stats will be stored
-arcpy.CopyFeatures_management(moz_admin3_shp, adm3_crop_flooded_shp) 
-
-# Load the WKT2 text for Lambert Azim Mozambique from: https://epsg.io/42106
-wkt2 = """
-PROJCRS["WGS84_/_Lambert_Azim_Mozambique",
-    BASEGEOGCRS["unknown",
-        DATUM["Unknown based on Normal Sphere (r=6370997) ellipsoid",
-            ELLIPSOID["Normal Sphere (r=6370997)",6370997,0,
-                LENGTHUNIT["metre",1]]],
-        PRIMEM["Greenwich",0,
-            ANGLEUNIT["degree",0.0174532925199433]]],
-    CONVERSION["unknown",
-        METHOD["Lambert Azimuthal Equal Area (Spherical)",
-            ID["EPSG",1027]],
-        PARAMETER["Latitude of natural origin",5,
-            ANGLEUNIT["degree",0.0174532925199433],
-            ID["EPSG",8801]],
-        PARAMETER["Longitude of natural origin",20,
-            ANGLEUNIT["degree",0.0174532925199433],
-            ID["EPSG",8802]],
-        PARAMETER["False easting",0,
-            LENGTHUNIT["metre",1],
-            ID["EPSG",8806]],
-        PARAMETER["False northing",0,
-            LENGTHUNIT["metre",1],
-            ID["EPSG",8807]]],
-    CS[Cartesian,2],
-        AXIS["(E)",east,
-            ORDER[1],
-            LENGTHUNIT["metre",1]],
-        AXIS["(N)",north,
-            ORDER[2],
-            LENGTHUNIT["metre",1]],
-    ID["EPSG",42106]]
-"""
-
-# Create a SpatialReference object from the WKT2 string
-spatial_ref = arcpy.SpatialReference(text=wkt2)
-
-# Reproject the shapefile to Lambert Azim Mozambique - to be consistent with rasters
-arcpy.management.Project(adm3_crop_flooded_shp, adm3_crop_flooded_shp_proj, spatial_ref)
-
-# Delete the old shapefile 
-arcpy.Delete_management(adm3_crop_flooded_shp)
-
-### LOOP STARTS HERE ###
-
-for raster in raster_list:
-
-    ## STEP 1: LOAD DATA ##
-
-    # Loop through all flood events - start with just one flood raster 
-    flood_raster = raster
-
-    # Extract the start date of the flood event (year) - this will always be 4 digits after "From_" in the file name
-    flood_year = flood_raster.split("From_")[1][:4]
-
-    # Get flood event ID  
-    flood_event_id =  "DFO_" + flood_raster.split("_")[1]
-
-    # Get the MODIS cropland raster which matches the year of the flood - already in the geodatabase
-    cropland_raster = "MODIS_Land_Cover_" + flood_year + "_cropland"
-
-    # Check where we are  
-    print("-------------------------------------------------")
-    print("Gathered the data. Processing flood event " + flood_event_id)
-
-    ## STEP 2: ALIGN SPATIAL REFERENCE ##
-
-    # Change spatial reference to equal-area projection. This is to be able to calculate area in ha 
-
-    # Check spatial reference - both rasters are likely in WGS 1984 
-
-    # Cropland raster 
-    ref1 = arcpy.Describe(cropland_raster).SpatialReference
-
-    # Flood raster
-    ref2 = arcpy.Describe(flood_raster).SpatialReference
-
-    # Output - cropland raster reprojected 
-    cropland_raster_proj = cropland_raster + "_proj"
-
-    # Reproject the raster
-    arcpy.management.ProjectRaster(cropland_raster, cropland_raster_proj, spatial_ref)
-
-    # Output - flood raster reprojected
-    flood_raster_proj = flood_raster + "_proj"
-
-    # Reproject the raster
-    arcpy.management.ProjectRaster(flood_raster, flood_raster_proj, spatial_ref)
-    print("Aligned spatial reference")
-
-    ## STEP 3: ALIGN SPATIAL RESOLUTION ##
-
-    # Resample the cropland data from 500m to the spatial resolution of the flood data (250m) - using nearest neighbour
- 
-    # Get the cell size of the flood  raster 
-    flood_cell_size = arcpy.Describe(flood_raster_proj).meanCellWidth
+# Admin 3 shapefile for Mozambique - saved in the results folder by 02-shapefile-prepare.py
+moz_admin3_shp = os.path.join(results_folder, "moz_admin3_shp.shp")
 
-    # Output to store the resampled cropland raster 
-    cropland_raster_resample = cropland_raster_proj + "_resampled"
+# Code mapping (posto -> district -> province) - saved in the results folder by 02-shapefile-prepare.py.
+# Without it only the posto table is written
+admin_code_mapping = os.path.join(results_folder, "admin_code_mapping.csv")
 
-    # Resample flood layer to 100m spatial resolution using nearest neighbour
-    arcpy.management.Resample(cropland_raster_proj, cropland_raster_resample, cell_size=flood_cell_size, resampling_type="NEAREST")
-    print("Aligned spatial resolution")
+# Folder with flood layers - GeoTIFF copies saved by 06-flood-layer-prep.py
+moz_flood_folder = os.path.join(results_folder, "flood_layers")
 
-    ## STEP 4: MASK CROPLAND USING FLOOD LAYER ##
+# Folder with cropland layers - GeoTIFF copies saved by 07-cropland-layer-prep.py
+moz_cropland_folder = os.path.join(results_folder, "cropland_layers")
 
-    # Output - cropland flooded raster
-    cropland_flooded = cropland_raster_resample + "_flood"
+# Cache folder - posto label grids, shared with 08-population-exposed.py
+cache_folder = os.path.join(results_folder, "cache")
 
-    # Extract by mask - using the flood layer. Get flooded cropland.
-    raster_masked = ExtractByMask(cropland_raster_resample, flood_raster_proj)
-    raster_masked.save(cropland_flooded)
-    print("Masked the cropland layer using flood data")
+# Run folder - manifest of the events already computed and their results, so a rerun only
+# computes new or modified events
+run_folder = os.path.join(results_folder, "runs", "09-cropland-flooded")
 
-    ## STEP 5: ZONAL STATS ##
+# Tile size (cells along each side) for streaming execution. None processes whole rasters;
+# a tile size (e.g. 2048) keeps peak memory bounded by the tile rather than the national grid
+tile_size = None
 
-    # First get the total amount of cropland (ha) in each posto
+# Exact coverage - True weights every cell by the fraction of it that each posto covers (see
+# flood_exposure/coverage.py) instead of giving it to the posto of its centre, as ZonalStatisticsAsTable
+# does. Border cells of small (urban) postos are then counted accurately, but the totals no longer match
+# the arcpy tables exactly. With a tile size the layers are streamed in bands of that many rows
+exact_coverage = False
 
-    # Cropland pixels are coded as values of 1 in the raster. 
-    # Using the "SUM" function in zonal stats will get the total number of cropland pixels in a posto.
-    # "SUM" also automatically calculates AREA - using exact pixel size (rather than average). 
-    # Output is in m2. I can convert units to ha (1 ha = 10,000 m2). 
+# Postos to compute - PA_ID values (from 02-shapefile-prepare.py), e.g. the postos of a province for a
+# rapid response. Only the pixels of these postos are read, through the posto pixel index
+# (flood_exposure/pixel_index.py, cell centres - exact_coverage is not used), and only the posto table
+# is written for them. None computes every posto
+zone_ids = None
 
-    # Output - table with total number of cropland pixels
-    adm3_total_crop_table = "adm3_total_crop_table"
+# Number of worker processes - the years and events are computed in parallel (None uses every core).
+# 1 runs everything in this process. More than 1 worker needs Linux (workers are forked)
+n_workers = 1
 
-    # Calculate sum of cropland pixels using zonal stats 
-    arcpy.sa.ZonalStatisticsAsTable(adm3_crop_flooded_shp_proj, "OBJECTID", cropland_raster_resample, adm3_total_crop_table, "DATA", "SUM")
-
-    # Clean up the table - divide the m2 by 10,000 to get hectares and round the "AREA" column to the closest integer
-
-    # Field to round (overwrite)
-    field_to_round = "AREA"
-
-    # Use CalculateField to round in place
-    arcpy.CalculateField_management(
-        in_table=adm3_total_crop_table,
-        field=field_to_round,
-        expression=f"round(!{field_to_round}! / 10000)",
-        expression_type="PYTHON3"
-    )
-
-    # Merge back to the shapefile (this is a temporary column, which will be deleted once we get % of cropland flooded)
-   
-    # Define the fields of the join
-    shapefile_id_field = "OBJECTID"  # This is the unique ID field in the shapefile
-    table_id_field = "OBJECTID_1"   # This is the ID field in the Zonal Statistics table that corresponds to the shapefile ID
-
-    # Define the fields to join from the table
-    fields_to_join = ["AREA"] 
-
-    # Add the join
-    arcpy.management.JoinField(adm3_crop_flooded_shp_proj, shapefile_id_field, adm3_total_crop_table, table_id_field, fields_to_join)
-
-    # Calculate the area of cropland flooded 
-
-    # Output - table with total number of cropland flooded pixels
-    adm3_total_crop_flood_table = "adm3_total_crop_flood_table"
-
-    # Calculate sum of cropland pixels using zonal stats 
-    arcpy.sa.ZonalStatisticsAsTable(adm3_crop_flooded_shp_proj, "OBJECTID", cropland_flooded, adm3_total_crop_flood_table, "DATA", "SUM")
-
-    # Calculate the area of cropland flooded in ha and round to the closest integer 
-    arcpy.CalculateField_management(
-        in_table=adm3_total_crop_flood_table,
-        field=field_to_round,
-        expression=f"round(!{field_to_round}! / 10000)",
-        expression_type="PYTHON3"
-    )
-
-    # Clean up variable name - to reflect ha 
-    # Rename the field 
-    old_field_name = "AREA" 
-    new_field_name = "Crop_Flood_ha_" + flood_event_id 
-
-    # Rename the field (and alias)
-    arcpy.management.AlterField(adm3_total_crop_flood_table, old_field_name, new_field_name, new_field_alias=new_field_name)
-
-    # Join back with the shapefile
-    arcpy.management.JoinField(adm3_crop_flooded_shp_proj, shapefile_id_field, adm3_total_crop_flood_table, table_id_field, new_field_name)
-
-    # Delete unnecessary layers 
-
-    # List of files to delete
-    files_to_delete = [
-        adm3_total_crop_flood_table,
-        cropland_flooded,
-        cropland_raster_resample,
-        flood_raster_proj,
-        cropland_raster_proj,
-        adm3_total_crop_table
-    ]
-
-    for file in files_to_delete:
-        arcpy.Delete_management(file)
-
-    # Calculate proportion of cropland flooded in each posto
-    new_field = "Pct_C_Flood_" + flood_event_id
-
-    # Add a new field to hold the percentage (as double)
-    arcpy.AddField_management(adm3_crop_flooded_shp_proj, new_field, "DOUBLE")  
-
-    # Calculate the percentage (rounded to two decimal points)
-    expression = "round((!" + new_field_name + "! / !AREA!) * 100, 2)"  
-
-    arcpy.CalculateField_management(
-        in_table=adm3_crop_flooded_shp_proj,
-        field=new_field,
-        expression=expression,
-        expression_type="PYTHON3"
-    )
-
-    # Delete the AREA field 
-    arcpy.DeleteField_management(adm3_crop_flooded_shp_proj, "AREA")
-
-    # Replace NA values with 0s 
-    expression = "0 if !" + new_field_name + "! is None else !" + new_field_name + "!"  
-
-    # Run the Field Calculator
-    arcpy.management.CalculateField(adm3_crop_flooded_shp_proj, new_field_name, expression, "PYTHON3")
-
-    # The same for the area (in ha)
-    expression = "0 if !" + new_field + "! is None else !" + new_field + "!"  
-
-    # Run the Field Calculator
-    arcpy.management.CalculateField(adm3_crop_flooded_shp_proj, new_field, expression, "PYTHON3")
-
-# Aggregate table to get total area of cropland flooded between 2008-2022 - or average per flood event?
-# Get another table which is at the country-year level. Trends over time (this could be done in R)
-
-# Identify fields with "Crop" in the name
-fields = arcpy.ListFields(adm3_crop_flooded_shp_proj)
-crop_fields = [f.name for f in fields if "Crop" in f.name]
-
-# New field name
-cropsum_field = "Crop_Flood_ha_2008_2022"
-
-# Add a new field which will store the sum the total area of cropland flooded 2008-2022
-arcpy.AddField_management(adm3_crop_flooded_shp_proj, cropsum_field, "DOUBLE")
-
-# Build the expression: sum of all crop fields
-expression = " + ".join([f"!{f}!" for f in crop_fields])
+# Output - csv table with posto-level cropland flooded stats
+adm3_crop_flooded_table = "adm3_crop_flooded_table.csv"
 
-# Run the calculation
-arcpy.CalculateField_management(
-    in_table=adm3_crop_flooded_shp_proj,
-    field=cropsum_field,
-    expression=expression,
-    expression_type="PYTHON3"
-)
+# Outputs - the same table for districts (admin 2) and provinces (admin 1), rolled up from the postos
+adm2_crop_flooded_table = "adm2_crop_flooded_table.csv"
+adm1_crop_flooded_table = "adm1_crop_flooded_table.csv"
 
-# Field for number of flood events
-num_flood_field = "num_floods"
+# Extra summaries over windows of events - name -> optional (first, last) "years" and list of "sources"
+# ("GFD", "DFO", "EM-DAT"), e.g. {"DFO_EMDAT_2018_2022": {"years": (2018, 2022), "sources": ["DFO", "EM-DAT"]}}
+summary_windows = {}
 
-# Create column for number of flood events 
-arcpy.AddField_management(adm3_crop_flooded_shp_proj, num_flood_field, "DOUBLE", field_alias="Number of floods")
+# Optional outputs - the same table as Parquet (needs pyarrow, e.g. "adm3_crop_flooded_table.parquet")
+# and joined to the posto polygons (e.g. "adm3_crop_flooded.gpkg", not written with zone_ids). None skips them
+adm3_crop_flooded_parquet = None
+adm3_crop_flooded_layer = None
 
-# Count the number of "Crop_Flood_ha_DFO" columns that are non-zero
-# Columns are already save in the crop_fields list
-expression = "sum([1 for x in [{}] if x and x > 0])".format(
-    ", ".join([f"!{f}!" for f in crop_fields])
-)
+# Optional parity check - the posto table written by the arcpy version of this script for the same events
+# (e.g. "adm3_crop_flooded_table_arcpy.csv" in the results folder). None skips it
+adm3_crop_flooded_arcpy_table = None
 
-# Run the calculation
-arcpy.CalculateField_management(
-    in_table=adm3_crop_flooded_shp_proj,
-    field=num_flood_field,
-    expression=expression,
-    expression_type="PYTHON3"
-)
+# Load data #####################################
 
-# Get average area of cropland flooded in a flood event
-# Calculate this by diving the total area of cropland flooded between 2008-2022 by the number of floods in this period 
+# Flood layers - DFO_* file name
+# Create a list of raster names that start with "DFO_"
+raster_list = sorted(os.path.splitext(f)[0] for f in os.listdir(moz_flood_folder)
+                     if f.startswith("DFO_") and f.lower().endswith(".tif"))
+print(raster_list)
 
-# Field for average area flooded
-avg_crop_flood_field = "avg_crop_flood_2008_2022"
+# Check length of list - we should have 24 events 
+length_list = len(raster_list)
+print(length_list)
 
-# Create the field
-arcpy.AddField_management(adm3_crop_flooded_shp_proj, avg_crop_flood_field, "DOUBLE", field_alias="Avg ha crop flooded 2008-22")
+# Read the admin 3 polygons - this is where the cropland flooded stats will be stored
+# Zone i + 1 in the label grid is posto i in the shapefile (its OBJECTID)
+adm3_geoms, adm3_records, adm3_crs = zones.read_zones(moz_admin3_shp)
+n_postos = len(adm3_geoms)
 
-# Expression - total area flooded between 2008-2022 over the number of floods in this period 
-# Round to the closest integer 
-expression = f"round(!{cropsum_field}! / !{num_flood_field}!)"
+# Attribute table of the output - one row per posto, with all the posto attributes
+adm3_crop_flooded = results.zone_table(adm3_records)
 
-# Run the calculation
-arcpy.CalculateField_management(
-    in_table=adm3_crop_flooded_shp_proj,
-    field=avg_crop_flood_field,
-    expression=expression,
-    expression_type="PYTHON3"
-)
+# Zone labels of the postos to compute (None: every posto)
+selected_postos = None if zone_ids is None else pixel_index.zones_by_attribute(adm3_records, zone_ids)
 
-# Replace NA values with 0s 
-expression = "0 if !" + avg_crop_flood_field + "! is None else !" + avg_crop_flood_field + "!"  
+# Manifest of the previous runs
+run_manifest = manifest.open_manifest(run_folder)
 
-# Run the Field Calculator
-arcpy.management.CalculateField(adm3_crop_flooded_shp_proj, avg_crop_flood_field, expression, "PYTHON3")
+# Cropland total and flooded per posto for each event
+event_results = {}
 
-# Final statistic - average % of cropland flooded between 2008-2022
+# Work still to do - one task per event - and the arrays it needs: the posto label grid and the
+# cell areas of each flood grid
+event_tasks = []
+shared_arrays = {}
 
-# Name of the field 
-avg_prop_crop_flood_field = "avg_p_crop_flood_2008_2022"
+### LOOP STARTS HERE ###
 
-# Create the field
-arcpy.AddField_management(adm3_crop_flooded_shp_proj, avg_prop_crop_flood_field, "DOUBLE", field_alias="Avg % crop flooded 2008-22")
+for raster_name in raster_list:
 
-# Expression - average of the % of crop flooded across all flood events 
+    ## STEP 1: LOAD DATA ##
 
-# Get the column names that have % of cropland flooded
-crop_prop_fields = [f.name for f in fields if "Pct_C" in f.name]
+    # Loop through all flood events - start with just one flood raster 
+    flood_raster = os.path.join(moz_flood_folder, raster_name + ".tif")
 
-# Turn into an expression
-field_expression = ", ".join([f"!{field}!" for field in crop_prop_fields])
+    # Extract the start date of the flood event (year) - this will always be 4 digits after "From_" in the file name
+    flood_year = raster_name.split("From_")[1][:4]
 
-# Generate the expression for averaging non-zero proportions 
-# Round to two decimal points 
-expression = f"""
-round(sum(v for v in [{field_expression}] if v is not None and v > 0) / (!num_floods! if !num_floods! > 0 else 1), 2)
-"""
-# Calculate field
-arcpy.CalculateField_management(
-    in_table=adm3_crop_flooded_shp_proj,
-    field=avg_prop_crop_flood_field,
-    expression=expression,
-    expression_type="PYTHON3"
-)
+    # Get flood event ID  
+    flood_event_id =  "DFO_" + raster_name.split("_")[1]
 
-# Save shapefile attribute table as csv 
-arcpy.conversion.ExportTable(adm3_crop_flooded_shp_proj, os.path.join(results_folder, adm3_crop_flooded_table))
+    # Get the MODIS cropland raster which matches the year of the flood
+    cropland_raster = os.path.join(moz_cropland_folder, "MODIS_Land_Cover_" + flood_year + "_cropland.tif")
 
+    # Check where we are  
+    print("-------------------------------------------------")
+    print("Gathered the data. Processing flood event " + flood_event_id)
 
+    # Skip the event if its inputs (flood raster, cropland raster, postos) have not changed since the
+    # last run - its results are read from the run folder
+    event_params = {"stat": "cropland", "value_class": 1, "area": "geodesic"}
+    if selected_postos is not None:
+        event_params["postos"] = sorted(selected_postos)
+    elif exact_coverage:
+        event_params["zones"] = "exact coverage"
+    event_digest = manifest.event_hash([flood_raster, cropland_raster], moz_admin3_shp, event_params)
+    stored = manifest.load_result(run_manifest, flood_event_id, event_digest)
+    if stored is not None:
+        print("Flood event " + flood_event_id + " unchanged since the last run. Skipping...")
+        event_results[raster_name] = (stored["total"], stored["flooded"])
+        continue
+
+    ## STEP 2: ALIGN SPATIAL REFERENCE AND RESOLUTION ##
+
+    # The flood layer (250m, WGS 1984) sets the grid of the analysis. The cropland data (500m) is
+    # resampled to it with nearest neighbour, through an index map computed once per pair of grids
+    # (or warped per tile if it is in another spatial reference)
+    flood_grid = raster.read_grid(flood_raster)
+    key = raster.grid_key(flood_grid)
+
+    if "areas_" + key not in shared_arrays:
+        # Areas are measured on the WGS84 ellipsoid instead of reprojecting both layers to an equal-area
+        # projection: all cells of a row have the same area, so the area of each row is computed once and
+        # the cropland pixels are weighted by it. Areas are in m2 - I can convert units to ha (1 ha = 10,000 m2)
+        shared_arrays["areas_" + key] = cell_area.row_areas(flood_grid)
+
+        # Posto label grid (or coverage matrix) on the flood grid - computed once and then read from the cache.
+        # For a few postos, their pixel index is built (once, in the cache) instead and nothing is shared
+        if selected_postos is not None:
+            pixel_index.pixel_index(moz_admin3_shp, flood_grid, cache_folder)
+        elif exact_coverage:
+            shared_arrays.update(coverage.coverage_arrays(
+                coverage.zone_coverage(moz_admin3_shp, flood_grid, cache_folder), "zones_" + key))
+        else:
+            shared_arrays["zones_" + key] = zones.zone_labels(moz_admin3_shp, flood_grid, cache_folder)
+
+    event_tasks.append({"raster_name": raster_name, "event_id": flood_event_id, "digest": event_digest,
+                        "year": flood_year, "value_path": cropland_raster, "flood_path": flood_raster,
+                        "grid": flood_grid, "zones": "zones_" + key, "areas": "areas_" + key,
+                        "n_zones": n_postos, "value_class": 1, "tile_size": tile_size,
+                        "postos": selected_postos, "shapefile": moz_admin3_shp, "cache_folder": cache_folder})
+
+## STEP 3: ZONAL STATS ##
+
+# The years and events are independent, so they are spread over the worker processes. The posto label
+# grids (or coverage matrices), cell areas and cropland masks are shared with the workers instead of being
+# copied to each of them.
+
+# Keep the results of each event as soon as it is done - in memory for the table and in the run folder
+# for the next run
+def store_event(task, total_crop, flooded_crop):
+    event_results[task["raster_name"]] = (total_crop, flooded_crop)
+    manifest.save_result(run_manifest, task["event_id"], task["digest"],
+                         {"total": total_crop, "flooded": flooded_crop})
+    print("Computed cropland area flooded. Flood event " + task["event_id"])
+
+if selected_postos is not None or exact_coverage:
+
+    # Cropland total and flooded in each posto with coverage weights, or for the selected postos only -
+    # one task per year and flood grid, which reads the cropland layer once and the flood layers of the
+    # events of that year
+    year_tasks = {}
+    for task in event_tasks:
+        year_task = year_tasks.setdefault((task["year"], task["zones"]),
+                                          dict(task, coverage=task["zones"], flood_paths=[], events=[]))
+        year_task["flood_paths"].append(task["flood_path"])
+        year_task["events"].append(task)
+
+    def store_year(year_task, result):
+        total_crop, flooded_crops = result
+        for task, flooded_crop in zip(year_task["events"], flooded_crops):
+            store_event(task, total_crop, flooded_crop)
+
+    year_task = parallel.coverage_task if selected_postos is None else parallel.pixel_index_task
+    parallel.run_parallel(year_task, list(year_tasks.values()), shared_arrays, n_workers, store_year)
+
+else:
+    # Total area of cropland in each posto - base for calculating the % of cropland flooded.
+    # Cropland pixels are coded as values of 1. This only depends on the year, so it is computed once
+    # per year (together with the cropland mask on the flood grid) and shared by the events of that year.
+    # The years go in batches of baseline.MAX_BASELINES: the baselines of a batch are computed in
+    # parallel and kept in the baseline cache, and their masks are only shared while the events of the
+    # batch run - so only a few years of cropland masks are in memory at a time
+    year_tasks = {}
+    for task in event_tasks:
+        year_tasks.setdefault((task["year"], task["zones"]), task)
+    year_keys = list(year_tasks)
+
+    for first in range(0, len(year_keys), baseline.MAX_BASELINES):
+        batch = year_keys[first:first + baseline.MAX_BASELINES]
+        missing = [k for k in batch if baseline.cached_baseline("cropland", k[0], year_tasks[k]["grid"]) is None]
+        for k, base in zip(missing, parallel.run_parallel(parallel.class_baseline_task,
+                                                          [year_tasks[k] for k in missing],
+                                                          shared_arrays, n_workers)):
+            baseline.keep_baseline("cropland", k[0], year_tasks[k]["grid"], base)
+        crop_bases = {k: baseline.cached_baseline("cropland", k[0], year_tasks[k]["grid"]) for k in batch}
+        print("Computed the cropland baselines of " + ", ".join(year for year, zones_name in batch))
+
+        batch_arrays = dict(shared_arrays)
+        for (year, zones_name), base in crop_bases.items():
+            batch_arrays["mask_" + year + "_" + zones_name] = base["mask"]
+        batch_tasks = [dict(task, mask="mask_" + task["year"] + "_" + task["zones"])
+                       for task in event_tasks if (task["year"], task["zones"]) in crop_bases]
+
+        # Area of cropland flooded in each posto - flooded pixels are coded as values of 1.
+        # Only the flood raster is read; with a tile size, the pass streams through the grid
+        # tile by tile and merges the partial sums.
+        def store_flooded(task, flooded_crop):
+            store_event(task, crop_bases[(task["year"], task["zones"])]["total"], flooded_crop)
+
+        parallel.run_parallel(parallel.flooded_task, batch_tasks, batch_arrays, n_workers, store_flooded)
+
+## STEP 4: STORE RESULTS ##
+
+# Output tables - the postos, and the districts and provinces they roll up to. The district and
+# province results add up the posto sums of the same zonal statistics (no raster is read again)
+admin_tables = [(adm3_crop_flooded, None, n_postos, adm3_crop_flooded_table)]
+
+# Only the selected postos - their rows of the table and of the zonal statistics. The districts and
+# provinces would only be partly covered, so they are not written
+if selected_postos is not None:
+    rows = np.array(selected_postos) - 1
+    adm3_crop_flooded = results.select_rows(adm3_crop_flooded, rows)
+    event_results = {raster_name: tuple(results.select_rows(stats, rows) for stats in event_result)
+                     for raster_name, event_result in event_results.items()}
+    admin_tables = [(adm3_crop_flooded, None, len(rows), adm3_crop_flooded_table)]
+
+elif os.path.exists(admin_code_mapping):
+    code_mapping = hierarchy.read_code_mapping(admin_code_mapping)
+    for (code_field, name_field), output in [(("ID_DIST", "Distrito"), adm2_crop_flooded_table),
+                                             (("CodProv", "Provincia"), adm1_crop_flooded_table)]:
+        admin_units, parents = hierarchy.parent_units(adm3_crop_flooded["PA_ID"], code_mapping,
+                                                      "PA_ID", code_field, name_field)
+        admin_tables.append((admin_units, parents, len(admin_units[code_field]), output))
+
+for admin_table, parents, n_units, output in admin_tables:
+
+    # Results of all events in one (unit x event x metric) matrix - the table is only built at the end
+    crop_matrix = results.result_matrix(n_units, ["DFO_" + r.split("_")[1] for r in raster_list],
+                                        ["Crop_Flood_ha", "Pct_C_Flood"])
+
+    for raster_name in raster_list:
+        total_crop, flooded_crop = event_results[raster_name]
+
+        # Districts / provinces - add up the sums of their postos. The % below is then the rolled-up
+        # cropland flooded over the rolled-up cropland, not an average of posto %
+        if parents is not None:
+            total_crop = hierarchy.roll_up(total_crop, parents, n_units)
+            flooded_crop = hierarchy.roll_up(flooded_crop, parents, n_units)
+
+        # Get flood event ID
+        flood_event_id =  "DFO_" + raster_name.split("_")[1]
+
+        # Divide the m2 by 10,000 to get hectares and round to the closest integer
+        # Postos without cropland get no total (as ZonalStatisticsAsTable leaves them out)
+        crop_total = np.where(total_crop["COUNT"] > 0, np.round(total_crop["SUM"] / 10000), np.nan)
+        crop_flood = np.round(flooded_crop["SUM"] / 10000)
+
+        # Store the area of cropland flooded (ha) 
+        results.set_result(crop_matrix, flood_event_id, "Crop_Flood_ha", crop_flood)
+
+        # Calculate proportion of cropland flooded in each unit (rounded to two decimal points)
+        # Replace NA values with 0s 
+        with np.errstate(invalid="ignore", divide="ignore"):
+            pct_crop_flood = np.round(crop_flood / np.where(crop_total > 0, crop_total, np.nan) * 100, 2)
+        results.set_result(crop_matrix, flood_event_id, "Pct_C_Flood", np.nan_to_num(pct_crop_flood, nan=0))
+
+    # Add the columns in the order of the flood events - Crop_Flood_ha_<event ID> and Pct_C_Flood_<event ID>
+    admin_table.update(results.wide_columns(crop_matrix))
+
+    # Aggregate table to get total area of cropland flooded between 2008-2022 - or average per flood event?
+    # Get another table which is at the country-year level. Trends over time (this could be done in R)
+
+    # Sums, counts and averages over the event axis of the result matrix, for all units at once
+    crop_summary = summary.summarise(crop_matrix, "Crop_Flood_ha", "Pct_C_Flood")
+
+    # Total area of cropland flooded 2008-2022
+    admin_table["Crop_Flood_ha_2008_2022"] = crop_summary["total"]
+
+    # Number of flood events (count the "Crop_Flood_ha_DFO" values that are non-zero)
+    admin_table["num_floods"] = crop_summary["num_floods"]
+
+    # Average area of cropland flooded in a flood event - total area flooded between 2008-2022
+    # over the number of floods in this period. Round to the closest integer 
+    admin_table["avg_crop_flood_2008_2022"] = crop_summary["avg"]
+
+    # Average % of cropland flooded across all flood events (non-zero proportions)
+    # Round to two decimal points 
+    admin_table["avg_p_crop_flood_2008_2022"] = crop_summary["avg_pct"]
+
+    # The same for each window of events in summary_windows - no zonal statistics are re-run
+    for window_name, window in summary_windows.items():
+        selected = summary.event_window(raster_list, window.get("years"), window.get("sources"))
+        window_summary = summary.summarise(crop_matrix, "Crop_Flood_ha", "Pct_C_Flood", selected)
+        admin_table["Crop_Flood_ha_" + window_name] = window_summary["total"]
+        admin_table["num_floods_" + window_name] = window_summary["num_floods"]
+        admin_table["avg_crop_flood_" + window_name] = window_summary["avg"]
+        admin_table["avg_p_crop_flood_" + window_name] = window_summary["avg_pct"]
+
+    # Save attribute table as csv - written once, at the end
+    results.write_csv(os.path.join(results_folder, output), admin_table)
+
+if adm3_crop_flooded_parquet:
+    results.write_parquet(os.path.join(results_folder, adm3_crop_flooded_parquet), adm3_crop_flooded)
+
+# Join the table to the posto polygons - a single join of all the columns (every posto only)
+if adm3_crop_flooded_layer and selected_postos is None:
+    results.join_zones(moz_admin3_shp, os.path.join(results_folder, adm3_crop_flooded_layer), adm3_crop_flooded)
+
+# Compare the posto table with the one from the arcpy version of this script, column by column
+if adm3_crop_flooded_arcpy_table:
+    parity.print_report(parity.compare_tables(os.path.join(results_folder, adm3_crop_flooded_arcpy_table),
+                                              os.path.join(results_folder, adm3_crop_flooded_table)))
@@ -0,0 +1,1533 @@
+# Local stand-in for the Earth Engine API used by flood_detection
+
+# Evaluates the subset of the ee API that modis.dfo, modis_toolbox, misc and
+# otsu use, eagerly and with NumPy, on images held as local arrays. Nothing
+# is sent to Earth Engine, so the DFO algorithm can be run, profiled and
+# regression-tested offline against fixture data.
+#
+# Usage - install the stand-in as the `ee` module (before the first ee call),
+# register the fixture assets, then call modis.dfo unchanged:
+#
+#     from flood_detection import local_ee
+#     ee = local_ee.install()
+#     local_ee.add_asset("MODIS/061/MOD09GQ", [ee.Image.from_arrays(...), ...])
+#     from flood_detection import modis
+#     flood_img = modis.dfo(roi, began, ended, "standard")
+#     flooded = flood_img.to_array("flooded")
+#
+# Differences from Earth Engine:
+#  - All bands of the images that are combined must be on the same grid (as
+#    in modis_local, the GA bands are resampled onto the 250m grid
+#    beforehand). The "scale" of reductions and exports is ignored.
+#  - Geometries are in the coordinates of the image grids; clip() keeps the
+#    pixels whose centre is inside.
+#  - Histograms use 255 equal-width buckets (modis_local.histogram).
+#  - Division by zero gives 0, as Image.divide does.
+
+import ast
+import copy
+import datetime
+import json
+import re
+import sys
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+
+from flood_detection import modis_local, session
+
+# Metres per degree at the equator - nominal scale of geographic grids
+METRES_PER_DEGREE = 111319.49079327357
+
+# Registered assets: asset ID -> Image, list of Images or list of Features
+_assets = {}
+
+# Time each asset was registered (its updateTime in listAssets)
+_asset_times = {}
+
+# Clip masks already computed: (geometry, shape, transform) -> boolean mask
+_clip_masks = {}
+
+# Install this module as `ee` - as the module of the flood_detection session
+# and in sys.modules, so `import ee` in the scripts picks up the stand-in
+#    Returns:
+#        - this module
+def install():
+    module = sys.modules[__name__]
+    sys.modules["ee"] = module
+    session.configure(module=module)
+    return module
+
+# Register a fixture asset
+#    Args:
+#        asset_id: ID used by ee.Image / ee.ImageCollection / ee.FeatureCollection
+#        value: Image, list of Images (a collection) or list of Features /
+#               property dictionaries (a table)
+def add_asset(asset_id, value):
+    _assets[asset_id] = value
+    _asset_times[asset_id] = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+# Forget the registered assets and cached clip masks
+def reset():
+    _assets.clear()
+    _asset_times.clear()
+    _clip_masks.clear()
+
+def Initialize(*args, **kwargs):
+    return None
+
+def Authenticate(*args, **kwargs):
+    return None
+
+# Plain Python value of a (wrapped) value - for properties, filters and sorting
+def _raw(value):
+    if isinstance(value, _Value):
+        return value._value
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+# Wrap a plain value the way ee returns it from get()
+def _wrap(value):
+    if value is None or isinstance(value, (_Value, Image, Collection, Feature, Geometry)):
+        return value
+    if isinstance(value, (bool, int, float, np.number)):
+        return Number(value)
+    if isinstance(value, str):
+        return String(value)
+    if isinstance(value, dict):
+        return Dictionary(value)
+    if isinstance(value, (list, tuple)):
+        return List(value)
+    if isinstance(value, np.ndarray):
+        return Array(value)
+    return value
+
+# getInfo() of any value
+def _info(value):
+    if hasattr(value, "getInfo"):
+        return value.getInfo()
+    if isinstance(value, dict):
+        return {k: _info(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_info(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return _raw(value)
+
+# Serialised form of a value, e.g. as a cache key. The values here are
+# already evaluated, so this is their getInfo() as JSON
+def _serialize(value):
+    return json.dumps(_info(value), sort_keys=True, default=str)
+
+######################################################################
+# Computed values
+
+class _Value(object):
+    def __init__(self, value):
+        self._value = _raw(value)
+
+    def getInfo(self):
+        return _info(self._value)
+
+    def serialize(self):
+        return _serialize(self)
+
+    def __repr__(self):
+        return "{0}({1!r})".format(type(self).__name__, self._value)
+
+class Number(_Value):
+    def _op(self, other, op):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return Number(op(np.float64(self._value), np.float64(_raw(other))).item())
+
+    def add(self, other):
+        return self._op(other, np.add)
+
+    def subtract(self, other):
+        return self._op(other, np.subtract)
+
+    def multiply(self, other):
+        return self._op(other, np.multiply)
+
+    def divide(self, other):
+        if _raw(other) == 0:
+            return Number(0)
+        return self._op(other, np.divide)
+
+    def pow(self, other):
+        return self._op(other, np.power)
+
+    def max(self, other):
+        return self._op(other, np.maximum)
+
+    def min(self, other):
+        return self._op(other, np.minimum)
+
+    def gt(self, other):
+        return Number(int(self._value > _raw(other)))
+
+    def gte(self, other):
+        return Number(int(self._value >= _raw(other)))
+
+    def lt(self, other):
+        return Number(int(self._value < _raw(other)))
+
+    def lte(self, other):
+        return Number(int(self._value <= _raw(other)))
+
+    def eq(self, other):
+        return Number(int(self._value == _raw(other)))
+
+    def neq(self, other):
+        return Number(int(self._value != _raw(other)))
+
+    def round(self):
+        return Number(float(np.round(self._value)))
+
+    def int(self):
+        return Number(int(self._value))
+
+    def format(self, pattern="%s"):
+        return String(pattern % self._value)
+
+    # The Python `if` on a comparison (modis.dfo) - true when non-zero
+    def __bool__(self):
+        return bool(self._value)
+
+class String(_Value):
+    def __init__(self, value):
+        _Value.__init__(self, str(_raw(value)))
+
+    def cat(self, other):
+        return String(self._value + str(_raw(other)))
+
+    def length(self):
+        return Number(len(self._value))
+
+class Dictionary(_Value):
+    def __init__(self, value=None):
+        _Value.__init__(self, dict(_raw(value) or {}))
+
+    def get(self, key, defaultValue=None):
+        return _wrap(self._value.get(_raw(key), defaultValue))
+
+    def keys(self):
+        return List(list(self._value))
+
+    def set(self, key, value):
+        out = dict(self._value)
+        out[_raw(key)] = value
+        return Dictionary(out)
+
+    def combine(self, second, overwrite=True):
+        out = dict(self._value)
+        for key, value in dict(_raw(second)).items():
+            if overwrite or key not in out:
+                out[key] = value
+        return Dictionary(out)
+
+class List(_Value):
+    def __init__(self, value):
+        _Value.__init__(self, list(_raw(value)))
+
+    def get(self, index):
+        return _wrap(self._value[_raw(index)])
+
+    def size(self):
+        return Number(len(self._value))
+
+    def sort(self):
+        return List(sorted(self._value, key=_raw))
+
+    def length(self):
+        return self.size()
+
+class Array(_Value):
+    def __init__(self, value):
+        _Value.__init__(self, np.asarray(_raw(value), dtype=np.float64))
+
+    def _op(self, other, op):
+        other = _raw(other)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return Array(op(self._value, np.asarray(other, dtype=np.float64)))
+
+    def add(self, other):
+        return self._op(other, np.add)
+
+    def subtract(self, other):
+        return self._op(other, np.subtract)
+
+    def multiply(self, other):
+        return self._op(other, np.multiply)
+
+    def divide(self, other):
+        return self._op(other, np.divide)
+
+    def pow(self, other):
+        return self._op(other, np.power)
+
+    # Running sum along an axis
+    def accum(self, axis, reducer=None):
+        return Array(np.cumsum(self._value, axis=axis))
+
+    # Reduce along the given axes, keeping them with length 1
+    def reduce(self, reducer, axes):
+        return Array(reducer._array(self._value, tuple(axes)))
+
+    def get(self, position):
+        return Number(self._value[tuple(position)].item())
+
+    # Sort by keys (the array itself by default). NaN keys sort first, so
+    # get([-1]) picks the largest key that is a number
+    def sort(self, keys=None):
+        keys = self._value if keys is None else _raw(keys)
+        keys = np.where(np.isnan(keys), -np.inf, keys)
+        return Array(self._value[np.argsort(keys, kind="stable")])
+
+    def length(self):
+        return Array(self._value.shape)
+
+class Date(_Value):
+    def __init__(self, value, tz=None):
+        value = _raw(value)
+        if isinstance(value, str):
+            value = np.datetime64(value, "ms").astype(np.int64).item()
+        elif isinstance(value, np.datetime64):
+            value = value.astype("datetime64[ms]").astype(np.int64).item()
+        _Value.__init__(self, int(value))
+
+    def _datetime(self):
+        return datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=self._value)
+
+    def millis(self):
+        return Number(self._value)
+
+    def advance(self, delta, unit):
+        delta, unit = _raw(delta), unit.rstrip("s")
+        if unit in ("year", "month"):
+            d = self._datetime()
+            months = d.year * 12 + d.month - 1 + int(delta) * (12 if unit == "year" else 1)
+            d = d.replace(year=months // 12, month=months % 12 + 1)
+            return Date(int((d - datetime.datetime(1970, 1, 1)).total_seconds() * 1000))
+        return Date(self._value + int(round(delta * _UNIT_MS[unit])))
+
+    def difference(self, start, unit):
+        return Number((self._value - Date(start)._value) / _UNIT_MS[unit.rstrip("s")])
+
+    def get(self, unit):
+        d = self._datetime()
+        return Number(getattr(d, unit.rstrip("s")))
+
+    # Joda-style pattern (yyyy, MM, dd, HH, mm, ss)
+    def format(self, pattern=None):
+        d = self._datetime()
+        if pattern is None:
+            return String(d.strftime("%Y-%m-%dT%H:%M:%S"))
+        out = pattern
+        for joda, value in (("yyyy", "%04d" % d.year), ("MM", "%02d" % d.month),
+                            ("dd", "%02d" % d.day), ("HH", "%02d" % d.hour),
+                            ("mm", "%02d" % d.minute), ("ss", "%02d" % d.second)):
+            out = out.replace(joda, value)
+        return String(out)
+
+_UNIT_MS = {"second": 1000, "minute": 60000, "hour": 3600000, "day": 86400000,
+            "week": 7 * 86400000}
+
+class DateRange(object):
+    def __init__(self, start, end=None):
+        self._start = Date(start)
+        self._end = Date(end) if end is not None else self._start.advance(1, "day")
+
+    def start(self):
+        return self._start
+
+    def end(self):
+        return self._end
+
+class Algorithms(object):
+    @staticmethod
+    def If(condition, trueCase, falseCase):
+        return trueCase if _raw(condition) else falseCase
+
+######################################################################
+# Geometries
+
+class Geometry(object):
+    # GeoJSON-like geometry (dictionary), or an object with getInfo()
+    def __init__(self, geojson):
+        if isinstance(geojson, Geometry):
+            geojson = geojson._geojson
+        self._geojson = geojson
+
+    @staticmethod
+    def Rectangle(coords):
+        coords = np.asarray(_raw(coords), dtype=np.float64).ravel()
+        x0, y0, x1, y1 = coords
+        return Geometry({"type": "Polygon", "coordinates": [
+            [[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]]})
+
+    @staticmethod
+    def Polygon(coords):
+        return Geometry({"type": "Polygon", "coordinates": _raw(coords)})
+
+    @staticmethod
+    def MultiPolygon(coords):
+        return Geometry({"type": "MultiPolygon", "coordinates": _raw(coords)})
+
+    @staticmethod
+    def Point(coords):
+        return Geometry({"type": "Point", "coordinates": list(_raw(coords))})
+
+    def _bbox(self):
+        points = np.asarray(list(_points(self._geojson["coordinates"])), dtype=np.float64)
+        return points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max()
+
+    def _is_rectangle(self):
+        if self._geojson["type"] != "Polygon" or len(self._geojson["coordinates"]) != 1:
+            return False
+        ring = np.asarray(self._geojson["coordinates"][0], dtype=np.float64)
+        if len(ring) != 5:
+            return False
+        x0, y0, x1, y1 = self._bbox()
+        on_edge = (np.isin(ring[:, 0], (x0, x1)) & np.isin(ring[:, 1], (y0, y1)))
+        return bool(on_edge.all())
+
+    def bounds(self, maxError=None, proj=None):
+        return Geometry.Rectangle(self._bbox())
+
+    def geometry(self):
+        return self
+
+    def coordinates(self):
+        return List(self._geojson["coordinates"])
+
+    def serialize(self):
+        return _serialize(self)
+
+    def getInfo(self):
+        return copy.deepcopy(self._geojson)
+
+def _points(coordinates):
+    if len(coordinates) and isinstance(coordinates[0], (int, float, np.number)):
+        yield coordinates
+        return
+    for part in coordinates:
+        for point in _points(part):
+            yield point
+
+# Pixel-centre mask of a geometry on a grid
+def _geometry_mask(geometry, shape, transform):
+    key = (repr(geometry._geojson), shape, transform)
+    if key not in _clip_masks:
+        a, b, c, d, e, f = transform
+        if geometry._is_rectangle() and b == 0 and d == 0:
+            x0, y0, x1, y1 = geometry._bbox()
+            x = c + a * (np.arange(shape[1]) + 0.5)
+            y = f + e * (np.arange(shape[0]) + 0.5)
+            mask = (((y >= y0) & (y <= y1))[:, None]) & (((x >= x0) & (x <= x1))[None, :])
+        else:
+            from affine import Affine
+            from rasterio.features import geometry_mask
+            mask = geometry_mask([geometry._geojson], shape, Affine(*transform), invert=True)
+        _clip_masks[key] = mask
+    return _clip_masks[key]
+
+######################################################################
+# Reducers
+
+class Reducer(object):
+    def __init__(self, name, **options):
+        self._name = name
+        self._options = options
+
+    @staticmethod
+    def sum():
+        return Reducer("sum")
+
+    @staticmethod
+    def count():
+        return Reducer("count")
+
+    @staticmethod
+    def mean():
+        return Reducer("mean")
+
+    @staticmethod
+    def median():
+        return Reducer("median")
+
+    @staticmethod
+    def min():
+        return Reducer("min")
+
+    @staticmethod
+    def max():
+        return Reducer("max")
+
+    @staticmethod
+    def histogram(maxBuckets=None, minBucketWidth=None, maxRaw=None):
+        return Reducer("histogram", maxBuckets=maxBuckets)
+
+    # Reduce a stack of values along an axis, ignoring masked values
+    #    Returns:
+    #        - (values, mask) - masked where every value is masked
+    def _stack(self, data, mask, axis=0):
+        data = np.asarray(data, dtype=np.float64)
+        valid = np.broadcast_to(mask, data.shape)
+        any_valid = valid.any(axis=axis)
+        if self._name == "count":
+            return valid.sum(axis=axis).astype(np.float64), np.ones(any_valid.shape, dtype=bool)
+        if self._name == "sum":
+            return np.where(valid, data, 0).sum(axis=axis), any_valid
+        masked = np.where(valid, data, np.nan)
+        with np.errstate(invalid="ignore"), _quiet():
+            values = {"mean": np.nanmean, "median": np.nanmedian,
+                      "min": np.nanmin, "max": np.nanmax}[self._name](masked, axis=axis)
+        return np.where(any_valid, values, 0), any_valid
+
+    # Reduce a 1-D list of values (reduceRegion, reduceColumns)
+    def _values(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if self._name == "histogram":
+            if values.size == 0:
+                return None
+            buckets = self._options.get("maxBuckets") or 255
+            hist = modis_local.histogram(values, max_buckets=buckets)
+            width = (values.max() - values.min()) / buckets
+            return {"bucketMin": float(values.min()), "bucketWidth": float(width),
+                    "histogram": hist["histogram"].tolist(),
+                    "bucketMeans": hist["bucketMeans"].tolist()}
+        if self._name == "count":
+            return int(values.size)
+        if values.size == 0:
+            return 0 if self._name == "sum" else None
+        return float({"sum": np.sum, "mean": np.mean, "median": np.median,
+                      "min": np.min, "max": np.max}[self._name](values))
+
+    def _array(self, values, axes):
+        return {"sum": np.sum, "mean": np.mean, "median": np.median, "min": np.min,
+                "max": np.max, "count": np.count_nonzero}[self._name](values, axis=axes, keepdims=True)
+
+class _quiet(object):
+    def __enter__(self):
+        self._catch = warnings.catch_warnings()
+        self._catch.__enter__()
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+
+    def __exit__(self, *exc):
+        return self._catch.__exit__(*exc)
+
+######################################################################
+# Images
+
+class Projection(object):
+    def __init__(self, crs, transform):
+        self._crs = crs
+        self._transform = transform
+
+    # Pixel size in metres (at the equator for geographic grids)
+    def nominalScale(self):
+        size = abs(self._transform[0]) if self._transform else 1.0
+        crs = str(self._crs or "").upper()
+        if crs in ("EPSG:4326", "EPSG:4269", "EPSG:4258") or "GEOGCS" in crs and "PROJCS" not in crs:
+            size *= METRES_PER_DEGREE
+        return Number(size)
+
+    def crs(self):
+        return String(self._crs)
+
+    def getInfo(self):
+        return {"type": "Projection", "crs": self._crs,
+                "transform": list(self._transform) if self._transform else None}
+
+class Image(object):
+    # Image(): no bands; Image(number): constant; Image("asset/id"): registered
+    # asset; Image(list of images): bands concatenated
+    def __init__(self, args=None):
+        self._bands = []
+        self._props = {}
+        self._shape = None
+        self._transform = None
+        self._crs = None
+        if args is None:
+            return
+        if isinstance(args, Image):
+            self._copy_from(args)
+        elif isinstance(args, (int, float, Number, np.number)):
+            self._copy_from(Image.constant(args))
+        elif isinstance(args, (str, String)):
+            self._copy_from(_assets[_raw(args)])
+        elif isinstance(args, (list, tuple, List)):
+            self._copy_from(Image.cat(*_raw(args)))
+        else:
+            raise TypeError("Cannot make an Image from {0!r}".format(args))
+
+    def _copy_from(self, other):
+        self._bands = list(other._bands)
+        self._props = dict(other._props)
+        self._shape, self._transform, self._crs = other._shape, other._transform, other._crs
+
+    # Image from local arrays
+    #    Args:
+    #        bands: dictionary of band name -> (y, x) array. NaN (or masked
+    #               values of a numpy masked array) are masked pixels
+    #        transform: (a, b, c, d, e, f) affine transform of the grid (as
+    #                   rasterio / affine order)
+    #        crs: CRS of the grid, e.g. "EPSG:4326"
+    #        properties: image properties, e.g. {"system:time_start": ms}
+    @staticmethod
+    def from_arrays(bands, transform=None, crs="EPSG:4326", properties=None):
+        image = Image()
+        for name, values in bands.items():
+            if isinstance(values, np.ma.MaskedArray):
+                mask = ~np.ma.getmaskarray(values)
+                values = values.filled(0)
+            else:
+                values = np.asarray(values)
+                mask = ~np.isnan(values) if values.dtype.kind == "f" else np.ones(values.shape, dtype=bool)
+            image._bands.append((name, values, mask))
+            image._shape = values.shape
+        image._transform = tuple(transform)[:6] if transform is not None else None
+        image._crs = crs
+        image._props = dict(properties or {})
+        return image
+
+    @staticmethod
+    def constant(value):
+        image = Image()
+        image._bands = [("constant", np.float64(_raw(value)), True)]
+        return image
+
+    @staticmethod
+    def cat(*images):
+        out = Image()
+        for image in images:
+            image = Image(image) if not isinstance(image, Image) else image
+            if not out._bands and not out._props:
+                out._props = dict(image._props)
+            out._adopt_grid(image)
+            out._bands.extend(image._bands)
+        return out
+
+    def _adopt_grid(self, other):
+        if other._shape is None:
+            return
+        if self._shape is not None and self._shape != other._shape:
+            raise ValueError("Images are on different grids: {0} and {1}".format(self._shape, other._shape))
+        self._shape, self._transform, self._crs = other._shape, other._transform, other._crs
+
+    def _new(self, bands, props=None, other=None):
+        image = Image()
+        image._shape, image._transform, image._crs = self._shape, self._transform, self._crs
+        if other is not None:
+            image._adopt_grid(other)
+        image._bands = bands
+        image._props = dict(self._props if props is None else props)
+        return image
+
+    # Local arrays of a band
+    #    Returns:
+    #        - (y, x) float array with NaN where the band is masked
+    def to_array(self, band=0):
+        name, data, mask = self._band(band)
+        data = np.broadcast_to(np.asarray(data, dtype=np.float64), self._shape or np.shape(data))
+        return np.where(mask, data, np.nan)
+
+    def _band(self, band):
+        if isinstance(band, int):
+            return self._bands[band]
+        for b in self._bands:
+            if b[0] == band:
+                return b
+        raise KeyError("Image has no band {0!r} (bands: {1})".format(band, self._names()))
+
+    def _names(self):
+        return [b[0] for b in self._bands]
+
+    # Band selection ###################################################
+
+    def select(self, *args):
+        if len(args) == 2 and isinstance(_raw(args[0]), (list, tuple)) and isinstance(_raw(args[1]), (list, tuple)):
+            selectors, names = list(_raw(args[0])), list(_raw(args[1]))
+        elif len(args) == 1 and isinstance(_raw(args[0]), (list, tuple)):
+            selectors, names = list(_raw(args[0])), None
+        else:
+            selectors, names = [_raw(a) for a in args], None
+        chosen = []
+        for selector in selectors:
+            if isinstance(selector, int):
+                chosen.append(self._bands[selector])
+                continue
+            matches = [b for b in self._bands if re.fullmatch(selector, b[0])]
+            if not matches:
+                raise KeyError("Image has no band {0!r} (bands: {1})".format(selector, self._names()))
+            chosen.extend(matches)
+        if names is not None:
+            chosen = [(n, d, m) for n, (_, d, m) in zip(names, chosen)]
+        return self._new(chosen)
+
+    def rename(self, *names):
+        names = list(_raw(names[0])) if len(names) == 1 and isinstance(_raw(names[0]), (list, tuple)) else list(names)
+        return self._new([(n, d, m) for n, (_, d, m) in zip(names, self._bands)])
+
+    def bandNames(self):
+        return List(self._names())
+
+    def addBands(self, srcImg, names=None, overwrite=False):
+        sources = srcImg if isinstance(srcImg, (list, tuple)) else [srcImg]
+        out = self._new(list(self._bands))
+        for source in sources:
+            source = source if isinstance(source, Image) else Image(source)
+            out._adopt_grid(source)
+            for band in source._bands:
+                if names is not None and band[0] not in names:
+                    continue
+                existing = out._names()
+                if band[0] in existing:
+                    if not overwrite:
+                        raise ValueError("Image.addBands: band {0!r} already exists".format(band[0]))
+                    out._bands[existing.index(band[0])] = band
+                else:
+                    out._bands.append(band)
+        return out
+
+    # Band math ########################################################
+
+    # Apply op band by band. A one-band image is used against every band of
+    # the other; names come from the image with more bands (the first one if
+    # they have as many)
+    def _binary(self, other, op):
+        other = other if isinstance(other, Image) else Image.constant(other)
+        left, right = self._bands, other._bands
+        if len(left) == len(right):
+            pairs, names = list(zip(left, right)), [b[0] for b in left]
+        elif len(right) == 1:
+            pairs, names = [(b, right[0]) for b in left], [b[0] for b in left]
+        elif len(left) == 1:
+            pairs, names = [(left[0], b) for b in right], [b[0] for b in right]
+        else:
+            raise ValueError("Images must have the same number of bands, or one band ({0} and {1})".format(
+                len(left), len(right)))
+        bands = []
+        with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+            for name, ((_, a, ma), (_, b, mb)) in zip(names, pairs):
+                bands.append((name, op(np.asarray(a), np.asarray(b)), ma & mb))
+        return self._new(bands, other=other)
+
+    def _unary(self, op):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self._new([(n, op(np.asarray(d)), m) for n, d, m in self._bands])
+
+    def add(self, other):
+        return self._binary(other, lambda a, b: np.add(a, b, dtype=np.float64))
+
+    def subtract(self, other):
+        return self._binary(other, lambda a, b: np.subtract(a, b, dtype=np.float64))
+
+    def multiply(self, other):
+        return self._binary(other, lambda a, b: np.multiply(a, b, dtype=np.float64))
+
+    def divide(self, other):
+        return self._binary(other, lambda a, b: np.where(b == 0, 0.0, np.divide(a, np.where(b == 0, 1, b), dtype=np.float64)))
+
+    def pow(self, other):
+        return self._binary(other, lambda a, b: np.power(a, b, dtype=np.float64))
+
+    def max(self, other):
+        return self._binary(other, lambda a, b: np.maximum(a, b, dtype=np.float64))
+
+    def min(self, other):
+        return self._binary(other, lambda a, b: np.minimum(a, b, dtype=np.float64))
+
+    def lt(self, other):
+        return self._binary(other, lambda a, b: (a < b).astype(np.uint8))
+
+    def lte(self, other):
+        return self._binary(other, lambda a, b: (a <= b).astype(np.uint8))
+
+    def gt(self, other):
+        return self._binary(other, lambda a, b: (a > b).astype(np.uint8))
+
+    def gte(self, other):
+        return self._binary(other, lambda a, b: (a >= b).astype(np.uint8))
+
+    def eq(self, other):
+        return self._binary(other, lambda a, b: (a == b).astype(np.uint8))
+
+    def neq(self, other):
+        return self._binary(other, lambda a, b: (a != b).astype(np.uint8))
+
+    def And(self, other):
+        return self._binary(other, lambda a, b: ((a != 0) & (b != 0)).astype(np.uint8))
+
+    def Or(self, other):
+        return self._binary(other, lambda a, b: ((a != 0) | (b != 0)).astype(np.uint8))
+
+    def Not(self):
+        return self._unary(lambda a: (a == 0).astype(np.uint8))
+
+    def bitwiseAnd(self, other):
+        return self._binary(other, lambda a, b: np.bitwise_and(a.astype(np.int64), np.asarray(b).astype(np.int64)))
+
+    def bitwiseOr(self, other):
+        return self._binary(other, lambda a, b: np.bitwise_or(a.astype(np.int64), np.asarray(b).astype(np.int64)))
+
+    def rightShift(self, other):
+        return self._binary(other, lambda a, b: np.right_shift(a.astype(np.int64), np.asarray(b).astype(np.int64)))
+
+    def leftShift(self, other):
+        return self._binary(other, lambda a, b: np.left_shift(a.astype(np.int64), np.asarray(b).astype(np.int64)))
+
+    def abs(self):
+        return self._unary(np.abs)
+
+    # Casts - truncate towards zero and clamp to the range of the type
+    def _cast(self, dtype):
+        if np.dtype(dtype).kind == "f":
+            return self._unary(lambda a: a.astype(dtype))
+        info = np.iinfo(dtype)
+        return self._unary(lambda a: np.clip(np.trunc(np.nan_to_num(a.astype(np.float64))),
+                                             info.min, info.max).astype(dtype))
+
+    def toFloat(self):
+        return self._cast(np.float32)
+
+    def toDouble(self):
+        return self._cast(np.float64)
+
+    def toInt(self):
+        return self._cast(np.int32)
+
+    def toInt8(self):
+        return self._cast(np.int8)
+
+    def toUint8(self):
+        return self._cast(np.uint8)
+
+    def toInt16(self):
+        return self._cast(np.int16)
+
+    def toUint16(self):
+        return self._cast(np.uint16)
+
+    def toInt32(self):
+        return self._cast(np.int32)
+
+    int8 = toInt8
+    uint8 = toUint8
+    int16 = toInt16
+    uint16 = toUint16
+    int32 = toInt32
+    int = toInt
+    float = toFloat
+
+    # Image.expression() - b('band') / b(index), band names, variables from
+    # `map`, arithmetic, comparisons, ||, && and !
+    def expression(self, expression, map=None):
+        source = expression.replace("||", " or ").replace("&&", " and ")
+        source = re.sub(r"!(?!=)", " not ", source)
+        variables = dict(map or {})
+        used_masks = []
+
+        def band(selector):
+            name, data, mask = self._band(selector)
+            used_masks.append(mask)
+            return np.asarray(data, dtype=np.float64)
+
+        def value(node):
+            if isinstance(node, ast.Expression):
+                return value(node.body)
+            if isinstance(node, ast.Constant):
+                return node.value
+            if isinstance(node, ast.Name):
+                if node.id in variables:
+                    v = variables[node.id]
+                    if isinstance(v, Image):
+                        used_masks.append(v._bands[0][2])
+                        return np.asarray(v._bands[0][1], dtype=np.float64)
+                    return _raw(v)
+                return band(node.id)
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+                args = [value(a) for a in node.args]
+                if node.func.id == "b":
+                    return band(args[0])
+                if node.func.id in ("float", "double"):
+                    return np.asarray(args[0], dtype=np.float64)
+                if node.func.id == "int":
+                    return np.trunc(args[0])
+                if node.func.id in ("abs", "sqrt", "exp", "log", "floor", "ceil"):
+                    return getattr(np, node.func.id)(args[0])
+            if isinstance(node, ast.BinOp):
+                ops = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply,
+                       ast.Div: np.true_divide, ast.Pow: np.power, ast.Mod: np.mod}
+                return ops[type(node.op)](value(node.left), value(node.right))
+            if isinstance(node, ast.UnaryOp):
+                operand = value(node.operand)
+                if isinstance(node.op, ast.Not):
+                    return np.logical_not(operand).astype(np.uint8)
+                return -operand if isinstance(node.op, ast.USub) else operand
+            if isinstance(node, ast.BoolOp):
+                combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+                out = value(node.values[0])
+                for v in node.values[1:]:
+                    out = combine(out, value(v))
+                return np.asarray(out).astype(np.uint8)
+            if isinstance(node, ast.Compare):
+                ops = {ast.Lt: np.less, ast.LtE: np.less_equal, ast.Gt: np.greater,
+                       ast.GtE: np.greater_equal, ast.Eq: np.equal, ast.NotEq: np.not_equal}
+                left, out = value(node.left), True
+                for op, comparator in zip(node.ops, node.comparators):
+                    right = value(comparator)
+                    out = np.logical_and(out, ops[type(op)](left, right))
+                    left = right
+                return np.asarray(out).astype(np.uint8)
+            raise ValueError("Unsupported expression: {0!r}".format(expression))
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result = value(ast.parse(source.strip(), mode="eval"))
+        mask = True
+        for m in used_masks:
+            mask = mask & m
+        return self._new([("constant", np.asarray(result), mask)])
+
+    # Per-pixel reduction across the bands, e.g. reduce(ee.Reducer.sum()) ->
+    # one band named "sum"
+    def reduce(self, reducer):
+        data = np.stack([np.broadcast_to(np.asarray(d, dtype=np.float64), self._shape or np.shape(d))
+                         for _, d, _ in self._bands])
+        mask = np.stack([np.broadcast_to(m, data.shape[1:]) for _, _, m in self._bands])
+        values, valid = reducer._stack(data, mask)
+        return self._new([(reducer._name, values, valid)])
+
+    def remap(self, From, to, defaultValue=None, bandName=None):
+        name, data, mask = self._band(bandName if bandName is not None else 0)
+        From, to = np.asarray(_raw(From), dtype=np.float64), np.asarray(_raw(to), dtype=np.float64)
+        data = np.asarray(data, dtype=np.float64)
+        out = np.full(np.shape(data), np.nan if defaultValue is None else _raw(defaultValue), dtype=np.float64)
+        found = np.zeros(np.shape(data), dtype=bool)
+        for f, t in zip(From, to):
+            hit = data == f
+            out[hit] = t
+            found |= hit
+        valid = mask & (found if defaultValue is None else True)
+        return self._new([("remapped", np.where(valid, out, 0), valid)])
+
+    # Masks ############################################################
+
+    def mask(self):
+        return self._new([(n, np.broadcast_to(m, self._shape or np.shape(m)).astype(np.uint8), True)
+                          for n, _, m in self._bands])
+
+    def updateMask(self, mask):
+        mask = mask if isinstance(mask, Image) else Image.constant(mask)
+        if len(mask._bands) == 1:
+            masks = [mask._bands[0]] * len(self._bands)
+        else:
+            masks = mask._bands
+        bands = [(n, d, m & (np.asarray(md) != 0) & mm) for (n, d, m), (_, md, mm) in zip(self._bands, masks)]
+        return self._new(bands, other=mask)
+
+    def unmask(self, value=0, sameFootprint=True):
+        value = _raw(value) if value is not None else 0
+        return self._new([(n, np.where(m, d, value), np.ones(self._shape, dtype=bool) if self._shape else True)
+                          for n, d, m in self._bands])
+
+    def clip(self, geometry):
+        if self._shape is None:
+            return self
+        geometry = geometry.geometry() if isinstance(geometry, (Feature, Collection)) else Geometry(geometry)
+        transform = self._transform or (1, 0, 0, 0, 1, 0)
+        inside = _geometry_mask(geometry, self._shape, transform)
+        return self._new([(n, d, m & inside) for n, d, m in self._bands])
+
+    # Properties #######################################################
+
+    def set(self, *args):
+        props = dict(self._props)
+        props.update(args[0] if len(args) == 1 else {args[0]: args[1]})
+        return self._new(self._bands, props)
+
+    def get(self, property):
+        return _wrap(self._props.get(_raw(property)))
+
+    def propertyNames(self):
+        return List(list(self._props))
+
+    # Copy the (non-system) properties of an image, feature or collection
+    def copyProperties(self, source=None, properties=None, exclude=None):
+        props = dict(self._props)
+        if source is not None:
+            for key, value in source._props.items():
+                if properties is not None and key not in properties:
+                    continue
+                if exclude is not None and key in exclude:
+                    continue
+                if properties is None and key.startswith("system:"):
+                    continue
+                props[key] = value
+        return self._new(self._bands, props)
+
+    def projection(self):
+        return Projection(self._crs, self._transform)
+
+    def geometry(self):
+        if self._shape is None or self._transform is None:
+            return None
+        a, b, c, d, e, f = self._transform
+        xs = (c, c + a * self._shape[1])
+        ys = (f, f + e * self._shape[0])
+        return Geometry.Rectangle([min(xs), min(ys), max(xs), max(ys)])
+
+    # Regions and samples ##############################################
+
+    # Reduce every band over the pixels inside a geometry
+    #    Returns:
+    #        - Dictionary of band name -> reduced value
+    def reduceRegion(self, reducer, geometry=None, scale=None, crs=None, crsTransform=None,
+                     bestEffort=False, maxPixels=None, tileScale=1):
+        image = self.clip(geometry) if geometry is not None else self
+        out = {}
+        for name, data, mask in image._bands:
+            data = np.broadcast_to(np.asarray(data, dtype=np.float64), image._shape or np.shape(data))
+            mask = np.broadcast_to(mask, data.shape)
+            out[name] = reducer._values(data[mask])
+        return Dictionary(out)
+
+    # Stratified random sample of pixels (modis_local.stratified_sample)
+    #    Returns:
+    #        - FeatureCollection with one feature per sampled pixel
+    def stratifiedSample(self, numPoints, classBand=None, region=None, scale=None, projection=None,
+                         seed=0, classValues=None, classPoints=None, dropNulls=True, tileScale=1,
+                         geometries=False):
+        image = self.clip(region) if region is not None else self
+        class_band = classBand if classBand is not None else image._bands[0][0]
+        bands = {name: image.to_array(name) for name in image._names()}
+        sample = modis_local.stratified_sample(bands, bands[class_band], _raw(numPoints),
+                                               np.random.default_rng(_raw(seed)))
+        names = list(sample)
+        features = [Feature(None, {n: float(sample[n][i]) for n in names})
+                    for i in range(len(sample[class_band]))]
+        return FeatureCollection(features)
+
+    def getInfo(self):
+        return {"type": "Image",
+                "bands": [{"id": n, "data_type": str(np.asarray(d).dtype),
+                           "dimensions": list(self._shape) if self._shape else None}
+                          for n, d, _ in self._bands],
+                "properties": _info(self._props)}
+
+    def __repr__(self):
+        return "Image(bands={0}, shape={1})".format(self._names(), self._shape)
+
+######################################################################
+# Features and collections
+
+class Feature(object):
+    def __init__(self, geometry, properties=None):
+        if isinstance(geometry, Feature):
+            self._geometry, self._props = geometry._geometry, dict(geometry._props)
+            return
+        if isinstance(geometry, dict) and geometry.get("type") == "Feature":
+            properties = geometry.get("properties")
+            geometry = geometry.get("geometry")
+        self._geometry = Geometry(geometry) if isinstance(geometry, dict) else geometry
+        self._props = dict(_raw(properties) or {})
+
+    def get(self, property):
+        return _wrap(self._props.get(_raw(property)))
+
+    def set(self, *args):
+        props = dict(self._props)
+        props.update(args[0] if len(args) == 1 else {args[0]: args[1]})
+        return Feature(self._geometry, props)
+
+    def geometry(self):
+        return self._geometry
+
+    def toDictionary(self, properties=None):
+        return Dictionary({k: v for k, v in self._props.items()
+                           if properties is None or k in properties})
+
+    def serialize(self):
+        return _serialize(self)
+
+    def getInfo(self):
+        return {"type": "Feature",
+                "geometry": self._geometry.getInfo() if self._geometry is not None else None,
+                "properties": _info(self._props)}
+
+class Collection(object):
+    def __init__(self, elements, props=None):
+        self._elements = list(elements)
+        self._props = dict(props or {})
+
+    def _new(self, elements, props=None):
+        return type(self)(elements, self._props if props is None else props)
+
+    @staticmethod
+    def _from_asset(asset_id):
+        if asset_id not in _assets:
+            raise KeyError("Asset {0!r} is not registered (local_ee.add_asset)".format(asset_id))
+        return _assets[asset_id]
+
+    def map(self, algorithm, opt_dropNulls=False):
+        out = [algorithm(e) for e in self._elements]
+        return self._new([e for e in out if e is not None])
+
+    def merge(self, collection2):
+        return self._new(self._elements + collection2._elements)
+
+    def sort(self, property, ascending=True):
+        return self._new(sorted(self._elements, key=lambda e: _raw(e._props.get(property)),
+                                reverse=not ascending))
+
+    # Keep the elements whose property passes the test (equals, less_than,
+    # greater_than, not_equals, not_less_than, not_greater_than, starts_with,
+    # ends_with, contains)
+    def filterMetadata(self, name, operator, value):
+        value = _raw(value)
+        tests = {"equals": lambda v: v == value, "not_equals": lambda v: v != value,
+                 "less_than": lambda v: v is not None and v < value,
+                 "greater_than": lambda v: v is not None and v > value,
+                 "not_less_than": lambda v: v is not None and v >= value,
+                 "not_greater_than": lambda v: v is not None and v <= value,
+                 "starts_with": lambda v: str(v).startswith(value),
+                 "ends_with": lambda v: str(v).endswith(value),
+                 "contains": lambda v: value in str(v)}
+        test = tests[operator]
+        return self._new([e for e in self._elements if test(_raw(e._props.get(name)))])
+
+    def filter(self, filter):
+        return self._new([e for e in self._elements if filter._test(e._props, None)])
+
+    def filterBounds(self, geometry):
+        if geometry is None:
+            return self
+        geometry = geometry.geometry() if isinstance(geometry, (Feature, Collection)) else Geometry(geometry)
+        x0, y0, x1, y1 = geometry._bbox()
+        keep = []
+        for e in self._elements:
+            footprint = e.geometry()
+            if footprint is None:
+                keep.append(e)
+                continue
+            ex0, ey0, ex1, ey1 = footprint._bbox()
+            if ex0 <= x1 and ex1 >= x0 and ey0 <= y1 and ey1 >= y0:
+                keep.append(e)
+        return self._new(keep)
+
+    def first(self):
+        return self._elements[0] if self._elements else None
+
+    def size(self):
+        return Number(len(self._elements))
+
+    def toList(self, count, offset=0):
+        return List(self._elements[_raw(offset):_raw(offset) + _raw(count)])
+
+    def distinct(self, properties):
+        properties = [properties] if isinstance(properties, str) else list(properties)
+        seen, keep = set(), []
+        for e in self._elements:
+            key = tuple(repr(_raw(e._props.get(p))) for p in properties)
+            if key not in seen:
+                seen.add(key)
+                keep.append(e)
+        return self._new(keep)
+
+    def aggregate_array(self, property):
+        return List([e._props.get(property) for e in self._elements if property in e._props])
+
+    def aggregate_max(self, property):
+        values = [_raw(e._props.get(property)) for e in self._elements if e._props.get(property) is not None]
+        return Number(max(values)) if values else None
+
+    def aggregate_min(self, property):
+        values = [_raw(e._props.get(property)) for e in self._elements if e._props.get(property) is not None]
+        return Number(min(values)) if values else None
+
+    def aggregate_sum(self, property):
+        return Number(sum(_raw(e._props.get(property)) or 0 for e in self._elements))
+
+    def set(self, *args):
+        props = dict(self._props)
+        props.update(args[0] if len(args) == 1 else {args[0]: args[1]})
+        return self._new(self._elements, props)
+
+    def get(self, property):
+        return _wrap(self._props.get(_raw(property)))
+
+    # Reduce columns (feature properties), e.g. a histogram of a sampled band
+    #    Returns:
+    #        - Dictionary with the reducer output (e.g. "histogram")
+    def reduceColumns(self, reducer, selectors, weightSelectors=None):
+        values = [_raw(e._props.get(selectors[0])) for e in self._elements]
+        values = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        return Dictionary({reducer._name: reducer._values(values)})
+
+    # One feature with all the polygons (kept as parts of a MultiPolygon - a
+    # dissolve is not needed for bounds, filterBounds and clip)
+    def union(self, maxError=None):
+        parts = []
+        for e in self._elements:
+            geometry = e.geometry()
+            if geometry is None:
+                continue
+            if geometry._geojson["type"] == "Polygon":
+                parts.append(geometry._geojson["coordinates"])
+            elif geometry._geojson["type"] == "MultiPolygon":
+                parts.extend(geometry._geojson["coordinates"])
+        return FeatureCollection([Feature(Geometry.MultiPolygon(parts) if parts else None)])
+
+    def geometry(self):
+        boxes = [e.geometry()._bbox() for e in self._elements if e.geometry() is not None]
+        if not boxes:
+            return None
+        boxes = np.array(boxes)
+        return Geometry.Rectangle([boxes[:, 0].min(), boxes[:, 1].min(),
+                                   boxes[:, 2].max(), boxes[:, 3].max()])
+
+    def serialize(self):
+        return _serialize(self)
+
+    def getInfo(self):
+        return {"type": type(self).__name__, "features": [e.getInfo() for e in self._elements],
+                "properties": _info(self._props)}
+
+    def __repr__(self):
+        return "{0}(size={1})".format(type(self).__name__, len(self._elements))
+
+class ImageCollection(Collection):
+    # ImageCollection("asset/id"), ImageCollection(list of images) or
+    # ImageCollection(collection)
+    def __init__(self, args, props=None):
+        if isinstance(args, Collection):
+            Collection.__init__(self, args._elements, args._props if props is None else props)
+        elif isinstance(args, (str, String)):
+            Collection.__init__(self, Collection._from_asset(_raw(args)), props)
+        else:
+            Collection.__init__(self, [Image(i) if not isinstance(i, Image) else i for i in _raw(args)], props)
+
+    @staticmethod
+    def fromImages(images):
+        return ImageCollection(_raw(images))
+
+    def filterDate(self, start, end=None):
+        if isinstance(start, DateRange):
+            start, end = start.start(), start.end()
+        start = Date(start)._value
+        end = Date(end)._value if end is not None else start + _UNIT_MS["day"]
+        return self._new([e for e in self._elements
+                          if start <= _raw(e._props.get("system:time_start")) < end])
+
+    def select(self, *args):
+        return self.map(lambda image: image.select(*args))
+
+    # Per-pixel reductions over the images, ignoring masked pixels. The
+    # output keeps the band names of the images
+    def _reduce(self, reducer):
+        if not self._elements:
+            return Image()
+        first = self._elements[0]
+        shape = next((e._shape for e in self._elements if e._shape is not None), None)
+        bands = []
+        for k, name in enumerate(first._names()):
+            data = np.stack([np.broadcast_to(np.asarray(e._bands[k][1], dtype=np.float64), shape)
+                             for e in self._elements])
+            mask = np.stack([np.broadcast_to(e._bands[k][2], shape) for e in self._elements])
+            values, valid = reducer._stack(data, mask)
+            bands.append((name, values, valid))
+        return first._new(bands, {})
+
+    def sum(self):
+        return self._reduce(Reducer.sum())
+
+    def mean(self):
+        return self._reduce(Reducer.mean())
+
+    def median(self):
+        return self._reduce(Reducer.median())
+
+    def min(self):
+        return self._reduce(Reducer.min())
+
+    def max(self):
+        return self._reduce(Reducer.max())
+
+    def count(self):
+        return self._reduce(Reducer.count())
+
+    def reduce(self, reducer):
+        return self._reduce(reducer)
+
+class FeatureCollection(Collection):
+    # FeatureCollection("asset/id"), FeatureCollection(list of features /
+    # property dictionaries) or FeatureCollection(collection)
+    def __init__(self, args, props=None):
+        if isinstance(args, Collection):
+            Collection.__init__(self, args._elements, args._props if props is None else props)
+            return
+        if isinstance(args, (str, String)):
+            args = Collection._from_asset(_raw(args))
+        features = []
+        for f in args:
+            if isinstance(f, (Feature, Image)):
+                features.append(f)
+            elif isinstance(f, dict) and f.get("type") == "Feature":
+                features.append(Feature(f))
+            else:
+                features.append(Feature(None, f))
+        Collection.__init__(self, features, props)
+
+######################################################################
+# Filters and joins
+
+class Filter(object):
+    # test(left properties, right properties) -> bool; measure -> number
+    # stored by Join.saveAll (measureKey)
+    def __init__(self, test, measure=None):
+        self._test = test
+        self._measure = measure
+
+    @staticmethod
+    def equals(leftField=None, rightValue=None, rightField=None, leftValue=None):
+        return Filter._compare(lambda l, r: l == r, leftField, rightValue, rightField, leftValue)
+
+    @staticmethod
+    def eq(name, value):
+        return Filter.equals(leftField=name, rightValue=value)
+
+    @staticmethod
+    def greaterThanOrEquals(leftField=None, rightValue=None, rightField=None, leftValue=None):
+        return Filter._compare(lambda l, r: l >= r, leftField, rightValue, rightField, leftValue)
+
+    @staticmethod
+    def lessThanOrEquals(leftField=None, rightValue=None, rightField=None, leftValue=None):
+        return Filter._compare(lambda l, r: l <= r, leftField, rightValue, rightField, leftValue)
+
+    @staticmethod
+    def greaterThan(leftField=None, rightValue=None, rightField=None, leftValue=None):
+        return Filter._compare(lambda l, r: l > r, leftField, rightValue, rightField, leftValue)
+
+    @staticmethod
+    def lessThan(leftField=None, rightValue=None, rightField=None, leftValue=None):
+        return Filter._compare(lambda l, r: l < r, leftField, rightValue, rightField, leftValue)
+
+    @staticmethod
+    def maxDifference(difference, leftField=None, rightValue=None, rightField=None, leftValue=None):
+        difference = _raw(difference)
+        filt = Filter._compare(lambda l, r: abs(l - r) <= difference, leftField, rightValue,
+                               rightField, leftValue)
+        values = Filter._values(leftField, rightValue, rightField, leftValue)
+        filt._measure = lambda left, right: abs(values(left, right)[0] - values(left, right)[1])
+        return filt
+
+    @staticmethod
+    def And(*filters):
+        filters = list(filters[0]) if len(filters) == 1 and isinstance(filters[0], (list, tuple)) else filters
+        measure = next((f._measure for f in filters if f._measure is not None), None)
+        return Filter(lambda left, right: all(f._test(left, right) for f in filters), measure)
+
+    @staticmethod
+    def Or(*filters):
+        filters = list(filters[0]) if len(filters) == 1 and isinstance(filters[0], (list, tuple)) else filters
+        return Filter(lambda left, right: any(f._test(left, right) for f in filters))
+
+    @staticmethod
+    def inList(leftField=None, rightValue=None, rightField=None, leftValue=None):
+        return Filter._compare(lambda l, r: l in r, leftField, rightValue, rightField, leftValue)
+
+    @staticmethod
+    def _values(leftField, rightValue, rightField, leftValue):
+        def values(left, right):
+            l = _raw(left.get(leftField)) if leftField is not None else _raw(leftValue)
+            if rightField is not None:
+                r = _raw((right if right is not None else left).get(rightField))
+            else:
+                r = _raw(rightValue)
+            return l, r
+        return values
+
+    @staticmethod
+    def _compare(op, leftField, rightValue, rightField, leftValue):
+        values = Filter._values(leftField, rightValue, rightField, leftValue)
+
+        def test(left, right):
+            l, r = values(left, right)
+            return l is not None and r is not None and op(l, r)
+        return Filter(test)
+
+class Join(object):
+    def __init__(self, kind, **options):
+        self._kind = kind
+        self._options = options
+
+    @staticmethod
+    def inner(primaryKey="primary", secondaryKey="secondary", measureKey=None):
+        return Join("inner", primaryKey=primaryKey, secondaryKey=secondaryKey)
+
+    @staticmethod
+    def saveAll(matchesKey, ordering=None, ascending=True, measureKey=None, outer=False):
+        return Join("saveAll", matchesKey=matchesKey, ordering=ordering, ascending=ascending,
+                    measureKey=measureKey, outer=outer)
+
+    # inner: a feature per matching pair, with the pair in "primary" /
+    # "secondary". saveAll: the primary elements with their matches in a
+    # list property (elements without matches are dropped unless outer)
+    def apply(self, primary, secondary, condition):
+        o = self._options
+        if self._kind == "inner":
+            pairs = [Feature(None, {o["primaryKey"]: p, o["secondaryKey"]: s})
+                     for p in primary._elements for s in secondary._elements
+                     if condition._test(p._props, s._props)]
+            return FeatureCollection(pairs)
+
+        out = []
+        for p in primary._elements:
+            matches = [s for s in secondary._elements if condition._test(p._props, s._props)]
+            if o["ordering"] is not None:
+                matches.sort(key=lambda s: _raw(s._props.get(o["ordering"])), reverse=not o["ascending"])
+            if o["measureKey"] is not None and condition._measure is not None:
+                matches = [s.set(o["measureKey"], condition._measure(p._props, s._props)) for s in matches]
+            if matches or o["outer"]:
+                out.append(p.set(o["matchesKey"], matches))
+        return primary._new(out)
+
+######################################################################
+# Fake task service (ee.batch exports and ee.data task status)
+
+# Tasks are kept in memory. Each getTaskStatus() poll moves a task one step:
+# READY -> RUNNING -> ... -> COMPLETED after TASK_POLLS polls in RUNNING.
+# Completed toAsset exports register their image as an asset.
+TASK_POLLS = 1
+
+# Tasks READY or RUNNING at once before start() raises (None for no limit)
+MAX_TASKS = None
+
+# Started tasks: task ID -> record (description, state, polls, params, log)
+_tasks = OrderedDict()
+
+# Number of times the tasks with a description are still to fail
+_task_failures = {}
+
+class EEException(Exception):
+    pass
+
+# Make the next `times` runs of the tasks with this description fail
+def fail_task(description, times=1):
+    _task_failures[description] = times
+
+# Forget the tasks and the injected failures
+def reset_tasks():
+    _tasks.clear()
+    _task_failures.clear()
+
+class Task(object):
+    def __init__(self, kind, params):
+        self._kind = kind
+        self._params = params
+        self.id = None
+
+    def start(self):
+        active = sum(t["state"] in ("READY", "RUNNING") for t in _tasks.values())
+        if MAX_TASKS is not None and active >= MAX_TASKS:
+            raise EEException("Too many tasks already in the queue ({0})".format(active))
+        self.id = "LOCAL{0:06d}".format(len(_tasks) + 1)
+        _tasks[self.id] = {"id": self.id, "description": self._params.get("description"),
+                           "task_type": self._kind, "state": "READY", "polls": 0,
+                           "params": self._params}
+
+    def status(self):
+        return data.getTaskStatus([self.id])[0]
+
+class _ExportImage(object):
+    @staticmethod
+    def toAsset(**params):
+        return Task("EXPORT_IMAGE", dict(params, destination="asset"))
+
+    @staticmethod
+    def toDrive(**params):
+        return Task("EXPORT_IMAGE", dict(params, destination="drive"))
+
+    @staticmethod
+    def toCloudStorage(**params):
+        return Task("EXPORT_IMAGE", dict(params, destination="gcs"))
+
+class _Export(object):
+    image = _ExportImage
+
+class batch(object):
+    Export = _Export
+    Task = Task
+
+class data(object):
+    @staticmethod
+    def getTaskStatus(taskId):
+        ids = [taskId] if isinstance(taskId, str) else list(taskId)
+        out = []
+        for task_id in ids:
+            task = _tasks.get(task_id)
+            if task is None:
+                out.append({"id": task_id, "state": "UNKNOWN"})
+                continue
+            _advance(task)
+            status = {k: task[k] for k in ("id", "description", "task_type", "state")}
+            if "error_message" in task:
+                status["error_message"] = task["error_message"]
+            out.append(status)
+        return out
+
+    # Metadata of one asset
+    @staticmethod
+    def getAsset(asset_id):
+        if asset_id not in _assets:
+            raise EEException("Asset not found: {0}".format(asset_id))
+        return {"name": asset_id, "id": asset_id, "updateTime": _asset_times[asset_id]}
+
+    # Assets directly in a folder, a page at a time (pageToken is the offset)
+    @staticmethod
+    def listAssets(params):
+        parent = params["parent"].rstrip("/") + "/"
+        names = sorted(a for a in _assets if a.startswith(parent) and "/" not in a[len(parent):])
+        start = int(params.get("pageToken") or 0)
+        end = start + int(params.get("pageSize") or 1000)
+        page = []
+        for name in names[start:end]:
+            value = _assets[name]
+            if isinstance(value, Image):
+                kind = "IMAGE"
+            elif value and all(isinstance(v, Image) for v in value):
+                kind = "IMAGE_COLLECTION"
+            else:
+                kind = "TABLE"
+            page.append({"type": kind, "name": name, "id": name, "updateTime": _asset_times[name]})
+        out = {"assets": page}
+        if end < len(names):
+            out["nextPageToken"] = str(end)
+        return out
+
+    @staticmethod
+    def getTaskList():
+        return [{k: t[k] for k in ("id", "description", "task_type", "state")} for t in _tasks.values()]
+
+def _advance(task):
+    if task["state"] == "READY":
+        task["state"] = "RUNNING"
+        return
+    if task["state"] != "RUNNING":
+        return
+    task["polls"] += 1
+    if task["polls"] < TASK_POLLS:
+        return
+    if _task_failures.get(task["description"], 0) > 0:
+        _task_failures[task["description"]] -= 1
+        task["state"] = "FAILED"
+        task["error_message"] = "Injected failure"
+        return
+    task["state"] = "COMPLETED"
+    params = task["params"]
+    if params.get("destination") == "asset" and params.get("assetId"):
+        add_asset(params["assetId"], params["image"])
@@ -12,8 +12,8 @@
 #     2: 'clear_views': Number of clear views (number of times a pixel had a clear view (ie not flagged as cloud) during the event)
 #     3: 'clear_perc': Percent clear views (clear views normalized by number of images)
 
-import ee
 from flood_detection import modis_toolbox
+from flood_detection.session import ee
 from flood_detection.utils import misc, otsu
 
 def dfo(roi, began, ended, threshold, my_comp='3Day', get_max=False):
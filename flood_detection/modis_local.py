@@ -0,0 +1,252 @@
+# Local version of the DFO flood detection algorithm (modis.dfo)
+
+# Runs the same steps as modis.dfo on a local stack of MODIS images held as
+# NumPy arrays, instead of building an Earth Engine graph. This lets events be
+# reprocessed in bulk on our own machines, without the GEE queue.
+
+# Input Parameters:
+#  - 'stack' - dictionary of (time, y, x) arrays with the bands of the joined
+#              MODIS GQ/GA images (Terra and Aqua together, any order):
+#              "red_250m", "nir_250m" (GQ) and "red_500m", "blue", "green",
+#              "swir", "state_1km" (GA, already resampled onto the 250m grid).
+#              Missing reflectance is NaN.
+#  - 'times' - acquisition date of each image (anything np.datetime64 accepts)
+#  - 'began' - the start date of the event as a String
+#  - 'ended' - the end date of the event as a String
+#  - 'threshold' - "standard" or "otsu"
+#  - 'my_comp' - "2Day" or "3Day"
+#  - 'roi' - optional boolean (y, x) mask of the area of interest
+#  - 'perm_water' - JRC yearly permanent water (1 = permanent water) on the
+#                   same grid; only needed for the "otsu" threshold
+#  - 'get_max' - option to add the maximum flood extent image, default 'False'
+
+# The output is a dictionary with the same 4 bands as modis.dfo:
+#     'flooded': Flood Extent (1 = flood, 0 = not flood)
+#     'duration': number of days in event that each pixel was flooded
+#     'clear_views': Number of clear views during the event
+#     'clear_perc': Percent clear views (clear views normalized by number of images)
+# plus the image properties ('began', 'ended', 'threshold_type', thresholds).
+
+import warnings
+
+import numpy as np
+
+from flood_detection.utils import otsu, qa
+
+# Milliseconds in a day - the composites join images by time difference
+DAY_MS = 1000 * 60 * 60 * 24
+
+# Aqua started on 2002-07-04. Before that only Terra images are available.
+AQUA_START = np.datetime64("2002-07-04", "ms")
+
+# Pan-sharpen the 500m bands with the 250m red band (modis_toolbox.pan_sharpen)
+def pan_sharpen(stack):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratio = stack["red_500m"] / stack["red_250m"]
+        sharp = {band: stack[band] / ratio for band in ("blue", "green", "swir")}
+    sharp.update({band: stack[band] for band in ("red_250m", "nir_250m", "state_1km")})
+    return sharp
+
+# NIR/red ratio used by the DFO thresholds (modis_toolbox.b1b2_ratio)
+def b1b2_ratio(stack):
+    return (stack["nir_250m"] + 13.5) / (stack["red_250m"] + 1081.1)
+
+# Decode the state_1km QA bits (modis_toolbox.add_qa_bands) into one packed
+# "qa_flags" band, with a lookup table (utils/qa.py). qa.flag_planes() gives
+# the cloud_state / cloud_shadow / ice_flag / snow_flag bands if needed
+def add_qa_bands(stack):
+    stack["qa_flags"] = qa.decode(stack["state_1km"])
+    return stack
+
+# Boolean mask of the pixels that are not cloudy, shadowed, ice or snow
+# (modis_toolbox.qa_mask)
+def qa_mask(stack):
+    return qa.usable(stack["qa_flags"])
+
+# Water flag for every image - a pixel is water when it passes the b1b2 ratio,
+# band 1 and band 7 thresholds (water_flag in modis.dfo)
+def water_flag(stack, thresh_b1b2, thresh_b7):
+    with np.errstate(invalid="ignore"):
+        flag = ((stack["b1b2_ratio"] < thresh_b1b2) & (stack["red_250m"] < 2027)
+                & (stack["swir"] < thresh_b7))
+    return flag.astype(np.uint8)
+
+# 2 or 3-day composites (join_previous_days + dfo_flood_water in modis.dfo).
+# Each image is joined with every image from the previous lag_days days
+# (including itself and the other satellite's image of the same day). A pixel is
+# flood water where at least comp_days of the joined images are water.
+#    Args:
+#        water: (time, y, x) water flags, sorted by time
+#        times_ms: acquisition times in milliseconds, sorted
+#        lag_days: 2 for "3Day", 1 for "2Day"
+#        comp_days: number of water flags needed
+#    Returns:
+#        - (time, y, x) uint8 flood water flags
+def flood_water(water, times_ms, lag_days, comp_days):
+    # Running total over time, so the sum over any window is a difference
+    cumulative = np.concatenate([np.zeros((1,) + water.shape[1:], dtype=np.int32),
+                                 np.cumsum(water, axis=0, dtype=np.int32)])
+    first = np.searchsorted(times_ms, times_ms - DAY_MS * lag_days, side="left")
+    last = np.searchsorted(times_ms, times_ms, side="right")
+    composite = cumulative[last] - cumulative[first]
+    return (composite >= comp_days).astype(np.uint8)
+
+# Collapse the composites into flood extent and flood duration
+# (flood_extent_freq in modis.dfo). Terra and Aqua give two composites per day,
+# hence the division by 2.
+def flood_extent_freq(flood_coll):
+    duration = (flood_coll.sum(axis=0) // 2).astype(np.uint16)
+    flooded = (duration >= 1).astype(np.uint8)
+    return flooded, duration
+
+# Number and percentage of clear views during the event (get_clear_views in
+# modis.dfo). Images without a state_1km value at a pixel are not observations
+# of it: the percentage is over the number of valid observations of each
+# pixel, NaN where there are none
+def get_clear_views(stack):
+    clear = qa.clear_view(stack["qa_flags"])
+    clear_views = clear.sum(axis=0).astype(np.uint16)
+    total_obs = qa.valid(stack["qa_flags"]).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        clear_perc = np.where(total_obs > 0, clear_views / np.maximum(total_obs, 1), np.nan).astype(np.float32)
+    return clear_views, clear_perc
+
+# Stratified random sample of pixels (stratifiedSample in modis.dfo). Only
+# pixels where the class band and all sample bands hold data are sampled.
+#    Args:
+#        bands: dictionary of (y, x) arrays to sample
+#        strata: (y, x) class values, NaN where masked
+#        num_points: number of points per class
+#        rng: np.random.Generator
+#    Returns:
+#        - dictionary of 1-D arrays with the sampled values
+def stratified_sample(bands, strata, num_points, rng):
+    valid = ~np.isnan(strata)
+    for values in bands.values():
+        valid &= ~np.isnan(values)
+    picked = []
+    for value in np.unique(strata[valid]):
+        cells = np.flatnonzero(valid & (strata == value))
+        picked.append(rng.choice(cells, size=min(num_points, cells.size), replace=False))
+    picked = np.concatenate(picked) if picked else np.array([], dtype=np.int64)
+    return {name: values.ravel()[picked] for name, values in bands.items()}
+
+# Histogram with bucket means, in the layout of ee.Reducer.histogram()
+def histogram(values, max_buckets=255):
+    values = values[~np.isnan(values)]
+    counts, edges = np.histogram(values, bins=max_buckets)
+    bucket = np.clip(np.searchsorted(edges, values, side="right") - 1, 0, max_buckets - 1)
+    sums = np.bincount(bucket, weights=values, minlength=max_buckets)
+    centres = (edges[:-1] + edges[1:]) / 2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(counts > 0, sums / np.maximum(counts, 1), centres)
+    return {"histogram": counts, "bucketMeans": means}
+
+def dfo(stack, times, began, ended, threshold, my_comp='3Day', roi=None,
+        perm_water=None, get_max=False, seed=0):
+
+    # STEP 1 - SELECT THE IMAGES OF THE EVENT
+    # "Began" and "Ended" are buffered by 2 days at the start and 3 days at the
+    # end, as in modis.dfo, so the first day of the flood is part of a full
+    # composite. Images are sorted by time (Terra and Aqua merged).
+    times = np.asarray(times, dtype="datetime64[ms]")
+    start = np.datetime64(began, "ms") - np.timedelta64(2, "D")
+    end = np.datetime64(ended, "ms") + np.timedelta64(3, "D")
+    keep = np.flatnonzero((times >= start) & (times < end))
+    keep = keep[np.argsort(times[keep], kind="stable")]
+    times_ms = times[keep].astype(np.int64)
+    modis = {band: np.asarray(values)[keep] for band, values in stack.items()}
+
+    # STEP 2 - PRE-PROCESS: pan-sharpen, NIR/red ratio and QA bands
+    modis = pan_sharpen(modis)
+    modis["b1b2_ratio"] = b1b2_ratio(modis)
+    modis = add_qa_bands(modis)
+    print("Collected and pre-processed MODIS Images")
+
+    # STEP 3.1 - SELECT thresholds
+    if threshold == "standard":
+        thresh_dict = {"b1b2": 0.70, "b7": 675.00, 'base_res': None}
+    elif threshold == "otsu":
+        if perm_water is None:
+            raise ValueError("'otsu' thresholds need the 'perm_water' layer")
+
+        # Median composite of the QA-masked images, clipped to the roi
+        clear = qa_mask(modis)
+        frame = {}
+        for band in ("red_250m", "b1b2_ratio", "swir"):
+            masked = np.where(clear, modis[band], np.nan)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                frame[band] = np.nanmedian(masked, axis=0)
+            if roi is not None:
+                frame[band] = np.where(roi, frame[band], np.nan)
+
+        # Strata: permanent water, masked where the composite has no data
+        strata = np.where((perm_water == 1) & ~np.isnan(frame["red_250m"]), 1.0, np.nan)
+
+        # Keep the SWIR histogram bi-modal - drop implausible reflectances
+        swir = frame["swir"]
+        with np.errstate(invalid="ignore"):
+            frame["swir"] = np.where((swir > -500) & (swir < 3000), swir, np.nan)
+
+        # Sample, build the histograms and run Otsu
+        sample = stratified_sample({"b1b2_ratio": frame["b1b2_ratio"], "swir": frame["swir"]},
+                                   strata, 2500, np.random.default_rng(seed))
+        # Both histograms have the same number of buckets, so one Otsu call
+        # thresholds them together
+        hists = [histogram(sample["b1b2_ratio"]), histogram(sample["swir"])]
+        b1b2_thresh, swir_thresh = otsu.get_threshold_local(
+            [h["histogram"] for h in hists], [h["bucketMeans"] for h in hists])
+        thresh_dict = {'b1b2': float(b1b2_thresh), 'b7': float(swir_thresh),
+                       'base_res': None}
+
+        print("Calculated thresholds for Otsu: {0}".format(thresh_dict))
+
+    else:
+        raise ValueError("'threshold' options are 'standard' or 'otsu'")
+
+    # STEP 3.2 - APPLY THRESHOLDS AND BUILD THE 2 OR 3-DAY COMPOSITES
+    # Terra & Aqua (post 2002-07-04): flood water threshold is 3 for 3-day
+    # composites and 2 for 2-day composites. Terra Only: 2 and 1.
+    water = water_flag(modis, thresh_dict["b1b2"], thresh_dict["b7"])
+    lag_days = {"3Day": 2, "2Day": 1}
+    if np.datetime64(began, "ms") >= AQUA_START:
+        dfo_comp = {"3Day": 3, "2Day": 2}
+    else:
+        dfo_comp = {"3Day": 2, "2Day": 1}
+    flood_coll = flood_water(water, times_ms, lag_days[my_comp], dfo_comp[my_comp])
+
+    # STEP 3.3 - COLLAPSE COMPOSITES INTO A FINAL FLOOD MAP
+    flooded, duration = flood_extent_freq(flood_coll)
+
+    # STEP 3.4 - CALCULATE CLEAR DAYS
+    clear_views, clear_perc = get_clear_views(modis)
+
+    dfo_final = {"flooded": flooded, "duration": duration,
+                 "clear_views": clear_views, "clear_perc": clear_perc}
+
+    # STEP 3.4a - ADD MAX IMG: the composite with the largest flood extent
+    if get_max == True:
+        inside = flood_coll if roi is None else flood_coll * roi
+        max_index = int(np.argmax(inside.reshape(inside.shape[0], -1).sum(axis=1)))
+        dfo_final["max_img"] = flood_coll[max_index]
+        dfo_final["max_img_date"] = str(times[keep][max_index].astype("datetime64[D]"))
+    elif get_max != False:
+        raise ValueError("'max_img' options are 'True' or 'False'")
+
+    # STEP 3.5 - PREP FINAL IMAGE: clip to the roi and add the properties
+    if roi is not None:
+        for band in ("flooded", "duration", "clear_views", "max_img"):
+            if band in dfo_final:
+                dfo_final[band] = np.where(roi, dfo_final[band], 0).astype(dfo_final[band].dtype)
+        dfo_final["clear_perc"] = np.where(roi, clear_perc, np.nan).astype(np.float32)
+
+    dfo_final.update({"began": str(np.datetime64(began, "D")),
+                      "ended": str(np.datetime64(ended, "D")),
+                      "threshold_type": threshold,
+                      "threshold_b1b2": round(thresh_dict["b1b2"], 3),
+                      "threshold_b7": round(thresh_dict["b7"], 2),
+                      "composite_type": str(dfo_comp[my_comp]) + "Day"})
+
+    print("DFO Flood Dectection Complete")
+    return dfo_final
@@ -9,10 +9,10 @@
 # NEED TO LOAD THESE TO RUN DFO AND OTSU SCRIPTS
 # NOTE: SOME OF THESE ARE SET UP SPECIFICALLY FOR THE DFO AND OTSU SCRIPTS
 
-import ee
-ee.Initialize(project='moz-hydrafloods')
 import math
 
+from flood_detection.session import ee
+
 # Function that renames the bands in MODIS GQ (250-m) collections to
 # readable band names
 def dfo_bands_gq(collection):
@@ -0,0 +1,69 @@
+# Earth Engine session
+
+# The flood_detection modules use Earth Engine through `ee` from this module
+# instead of importing and initialising the ee package themselves. The
+# session is initialised on first use (the first attribute looked up on `ee`),
+# once, under a lock - importing flood_detection does not contact Earth
+# Engine, and code that never touches ee (modis_local, the NumPy parts of
+# otsu) runs offline. configure() points the session at another project or
+# at a stand-in module such as local_ee.
+#
+#     from flood_detection.session import ee
+#     img = ee.Image("MODIS/061/MOD09GQ/...")    # ee.Initialize() happens here
+
+import importlib
+import threading
+
+# Default Earth Engine project
+PROJECT = 'moz-hydrafloods'
+
+_lock = threading.Lock()
+_settings = {"project": PROJECT, "module": None}
+_module = None
+
+# Set the project and module of the session. Takes effect on the next use -
+# a session already initialised is initialised again
+#    Args:
+#        project: Earth Engine project
+#        module: module to use as ee (e.g. flood_detection.local_ee); None
+#                imports the ee package
+def configure(project=PROJECT, module=None):
+    global _module
+    with _lock:
+        _settings["project"] = project
+        _settings["module"] = module
+        _module = None
+
+# Initialise the session now (e.g. in a script, right after ee.Authenticate())
+#    Args:
+#        project: Earth Engine project; None keeps the configured one
+#    Returns:
+#        - the initialised ee module
+def initialize(project=None):
+    if project is not None and project != _settings["project"]:
+        configure(project, _settings["module"])
+    return get()
+
+# The initialised ee module
+def get():
+    global _module
+    module = _module
+    if module is None:
+        with _lock:
+            if _module is None:
+                module = _settings["module"] or importlib.import_module("ee")
+                module.Initialize(project=_settings["project"])
+                _module = module
+            module = _module
+    return module
+
+# Stand-in for the ee module: attributes are looked up on the initialised module
+class _EarthEngine(object):
+    def __getattr__(self, name):
+        return getattr(get(), name)
+
+    def __repr__(self):
+        state = "initialised" if _module is not None else "not initialised"
+        return "<Earth Engine session ({0}, {1})>".format(_settings["project"], state)
+
+ee = _EarthEngine()
@@ -0,0 +1,80 @@
+# Asset listing and export fingerprints
+
+# An export is only worth submitting when its output is missing or would
+# differ. Each export gets a fingerprint of what defines its output (source
+# asset / image ID and version, region, scale, CRS, data type); the scheduler
+# queue (scheduler.py) remembers the fingerprint of every completed export and
+# skips a request with the same fingerprint. The asset listing gives the
+# version (updateTime) of the source assets, so an asset that was re-made is
+# exported again. Listing pages through ee.data.listAssets and is cached on
+# disk, as a folder can hold thousands of DFO_* assets.
+
+import hashlib
+import json
+import os
+import time
+
+from flood_detection.session import ee
+
+# Assets per listAssets page
+PAGE_SIZE = 1000
+
+# Age (seconds) after which a cached listing is fetched again
+MAX_AGE = 3600
+
+# All the assets in a folder (paginated), with an on-disk cache
+#    Args:
+#        parent: asset folder, e.g. "projects/moz-hydrafloods/assets"
+#        cache_file: JSON file of the cached listing; None always lists
+#        max_age: age (seconds) of the cache before it is refreshed
+#    Returns:
+#        - list of asset dictionaries from ee.data.listAssets ("name", "type",
+#          "updateTime", ...)
+def list_assets(parent, cache_file=None, max_age=MAX_AGE):
+    parent = parent.rstrip("/")
+    if cache_file is not None and os.path.exists(cache_file):
+        with open(cache_file) as f:
+            cached = json.load(f)
+        if cached.get("parent") == parent and time.time() - cached.get("listed", 0) < max_age:
+            return cached["assets"]
+
+    assets, page_token = [], None
+    while True:
+        params = {"parent": parent, "pageSize": PAGE_SIZE}
+        if page_token:
+            params["pageToken"] = page_token
+        page = ee.data.listAssets(params)
+        assets.extend(page.get("assets", []))
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            break
+
+    if cache_file is not None:
+        folder = os.path.dirname(cache_file)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"parent": parent, "listed": time.time(), "assets": assets}, f)
+        os.replace(tmp_file, cache_file)
+    return assets
+
+# Fingerprint of an export request
+#    Args:
+#        source: asset / image ID (or a description of the source image)
+#        region: export region (coordinates, or a description such as
+#                "footprint")
+#        scale: resolution (m)
+#        crs: output CRS (None for the default)
+#        dtype: output data type (e.g. "uint16")
+#        version: version of the source, e.g. the asset updateTime
+#        settings: optional dictionary of other export settings that change
+#                  the output (e.g. folder, file name prefix, maxPixels)
+#    Returns:
+#        - hex string
+def export_fingerprint(source, region, scale, crs=None, dtype=None, version=None, settings=None):
+    request = {"source": source, "region": region, "scale": scale, "crs": crs,
+               "dtype": dtype, "version": version}
+    if settings:
+        request["settings"] = settings
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode("utf-8")).hexdigest()
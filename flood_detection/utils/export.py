@@ -2,8 +2,8 @@
 # Export functions
 # These are different functions to export the maps to assets or cloud buckets
 
-import ee
-ee.Initialize(project='moz-hydrafloods')
+from flood_detection.session import ee
+from flood_detection.utils import assets, scheduler
 
 # --------------------------------------------------------
 # This function is used to export maps that were created from DFO events with an
@@ -13,20 +13,40 @@ ee.Initialize(project='moz-hydrafloods')
     #        bounds: the ROI
     #        save_path: the asset path into which you'd like to save the image
     #        res: the resolution (in meters) per pixel of the image
+    #        event_info: optional properties of the event already fetched by
+    #                    fetch.event_table() (with "region" - the bounds
+    #                    coordinates); the export then makes no getInfo() calls
+    #        queue: optional export queue (scheduler.open_queue) - the export
+    #               is submitted to it instead of being started right away
+    #        existing_assets: optional set of the asset names already in
+    #                         save_path (listed once by the caller); listed
+    #                         here if not given. An asset that exists is not
+    #                         exported again (GEE cannot overwrite it)
     #    Returns:
-    #        - Saves the image into the GEE Code Editor Asset path
+    #        - Saves the image into the GEE Code Editor Asset path; returns
+    #          False if the asset already exists (nothing exported)
 # --------------------------------------------------------
-def to_asset(flood_img, bounds, save_path, res=250):
+def to_asset(flood_img, bounds, save_path, res=250, event_info=None, queue=None, existing_assets=None):
 
-    # This Fusion Table is the QC database from 11/12/18
-    # dfo_props = ee.FeatureCollection('ft:1P_wUQQJqghdnN3UMAcXDlrbQFpJWN-md2eH1WprS')
+    if event_info is not None:
+        dfo_id = event_info['ID']
+        props = event_info
+        start_formatted = event_info['began_ymd']
+        end_formatted = event_info['ended_ymd']
+        region = event_info['region']
+    else:
+        # This Fusion Table is the QC database from 11/12/18
+        # dfo_props = ee.FeatureCollection('ft:1P_wUQQJqghdnN3UMAcXDlrbQFpJWN-md2eH1WprS')
+
+        # This Fustino Table is the DFO Database from July 16th, 2019
+        dfo_props = ee.FeatureCollection("projects/moz-hydrafloods/assets/emdat_moz_flood_shp")
+        dfo_id = flood_img.get('id').getInfo()
+        props = ee.Feature(dfo_props.filterMetadata('ID', 'equals', dfo_id).first())\
+                                    .getInfo()['properties']
+        start_formatted = ee.Date(props.get('BEGAN')).format('yyyyMMdd').getInfo()
+        end_formatted = ee.Date(props.get('ENDED')).format('yyyyMMdd').getInfo()
+        region = bounds.getInfo()['coordinates']
 
-    # This Fustino Table is the DFO Database from July 16th, 2019
-    dfo_props = ee.FeatureCollection("projects/moz-hydrafloods/assets/emdat_moz_flood_shp")
-    dfo_id = flood_img.get('id').getInfo()
-    props = ee.Feature(dfo_props.filterMetadata('ID', 'equals', dfo_id).first())\
-                                .getInfo()['properties']
-    
     print(props)
     print("Printed properties")
 
@@ -42,12 +62,16 @@ def to_asset(flood_img, bounds, save_path, res=250):
         dfo_other_country = props.get('OTHERCOUNT')
 
     # ------------------------ EXPORT RESULTS-------------------------- #
-    start_formatted = ee.Date(props.get('BEGAN')).format('yyyyMMdd').getInfo()
-    end_formatted = ee.Date(props.get('ENDED')).format('yyyyMMdd').getInfo()
     save_name = "DFO_" + str(dfo_id) + "_From_" + str(start_formatted) + "_to_" + str(end_formatted) 
     save_asset = str(save_path + "/" + save_name)
 
-    task = ee.batch.Export.image.toAsset(
+    if existing_assets is None:
+        existing_assets = {a["name"] for a in assets.list_assets(save_path)}
+    if save_asset in existing_assets:
+        print("Asset {0} already exists - not exported again".format(save_asset))
+        return False
+
+    params = dict(
         image=flood_img.set({
                             #'glide_index': ee.String(glide_number),
                              #'dfo_country': ee.String(props.get('COUNTRY')),
@@ -61,12 +85,17 @@ def to_asset(flood_img, bounds, save_path, res=250):
                              #'dfo_displaced': ee.Number(props.get("DISPLACED"))}),
         description="ExportToAsset DFO" + str(dfo_id),
         assetId=save_asset,
-        region=bounds.getInfo()['coordinates'],
+        region=region,
         scale=res,
         maxPixels=1e12
     )
+    if queue is not None:
+        fingerprint = assets.export_fingerprint(save_asset, region, res)
+        scheduler.submit(queue, save_asset, "image.toAsset", params, fingerprint)
+        return True
+    task = ee.batch.Export.image.toAsset(**params)
     task.start()
-    return
+    return True
 
 # --------------------------------------------------------
 # This function is an exact copy of the script above except
@@ -78,12 +107,13 @@ def to_asset(flood_img, bounds, save_path, res=250):
     #     bounds: the ROI
     #     cloud_path: the name of the Cloud Bucket to upload the file (as a string)
     #     res: the resolution (in meters) per pixel of the image
+    #     queue: optional export queue (scheduler.open_queue)
     #
     # Returns:
     #     - Saves the image into the GEE Code Editor Asset path
 
 # --------------------------------------------------------
-def to_gcs(flood_img, bounds, cloud_path, name_prefix='DFO', res=250):
+def to_gcs(flood_img, bounds, cloud_path, name_prefix='DFO', res=250, queue=None):
 
     start_formatted = ee.Date(flood_img.get('began')).format('yyyyMMdd').getInfo()
     end_formatted = ee.Date(flood_img.get('ended')).format('yyyyMMdd').getInfo()
@@ -92,7 +122,7 @@ def to_gcs(flood_img, bounds, cloud_path, name_prefix='DFO', res=250):
     save_csb = str(save_name)
 
     # ------------ EXPORT RESULTS! ------------ #
-    task = ee.batch.Export.image.toCloudStorage(
+    params = dict(
         image=flood_img.toFloat(),
         description="ExportToCSB DFO" + str(index),
         bucket=cloud_path,
@@ -101,5 +131,11 @@ def to_gcs(flood_img, bounds, cloud_path, name_prefix='DFO', res=250):
         scale=res,
         maxPixels=1e12
     )
+    if queue is not None:
+        fingerprint = assets.export_fingerprint(cloud_path + "/" + save_csb, params['region'], res,
+                                                dtype="float")
+        scheduler.submit(queue, cloud_path + "/" + save_csb, "image.toCloudStorage", params, fingerprint)
+        return
+    task = ee.batch.Export.image.toCloudStorage(**params)
     task.start()
     return
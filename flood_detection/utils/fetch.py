@@ -0,0 +1,116 @@
+# Batched, cached client fetches (getInfo) for the flood detection scripts
+
+# Every getInfo() is a blocking round trip to Earth Engine. The properties and
+# dates of all the events are fetched in one request instead of several per
+# event. The heavier values of each event (watershed bounds, countries) are
+# fetched a few events at a time, so one event that fails or times out only
+# loses its own values. Results are kept on disk, keyed by the serialised ee
+# expression and the version of the event table (its asset updateTime) - a
+# rerun with the same table and expressions does not contact Earth Engine at
+# all, and an edited table is fetched again.
+
+import hashlib
+import json
+import os
+
+from flood_detection.session import ee
+
+# Events per request for the extra values of event_table()
+EXTRAS_CHUNK = 5
+
+# getInfo() with an on-disk cache
+#    Args:
+#        obj: ee object (ComputedObject)
+#        cache_folder: folder of the cached results; None always fetches
+#        version: optional version of the inputs (e.g. the updateTime of the
+#                 source asset) - a cached result of another version is not used
+#    Returns:
+#        - the getInfo() result
+def get_info(obj, cache_folder=None, version=None):
+    if cache_folder is None:
+        return obj.getInfo()
+
+    request = obj.serialize()
+    if version is not None:
+        request += "\n" + str(version)
+    key = hashlib.sha256(request.encode("utf-8")).hexdigest()
+    cache_file = os.path.join(cache_folder, key + ".json")
+    if os.path.exists(cache_file):
+        with open(cache_file) as f:
+            return json.load(f)
+
+    info = obj.getInfo()
+    os.makedirs(cache_folder, exist_ok=True)
+    tmp_file = cache_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(info, f)
+    os.replace(tmp_file, cache_file)
+    return info
+
+# Version of an asset (its updateTime), for the cache keys of get_info()
+def asset_version(asset_id):
+    return ee.data.getAsset(asset_id).get("updateTime")
+
+# Properties of every event of an event table
+#    Args:
+#        event_db: ee.FeatureCollection of events with "ID", "BEGAN" and "ENDED"
+#        extras: optional function ee.Feature -> dictionary of ee values to
+#                fetch with each event (e.g. watershed bounds, countries)
+#        cache_folder: see get_info()
+#        version: version of the event table (see asset_version())
+#        chunk_size: events per request for the extras
+#    Returns:
+#        - dictionary event ID -> properties: the table properties, "began" /
+#          "ended" (yyyy-MM-dd), "began_ymd" / "ended_ymd" (yyyyMMdd) and the
+#          extras. An event whose extras could not be fetched has the error
+#          message in "extras_error" instead
+def event_table(event_db, extras=None, cache_folder=None, version=None, chunk_size=EXTRAS_CHUNK):
+    def event_properties(flood_event):
+        flood_event = ee.Feature(flood_event)
+        began = ee.Date(flood_event.get("BEGAN"))
+        ended = ee.Date(flood_event.get("ENDED"))
+        props = {"began": began.format("yyyy-MM-dd"), "ended": ended.format("yyyy-MM-dd"),
+                 "began_ymd": began.format("yyyyMMdd"), "ended_ymd": ended.format("yyyyMMdd")}
+        return ee.Feature(None, flood_event.toDictionary().combine(props))
+
+    info = get_info(event_db.map(event_properties), cache_folder, version)
+    table = {_event_id(f["properties"]["ID"]): f["properties"] for f in info["features"]}
+    if extras is None:
+        return table
+
+    ids = [f["properties"]["ID"] for f in info["features"]]
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        try:
+            fetched = _event_extras(event_db, chunk, extras, cache_folder, version)
+        except Exception as e:
+            if len(chunk) == 1:
+                table[_event_id(chunk[0])]["extras_error"] = str(e)
+                continue
+            # One of the events may be at fault - fetch them one by one
+            fetched = {}
+            for event_id in chunk:
+                try:
+                    fetched.update(_event_extras(event_db, [event_id], extras, cache_folder, version))
+                except Exception as e:
+                    table[_event_id(event_id)]["extras_error"] = str(e)
+        for event_id, values in fetched.items():
+            table[event_id].update(values)
+    return table
+
+# Extra values of some events, in one request
+def _event_extras(event_db, ids, extras, cache_folder, version):
+    def event_values(flood_event):
+        flood_event = ee.Feature(flood_event)
+        return ee.Feature(None, extras(flood_event)).set("ID", flood_event.get("ID"))
+
+    info = get_info(event_db.filter(ee.Filter.inList("ID", ids)).map(event_values), cache_folder, version)
+    out = {}
+    for f in info["features"]:
+        values = dict(f["properties"])
+        out[_event_id(values.pop("ID"))] = values
+    return out
+
+# Event IDs come back as numbers (int or float)
+def _event_id(value):
+    return int(value) if float(value).is_integer() else value
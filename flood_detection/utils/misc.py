@@ -1,7 +1,5 @@
 # Import packages
-import ee
-
-ee.Initialize(project='moz-hydrafloods')
+from flood_detection.session import ee
 
 # Series of functions to extract overlapping watersheds from roi region. We use
 # HydroSheds database provided a different levels. Also - functions for islands
@@ -53,15 +51,19 @@ def get_jrc_yearly_perm(began, roi):
                     .select(['remapped'],['jrc_perm_yearly'])
     return jrc_perm.updateMask(jrc_perm)
 
-def get_countries (roi):
+# Country codes and names of the LSIB countries that intersect the roi, as
+# ee.Lists (no request is made - see utils/fetch.py to batch the fetch)
+def country_lists(roi):
     countries = ee.FeatureCollection("USDOS/LSIB/2017")
     img_country = countries.filterBounds(roi)
+    cc_list = img_country.distinct('OBJECTID').aggregate_array('OBJECTID')
+    country_list = img_country.distinct('COUNTRY_NA').aggregate_array('COUNTRY_NA')
+    return cc_list, country_list
 
-    cc_list = img_country.distinct('OBJECTID').aggregate_array('OBJECTID').getInfo()
-    cc_list = [str(c) for c in cc_list]
+def get_countries (roi):
+    cc_list, country_list = country_lists(roi)
 
-    country_list = img_country.distinct('COUNTRY_NA').aggregate_array('COUNTRY_NA').getInfo()
-    country_list = [str(c) for c in country_list]
+    cc_list = [str(c) for c in cc_list.getInfo()]
+    country_list = [str(c) for c in country_list.getInfo()]
 
     return cc_list, country_list
-    
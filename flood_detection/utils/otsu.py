@@ -1,31 +1,60 @@
-
 # coding: utf-8
 
 # Otsu thresholding functions for choosing thresholds for DFO flood detection
-import ee
-ee.Initialize()
+import numpy as np
+
+from flood_detection.session import ee
 
 # Compute between sum of squares, where each mean partitions the data.
+# Splitting after bucket i puts buckets 0..i in class A and the rest in class
+# B. The counts and sums of class A for every split are running sums over the
+# buckets, so all candidate BSS values come out of one pass (accum) instead of
+# re-reducing a slice of the histogram for every i.
 def get_threshold(histogram):
     counts = ee.Array(ee.Dictionary(histogram).get('histogram'))
     means = ee.Array(ee.Dictionary(histogram).get('bucketMeans'))
-    size = means.length().get([0])
     total = counts.reduce(ee.Reducer.sum(), [0]).get([0])
     summed = means.multiply(counts).reduce(ee.Reducer.sum(), [0]).get([0])
     mean = summed.divide(total)
 
-    indices = ee.List.sequence(1, size)
-
-    def calc_bss(i):
-        aCounts = counts.slice(0, 0, i)
-        aCount = aCounts.reduce(ee.Reducer.sum(), [0]).get([0])
-        aMeans = means.slice(0, 0, i)
-        aMean = aMeans.multiply(aCounts).reduce(ee.Reducer.sum(), [0]).get([0]).divide(aCount)
-        bCount = total.subtract(aCount)
-        bMean = summed.subtract(aCount.multiply(aMean)).divide(bCount)
-        return aCount.multiply(aMean.subtract(mean).pow(2)).add(bCount.multiply(bMean.subtract(mean).pow(2)))
-
-    bss = indices.map(calc_bss)
+    aCount = counts.accum(0)
+    aSum = means.multiply(counts).accum(0)
+    aMean = aSum.divide(aCount)
+    bCount = aCount.multiply(-1).add(total)
+    bMean = aSum.multiply(-1).add(summed).divide(bCount)
+    bss = aCount.multiply(aMean.subtract(mean).pow(2))\
+                .add(bCount.multiply(bMean.subtract(mean).pow(2)))
 
     # Return the mean value corresponding to the maximum BSS.
     return means.sort(bss).get([-1])
+
+# Local (NumPy) version of get_threshold for many histograms at once
+#    Args:
+#        counts: bucket counts, shape (..., n_buckets) - one histogram per row
+#                (e.g. per band, tile or event)
+#        means: bucket means, same shape as counts
+#    Returns:
+#        - array of thresholds, shape (...). NaN for empty histograms
+def get_threshold_local(counts, means):
+    counts = np.asarray(counts, dtype=np.float64)
+    means = np.asarray(means, dtype=np.float64)
+    counts, means = np.broadcast_arrays(counts, means)
+
+    aCount = np.cumsum(counts, axis=-1)
+    aSum = np.cumsum(counts * means, axis=-1)
+    total = aCount[..., -1:]
+    summed = aSum[..., -1:]
+    bCount = total - aCount
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = summed / total
+        aMean = aSum / aCount
+        bMean = (summed - aSum) / bCount
+        bss = aCount * (aMean - mean) ** 2 + bCount * (bMean - mean) ** 2
+
+    # Splits with an empty class are not candidates
+    bss = np.where((aCount > 0) & (bCount > 0), bss, -np.inf)
+
+    # Like sort(bss).get([-1]), ties go to the last bucket
+    last = bss.shape[-1] - 1 - np.argmax(bss[..., ::-1], axis=-1)
+    thresholds = np.take_along_axis(means, last[..., None], axis=-1)[..., 0]
+    return np.where(np.isfinite(bss).any(axis=-1), thresholds, np.nan)
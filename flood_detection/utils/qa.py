@@ -0,0 +1,89 @@
+# Lookup-table decoding of the MODIS state_1km QA band (local processing)
+
+# state_1km is a 16-bit field, so every flag the DFO algorithm needs can be
+# worked out once for all 65536 values. decode() then turns a stack of
+# state_1km values into packed flags with one gather, instead of a
+# bitwiseAnd / rightShift pass per flag and more passes to combine them.
+#
+# QA Band information: http://modis-sr.ltdri.org/guide/MOD09_UserGuide_v1_3.pdf
+# Table 16: 1-kilometer State QA Descriptions (16-bit)
+#    bits 0-1: cloud_state ==> 0: "clear", 1: "cloudy", 2: "mixed", 3: "not set"
+#    bit 2: cloud_shadow ==> 0: "no", 1: "yes"
+#    bit 12: ice_flag ==> 0: "no", 1: "yes"
+#    bit 15: snow_flag ==> 0: "no snow", 1: "snow"
+#
+# Packed flags byte:
+#    bits 0-1: cloud_state
+#    bit 2: cloud_shadow
+#    bit 3: ice_flag
+#    bit 4: snow_flag
+#    bit 5: usable - not cloudy / mixed, shadowed, ice or snow (qa_mask)
+#    bit 6: clear view - clear or no shadow (get_clear_views)
+#    bit 7: valid - the pixel has a state_1km value
+#
+# A missing state_1km value (NaN, or masked in Earth Engine) decodes to 0:
+# not valid, not usable and not a clear view, as masked pixels drop out of the
+# Earth Engine reductions.
+
+import numpy as np
+
+CLOUD_STATE = 0b11
+CLOUD_SHADOW = 1 << 2
+ICE_FLAG = 1 << 3
+SNOW_FLAG = 1 << 4
+USABLE = 1 << 5
+CLEAR_VIEW = 1 << 6
+VALID = 1 << 7
+
+# Packed flags of every state_1km value
+def _flags_table():
+    state = np.arange(1 << 16, dtype=np.uint32)
+    cloud_state = state & 3
+    cloud_shadow = (state >> 2) & 1
+    ice_flag = (state >> 12) & 1
+    snow_flag = (state >> 15) & 1
+    usable = ~((cloud_state == 1) | (cloud_state == 2) | (cloud_shadow == 1)
+               | (ice_flag == 1) | (snow_flag == 1))
+    clear_view = (cloud_state == 0) | (cloud_shadow == 0)
+    flags = (cloud_state | cloud_shadow << 2 | ice_flag << 3 | snow_flag << 4
+             | usable.astype(np.uint32) << 5 | clear_view.astype(np.uint32) << 6 | VALID)
+    return flags.astype(np.uint8)
+
+FLAGS_TABLE = _flags_table()
+
+# Packed flags of state_1km values
+#    Args:
+#        state: array of state_1km values (any shape); NaN where missing
+#    Returns:
+#        - uint8 array of packed flags, same shape (0 where missing)
+def decode(state):
+    state = np.asarray(state)
+    if state.dtype.kind != "f":
+        return FLAGS_TABLE[state.astype(np.uint16, copy=False)]
+    valid = np.isfinite(state)
+    flags = FLAGS_TABLE[np.where(valid, state, 0).astype(np.uint16)]
+    flags[~valid] = 0
+    return flags
+
+# Pixels with a state_1km value
+def valid(flags):
+    return (flags & VALID) != 0
+
+# Pixels that are not cloudy, shadowed, ice or snow
+def usable(flags):
+    return (flags & USABLE) != 0
+
+# Pixels with a clear view (clear or not shadowed)
+def clear_view(flags):
+    return (flags & CLEAR_VIEW) != 0
+
+# The individual flag planes, as modis_toolbox.add_qa_bands names them
+# (missing pixels read as 0 - check valid() where that matters)
+#    Returns:
+#        - dictionary "cloud_state" / "cloud_shadow" / "ice_flag" / "snow_flag"
+#          -> uint8 array
+def flag_planes(flags):
+    return {"cloud_state": flags & CLOUD_STATE,
+            "cloud_shadow": (flags & CLOUD_SHADOW) >> 2,
+            "ice_flag": (flags & ICE_FLAG) >> 3,
+            "snow_flag": (flags & SNOW_FLAG) >> 4}
@@ -0,0 +1,235 @@
+# Export task scheduler
+
+# Starts GEE export tasks within a rate limit and a cap on the number of tasks
+# running at once, instead of starting them all (or sleeping a flat 15 minutes
+# every 50 events). The rate limit is a token bucket: tokens refill at `rate`
+# per second up to `burst`, and starting a task takes one. Running tasks are
+# polled together (one status request per poll); failed tasks are started
+# again after an exponential backoff, up to `max_retries` times. A task that
+# cannot be started because of a quota or rate limit (QuotaError) does not use
+# up its retries: no task is started until a backoff has passed, which grows
+# while the errors go on. Any other start error (bad parameters, no
+# permission, ...) counts as a failed attempt.
+#
+# The state of every task (pending / running / completed / failed, task ID,
+# attempts, fingerprint) is kept in a JSON file, so a restarted script does
+# not export again what is done and picks up the tasks that are still running.
+# The export parameters (ee objects) are not saved - the script submits its
+# tasks again on every run; tasks that are already completed are skipped,
+# unless their fingerprint (assets.export_fingerprint) has changed. Tasks that
+# failed for good in an earlier run are tried again.
+
+import json
+import os
+import time
+from collections import namedtuple
+
+# Version of the queue file - bump to start afresh after a format change
+QUEUE_VERSION = 1
+
+# Default limits: tasks started per second, tokens saved up for a burst,
+# tasks running at once, retries of a failed task
+RATE = 0.2
+BURST = 10
+MAX_RUNNING = 20
+MAX_RETRIES = 5
+
+# Backoff before the n-th retry: BACKOFF * 2 ** (n - 1) seconds, at most MAX_BACKOFF
+BACKOFF = 60
+MAX_BACKOFF = 3600
+
+# Raised by a task service when a task cannot be started for now because of a
+# quota or rate limit - the task itself is not at fault
+class QuotaError(Exception):
+    pass
+
+# Task service: start(kind, params) -> task ID (QuotaError when a limit is
+# reached), and status(task IDs) ->
+# dictionary task ID -> {"state": ..., "error_message": ...} with the GEE
+# task states (READY, RUNNING, COMPLETED, FAILED, CANCELLED)
+TaskService = namedtuple("TaskService", ["start", "status"])
+
+# Task service of the Earth Engine client. `kind` is the export function,
+# e.g. "image.toAsset" for ee.batch.Export.image.toAsset
+def ee_task_service():
+    from flood_detection.session import ee
+
+    def start(kind, params):
+        group, method = kind.split(".")
+        task = getattr(getattr(ee.batch.Export, group), method)(**params)
+        try:
+            task.start()
+        except ee.EEException as e:
+            if _is_quota_error(e):
+                raise QuotaError(str(e))
+            raise
+        return task.id
+
+    def status(task_ids):
+        return {s["id"]: s for s in ee.data.getTaskStatus(list(task_ids))}
+
+    return TaskService(start, status)
+
+# Open (or create) a queue
+#    Args:
+#        path: JSON file of the queue
+#        rate, burst, max_running, max_retries, backoff: limits (see above)
+#        now: current time (seconds), time.time() by default
+#    Returns:
+#        - queue dictionary
+def open_queue(path, rate=RATE, burst=BURST, max_running=MAX_RUNNING,
+               max_retries=MAX_RETRIES, backoff=BACKOFF, now=None):
+    tasks = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            saved = json.load(f)
+        if saved.get("version") == QUEUE_VERSION:
+            tasks = saved["tasks"]
+    return {"path": path, "tasks": tasks, "params": {},
+            "rate": rate, "burst": burst, "max_running": max_running,
+            "max_retries": max_retries, "backoff": backoff,
+            "tokens": float(burst), "updated": time.time() if now is None else now,
+            "start_errors": 0, "hold_until": 0}
+
+# Add an export to the queue (nothing is started - see step() / run_queue())
+#    Args:
+#        queue: queue from open_queue()
+#        key: unique name of the export (e.g. the asset ID)
+#        kind: export function, e.g. "image.toAsset" or "image.toDrive"
+#        params: keyword arguments of the export function
+#        fingerprint: optional fingerprint of the request - a task done with
+#                     another fingerprint is exported again
+#    Returns:
+#        - state of the task ("pending" for a new, changed or failed one,
+#          "completed" if an earlier run exported it, "running" if an earlier
+#          run started it)
+def submit(queue, key, kind, params, fingerprint=None):
+    queue["params"][key] = (kind, params)
+    task = queue["tasks"].get(key)
+    changed = (task is not None and fingerprint is not None and task["state"] != "running"
+               and task.get("fingerprint") != fingerprint)
+    if task is None or changed or task["state"] == "failed":
+        queue["tasks"][key] = {"kind": kind, "state": "pending", "task_id": None,
+                               "attempts": 0, "next_attempt": 0, "error": None,
+                               "fingerprint": fingerprint}
+        _save(queue)
+    return queue["tasks"][key]["state"]
+
+# Poll the running tasks, then start the pending tasks that are due, within
+# the rate limit and the cap on running tasks. Does not wait
+#    Args:
+#        queue: queue from open_queue()
+#        service: TaskService
+#        now: current time (seconds), time.time() by default
+def step(queue, service, now=None):
+    now = time.time() if now is None else now
+    _poll(queue, service, now)
+
+    queue["tokens"] = min(float(queue["burst"]),
+                          queue["tokens"] + (now - queue["updated"]) * queue["rate"])
+    queue["updated"] = now
+    running = sum(t["state"] == "running" for t in queue["tasks"].values())
+    for key, task in queue["tasks"].items():
+        if queue["tokens"] < 1 or running >= queue["max_running"] or queue["hold_until"] > now:
+            break
+        if task["state"] != "pending" or task["next_attempt"] > now or key not in queue["params"]:
+            continue
+        kind, params = queue["params"][key]
+        queue["tokens"] -= 1
+        try:
+            task["task_id"] = service.start(kind, params)
+        except QuotaError as e:
+            # Back off and stop starting tasks for now. The task never ran, so this is not
+            # one of its attempts
+            queue["start_errors"] += 1
+            delay = min(queue["backoff"] * 2 ** (queue["start_errors"] - 1), MAX_BACKOFF)
+            queue["hold_until"] = now + delay
+            task["error"] = str(e)
+            print("Could not start export {0}: {1} - waiting {2:.0f} s".format(key, e, delay))
+            break
+        except Exception as e:
+            print("Could not start export {0}: {1}".format(key, e))
+            _retry(queue, task, str(e), now)
+            continue
+        queue["start_errors"] = 0
+        task["state"] = "running"
+        running += 1
+        print("Started export {0}".format(key))
+    _save(queue)
+
+# Run the queue until every submitted task is completed or has failed for good
+#    Args:
+#        queue: queue from open_queue()
+#        service: TaskService
+#        poll_interval: seconds between polls
+#        clock, sleep: time functions (time.time / time.sleep)
+#    Returns:
+#        - dictionary state -> number of tasks
+def run_queue(queue, service, poll_interval=30, clock=time.time, sleep=time.sleep):
+    while True:
+        step(queue, service, clock())
+        if not _active(queue):
+            break
+        sleep(poll_interval)
+    counts = {}
+    for task in queue["tasks"].values():
+        counts[task["state"]] = counts.get(task["state"], 0) + 1
+    print("Export queue finished: {0}".format(counts))
+    return counts
+
+# Exports that failed for good, with their last error
+#    Returns:
+#        - list of (key, error message)
+def failed_tasks(queue):
+    return [(key, t["error"]) for key, t in queue["tasks"].items() if t["state"] == "failed"]
+
+# Earth Engine errors of a quota or rate limit (e.g. "Too many tasks already in
+# the queue", "Quota exceeded")
+def _is_quota_error(error):
+    message = str(error).lower()
+    return "quota" in message or "too many" in message
+
+# Status of all the running tasks, in one request
+def _poll(queue, service, now):
+    running = {t["task_id"]: t for t in queue["tasks"].values() if t["state"] == "running"}
+    if not running:
+        return
+    try:
+        statuses = service.status(list(running))
+    except Exception as e:
+        print("Could not poll the export tasks: {0}".format(e))
+        return
+    for task_id, task in running.items():
+        status = statuses.get(task_id)
+        if status is None:
+            continue
+        if status["state"] == "COMPLETED":
+            task["state"] = "completed"
+            task["error"] = None
+        elif status["state"] in ("FAILED", "CANCELLED"):
+            _retry(queue, task, status.get("error_message", status["state"]), now)
+
+def _retry(queue, task, error, now):
+    task["attempts"] += 1
+    task["error"] = error
+    task["task_id"] = None
+    if task["attempts"] > queue["max_retries"]:
+        task["state"] = "failed"
+    else:
+        task["state"] = "pending"
+        task["next_attempt"] = now + min(queue["backoff"] * 2 ** (task["attempts"] - 1), MAX_BACKOFF)
+
+# Tasks still to be waited for: running ones, and pending ones submitted by
+# this run (others cannot be started - their parameters are unknown)
+def _active(queue):
+    return any(t["state"] == "running" or (t["state"] == "pending" and key in queue["params"])
+               for key, t in queue["tasks"].items())
+
+def _save(queue):
+    tmp_file = queue["path"] + ".tmp"
+    folder = os.path.dirname(queue["path"])
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(tmp_file, "w") as f:
+        json.dump({"version": QUEUE_VERSION, "tasks": queue["tasks"]}, f, indent=1)
+    os.replace(tmp_file, queue["path"])
@@ -0,0 +1,144 @@
+# Grid alignment with precomputed index maps
+
+# Replaces arcpy.management.Resample(..., "NEAREST") between two grids in the
+# same CRS (e.g. 250m flood -> 100m population, 500m cropland -> 250m flood).
+# For axis-aligned grids the nearest source cell of a destination cell only
+# depends on its row (for the source row) and on its column (for the source
+# column), so the whole resampling is described by two small index vectors.
+# They are computed once per pair of grids and reused for every event; the
+# resampling itself is an in-memory gather, done tile by tile if needed.
+
+import numpy as np
+from rasterio.windows import Window
+
+from flood_exposure.raster import grid_key, grid_of, same_crs
+
+# Fraction of a cell within which a destination centre counts as on a cell edge
+EDGE_TOLERANCE = 1e-6
+
+# Index maps already computed in this process, keyed by (source, destination) grid
+_index_maps = {}
+
+# Nearest-neighbour index map from one grid to another
+#    Args:
+#        src_grid: raster.Grid of the source layer
+#        dst_grid: raster.Grid to resample onto (same CRS, no rotation)
+#    Returns:
+#        - dictionary with "rows" and "cols" (source row / column of every
+#          destination row / column, -1 outside the source), "src_shape" and
+#          "factor" (integer up-sampling factor when the grids nest exactly,
+#          otherwise None)
+def index_map(src_grid, dst_grid):
+    key = (grid_key(src_grid), grid_key(dst_grid))
+    if key in _index_maps:
+        return _index_maps[key]
+
+    if not same_crs(src_grid.crs, dst_grid.crs):
+        raise ValueError("Index maps need grids in the same CRS")
+    src, dst = src_grid.transform, dst_grid.transform
+    if src.b != 0 or src.d != 0 or dst.b != 0 or dst.d != 0:
+        raise ValueError("Index maps need grids without rotation")
+
+    # Source row / column of the centre of every destination row / column.
+    # Centres that fall on a source cell edge go to the next cell, as in GDAL;
+    # the small tolerance stops rounding errors from deciding those ties.
+    dst_rows, dst_cols = dst_grid.shape
+    y = dst.f + (np.arange(dst_rows) + 0.5) * dst.e
+    x = dst.c + (np.arange(dst_cols) + 0.5) * dst.a
+    rows = np.floor((y - src.f) / src.e + EDGE_TOLERANCE).astype(np.int64)
+    cols = np.floor((x - src.c) / src.a + EDGE_TOLERANCE).astype(np.int64)
+    rows[(rows < 0) | (rows >= src_grid.shape[0])] = -1
+    cols[(cols < 0) | (cols >= src_grid.shape[1])] = -1
+
+    # Integer ratio with the destination origin on a source cell edge: every
+    # source cell becomes a block of factor x factor destination cells, and
+    # the first destination row / column starts a block. An origin on a
+    # destination edge only is not enough - the blocks would be out of phase
+    factor = src.a / dst.a
+    nested = (np.isclose(factor, round(factor)) and np.isclose(src.e / dst.e, factor)
+              and _whole((dst.c - src.c) / src.a) and _whole((dst.f - src.f) / src.e))
+
+    imap = {"rows": rows, "cols": cols, "src_shape": tuple(src_grid.shape),
+            "factor": int(round(factor)) if nested and round(factor) >= 1 else None}
+    _index_maps[key] = imap
+    return imap
+
+# Resample an array with an index map
+#    Args:
+#        src: source array (or the part of it starting at src_offset)
+#        imap: index map from index_map()
+#        fill: value for destination cells outside the source
+#        window: optional destination Window - only that part is produced
+#        src_offset: (row, col) of src[0, 0] in the source grid, when src is
+#                    only a block of the source layer
+#    Returns:
+#        - array on the destination grid (or window)
+def gather(src, imap, fill=0, window=None, src_offset=(0, 0)):
+    rows, cols = _window_indices(imap, window)
+    out_rows = np.where(rows >= 0, rows - src_offset[0], -1)
+    out_cols = np.where(cols >= 0, cols - src_offset[1], -1)
+    inside_rows = out_rows >= 0
+    inside_cols = out_cols >= 0
+
+    if not inside_rows.any() or not inside_cols.any():
+        return np.full((rows.size, cols.size), fill, dtype=src.dtype)
+
+    if imap["factor"] is not None and inside_rows.all() and inside_cols.all():
+        # Nested grids: each source cell becomes a factor x factor block, so the
+        # source block is repeated along both axes instead of gathered cell by
+        # cell. The window can start part-way through a block.
+        k = imap["factor"]
+        block = src[out_rows[0]:out_rows[-1] + 1, out_cols[0]:out_cols[-1] + 1]
+        skip_rows = _cells_before(imap["rows"], rows, window, 0)
+        skip_cols = _cells_before(imap["cols"], cols, window, 1)
+        expanded = np.repeat(np.repeat(block, k, axis=0), k, axis=1)
+        return expanded[skip_rows:skip_rows + rows.size, skip_cols:skip_cols + cols.size]
+
+    out = np.full((rows.size, cols.size), fill, dtype=src.dtype)
+    out[np.ix_(inside_rows, inside_cols)] = src[np.ix_(out_rows[inside_rows], out_cols[inside_cols])]
+    return out
+
+# Read one window of the destination grid from an open raster, through an
+# index map - only the block of source rows / columns the window needs is read
+#    Args:
+#        dataset: open rasterio dataset on the source grid of imap
+#        imap: index map from index_map()
+#        window: destination Window, or None for the whole destination grid
+#        nodata: fill value (defaults to the raster NoData, or 0)
+#    Returns:
+#        - (array, nodata)
+def read_aligned(dataset, imap, window=None, band=1, nodata=None):
+    if nodata is None:
+        nodata = 0 if dataset.nodata is None else dataset.nodata
+    rows, cols = _window_indices(imap, window)
+    rows, cols = rows[rows >= 0], cols[cols >= 0]
+    if rows.size == 0 or cols.size == 0:
+        return gather(np.zeros((0, 0), dtype=dataset.dtypes[band - 1]), imap, nodata, window), nodata
+
+    r0, r1, c0, c1 = rows.min(), rows.max() + 1, cols.min(), cols.max() + 1
+    block = dataset.read(band, window=Window(c0, r0, c1 - c0, r1 - r0))
+    return gather(block, imap, nodata, window, src_offset=(r0, c0)), nodata
+
+# Index map between the grid of an open raster and another grid
+def dataset_index_map(dataset, dst_grid):
+    return index_map(grid_of(dataset), dst_grid)
+
+def _whole(value):
+    return bool(np.isclose(value, round(value)))
+
+def _window_indices(imap, window):
+    if window is None:
+        return imap["rows"], imap["cols"]
+    r0, c0 = int(window.row_off), int(window.col_off)
+    return (imap["rows"][r0:r0 + int(window.height)],
+            imap["cols"][c0:c0 + int(window.width)])
+
+# Number of destination cells of the first source cell of a window that lie
+# before the window (the window can start part-way through a block)
+def _cells_before(all_indices, indices, window, axis):
+    start = 0 if window is None else int(window.row_off if axis == 0 else window.col_off)
+    first = indices[0]
+    n = 0
+    while start - n - 1 >= 0 and all_indices[start - n - 1] == first:
+        n += 1
+    return n
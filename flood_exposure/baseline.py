@@ -0,0 +1,123 @@
+# Per-year baselines (denominators) of the exposure scripts
+
+# The total cropland (or population) of every posto only depends on the layer,
+# its year and the analysis grid - not on the flood event. With 24 events over
+# 15 years most events share their year with another one, so 09 computes each
+# baseline once per (year, grid) - one task per year, see parallel.py - and
+# shares it with the events of that year. A cropland baseline also keeps the
+# cropland mask on the analysis grid (bit packed, 1 bit per cell), so the
+# events of that year only read their flood raster.
+#
+# Baselines are kept in a small LRU cache keyed by (layer, year, grid): only
+# the last MAX_BASELINES are held, so the masks of all the years are never in
+# memory at once, and a script run again in the same session reuses them.
+
+from collections import OrderedDict
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from flood_exposure import zonal
+from flood_exposure.raster import grid_key, valid_mask
+from flood_exposure.tiles import TILE_SIZE, iter_windows, read_window, window_slice
+
+# Number of baselines kept in memory - the least recently used one is dropped
+MAX_BASELINES = 4
+
+# Baselines of this process, least recently used first
+_baselines = OrderedDict()
+
+# Cached baseline of a layer for a year
+#    Args:
+#        layer: name of the layer (e.g. "cropland")
+#        year: year of the layer (e.g. "2015")
+#        grid: analysis grid
+#    Returns:
+#        - the baseline, or None if it is not in the cache
+def cached_baseline(layer, year, grid):
+    key = (layer, str(year), grid_key(grid))
+    if key not in _baselines:
+        return None
+    _baselines.move_to_end(key)
+    return _baselines[key]
+
+# Keep a baseline in the cache, dropping the least recently used ones
+def keep_baseline(layer, year, grid, base):
+    _baselines[(layer, str(year), grid_key(grid))] = base
+    while len(_baselines) > MAX_BASELINES:
+        _baselines.popitem(last=False)
+
+# Drop all cached baselines
+def clear_baselines():
+    _baselines.clear()
+
+# Baseline of a classified layer (e.g. cropland = 1), streamed in bands of rows
+#    Args:
+#        zones: label grid on `grid`
+#        value_path: raster with the classes (e.g. a MODIS cropland layer)
+#        grid: analysis grid - the layer is resampled onto it
+#        n_zones: number of zones
+#        value_class: class that counts
+#        weights: optional array on `grid` (e.g. cell_area.cell_areas) - SUM
+#                 adds up these instead of the raster values
+#        tile_size: number of rows per band; None reads the whole grid at once
+#    Returns:
+#        - dictionary with "total" (zonal_stats() of the class per zone) and
+#          "mask" (cells of the class, packed with np.packbits along columns)
+def class_baseline(zones, value_path, grid, n_zones, value_class, weights=None,
+                   tile_size=TILE_SIZE):
+    rows, cols = grid.shape
+    band_rows = rows if tile_size is None else tile_size
+    totals = []
+    packed = np.zeros((rows, (cols + 7) // 8), dtype=np.uint8)
+    with rasterio.open(value_path) as src:
+        for row_off in range(0, rows, band_rows):
+            window = Window(0, row_off, cols, min(band_rows, rows - row_off))
+            values, nodata = read_window(src, grid, window)
+            mask = valid_mask(values, nodata) & (values == value_class)
+            packed[window_slice(window)[0]] = np.packbits(mask, axis=-1)
+            if weights is not None:
+                values = weights[window_slice(window)]
+            totals.append(zonal.zonal_stats(np.asarray(zones[window_slice(window)]),
+                                            values, n_zones, mask))
+    return {"total": zonal.merge_stats(totals), "mask": packed, "shape": (rows, cols)}
+
+# Class mask of a baseline for one window
+def read_mask(base, window=None):
+    if window is None:
+        return np.unpackbits(base["mask"], axis=-1, count=base["shape"][1]).astype(bool)
+    row_slice, col_slice = window_slice(window)
+    band = np.unpackbits(base["mask"][row_slice], axis=-1, count=base["shape"][1])
+    return band[:, col_slice].astype(bool)
+
+# Flooded zonal statistics of the class cells of a baseline - only the flood
+# raster is read
+#    Args:
+#        zones: label grid on `grid`
+#        flood_path: flood raster (1 = flooded)
+#        base: baseline from class_baseline()
+#        grid: analysis grid
+#        n_zones: number of zones
+#        weights: optional array on `grid`, as in class_baseline()
+#        tile_size: number of cells along each side of a tile; None reads
+#                   the whole grid as a single tile
+#    Returns:
+#        - zonal_stats() dictionary of the flooded class cells per zone
+def stream_flooded(zones, flood_path, base, grid, n_zones, weights=None, tile_size=TILE_SIZE):
+    if tile_size is None:
+        tile_size = max(grid.shape)
+    parts = []
+    with rasterio.open(flood_path) as src:
+        for window in iter_windows(grid.shape, tile_size):
+            tile_zones = np.asarray(zones[window_slice(window)])
+            if not tile_zones.any():
+                continue
+            flood, flood_nodata = read_window(src, grid, window)
+            values = flood if weights is None else weights[window_slice(window)]
+            parts.append(zonal.zonal_stats(tile_zones, values, n_zones,
+                                           read_mask(base, window) & (flood == 1)))
+
+    if not parts:
+        return zonal.zonal_stats(np.zeros(0, dtype=np.int32), np.zeros(0), n_zones)
+    return zonal.merge_stats(parts)
@@ -0,0 +1,65 @@
+# Geodesic cell areas of a geographic (lat / lon) grid
+
+# On a lat / lon grid all cells of a row have the same area, and the area only
+# depends on the latitudes of the row edges. The area of every row is computed
+# once on the WGS84 ellipsoid, and an "equal-area" zonal SUM is the pixel count
+# weighted by that vector. This replaces reprojecting the rasters to an
+# equal-area projection (e.g. Lambert Azimuthal) just to measure areas.
+
+import numpy as np
+from rasterio.crs import CRS
+
+from flood_exposure.raster import grid_key
+
+# WGS84 ellipsoid - semi-major axis (m) and flattening
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+
+# Row areas already computed in this process, keyed by grid
+_row_areas = {}
+
+# Area of every row of cells of a geographic grid
+#    Args:
+#        grid: raster.Grid in a geographic CRS (degrees, no rotation)
+#    Returns:
+#        - float64 array with one area (m2) per row - the area of one cell
+def row_areas(grid):
+    key = grid_key(grid)
+    if key in _row_areas:
+        return _row_areas[key]
+
+    if grid.crs is None or not CRS.from_user_input(grid.crs).is_geographic:
+        raise ValueError("Cell areas need a grid in a geographic CRS")
+    t = grid.transform
+    if t.b != 0 or t.d != 0:
+        raise ValueError("Cell areas need a grid without rotation")
+
+    # Latitudes of the row edges, top to bottom
+    edges = t.f + np.arange(grid.shape[0] + 1) * t.e
+    q = _authalic_q(np.radians(np.clip(edges, -90, 90)))
+    areas = WGS84_A ** 2 * np.radians(abs(t.a)) / 2 * np.abs(np.diff(q))
+    _row_areas[key] = areas
+    return areas
+
+# Cell areas of one window of a grid, broadcast to the window shape (a
+# read-only view - no memory is used for the repeated columns)
+#    Args:
+#        grid: raster.Grid in a geographic CRS
+#        window: rasterio Window, or None for the whole grid
+#    Returns:
+#        - float64 array of cell areas (m2)
+def cell_areas(grid, window=None):
+    areas = row_areas(grid)
+    if window is None:
+        return np.broadcast_to(areas[:, None], grid.shape)
+    r0 = int(window.row_off)
+    rows = areas[r0:r0 + int(window.height)]
+    return np.broadcast_to(rows[:, None], (rows.size, int(window.width)))
+
+# q(latitude) of the authalic latitude. The area between the equator and a
+# latitude over a longitude span dlon (radians) is a^2 * dlon * q / 2
+def _authalic_q(lat):
+    e2 = WGS84_F * (2 - WGS84_F)
+    e = np.sqrt(e2)
+    s = np.sin(lat)
+    return (1 - e2) * (s / (1 - e2 * s ** 2) - np.log((1 - e * s) / (1 + e * s)) / (2 * e))
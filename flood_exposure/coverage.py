@@ -0,0 +1,320 @@
+# Exact polygon coverage of raster cells
+
+# Cell-centre rasterisation (zones.rasterize_zones, like ZonalStatisticsAsTable)
+# gives each cell to one posto or none, which drops or double counts border
+# cells of small (urban) postos at 250m / 500m. Here every (posto, cell) pair
+# gets the fraction of the cell that the posto covers, so zonal sums are
+# accurate on the native grids, without resampling to a finer grid.
+#
+# The fractions come from the accumulation (prefix-sum) scanline method: the
+# polygon edges are cut at every cell row and column line; each piece adds its
+# signed height to the cell it crosses and the cell to its right, split by
+# where it crosses the cell; a running sum along each row then gives the
+# covered fraction of every cell. Everything is vectorised over the edges.
+# The result is a sparse (zone, cell, weight) matrix in COO form, sorted by
+# cell, and a zonal sum is a mat-vec: np.bincount(zone, weight * values[cell]).
+# Since the entries are sorted by cell, the layers can be streamed in bands of
+# rows, each band using the slice of the matrix that falls in it.
+#
+# The matrix has a few entries per covered cell, so it is only built for the
+# native flood / cropland grids (250m, 500m); on the 100m population grid it
+# would hold several entries for each of the ~200 million cells of the country.
+
+import os
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from flood_exposure.cell_area import row_areas
+from flood_exposure.raster import grid_key, valid_mask
+from flood_exposure.tiles import TILE_SIZE, read_window
+from flood_exposure.zonal import stats_from_sums
+from flood_exposure.zones import _to_grid_crs, read_zones, shapefile_fingerprint
+
+# Coverage fractions below this are dropped (rounding noise)
+MIN_COVERAGE = 1e-9
+
+# Finest grid (cell side in metres) that a coverage matrix is built for
+MIN_CELL_SIZE = 200
+
+# Coverage matrices already loaded in this process
+_loaded = {}
+
+# Coverage fractions of polygons on a grid
+#    Args:
+#        geometries: GeoJSON-like (multi)polygons, zone i + 1 is geometries[i]
+#        grid: raster.Grid
+#        crs: CRS of the geometries; they are reprojected if the grid differs
+#    Returns:
+#        - dictionary with the COO arrays "zones" (int32 labels), "cells"
+#          (int64 flat cell indices, row * cols + col) and "weights" (float64
+#          covered fraction of the cell), sorted by cell, plus the grid "shape"
+def polygon_coverage(geometries, grid, crs=None):
+    _check_cell_size(grid)
+    geometries = _to_grid_crs(geometries, grid, crs)
+    x0, y0, x1, y1, labels = _edges(geometries, grid)
+    rows, cols = grid.shape
+    xa, ya, xb, yb, labels = _split_edges(x0, y0, x1, y1, labels, rows, cols)
+
+    # Each piece lies in one row and one column (or left of the grid, where it
+    # is moved onto the left edge - everything to its right is covered)
+    xa, xb = np.maximum(xa, 0), np.maximum(xb, 0)
+    mid_x = (xa + xb) / 2
+    row = np.floor((ya + yb) / 2).astype(np.int64)
+    col = np.minimum(np.floor(mid_x).astype(np.int64), cols)
+    frac = mid_x - col
+    dy = yb - ya
+    keep = (row >= 0) & (row < rows) & (mid_x <= cols)
+    row, col, frac, dy, labels = row[keep], col[keep], frac[keep], dy[keep], labels[keep]
+
+    # Accumulation buffer, sparse: (zone, row, col) -> sum of contributions
+    width = cols + 2
+    keys = np.concatenate([(labels * rows + row) * width + col,
+                           (labels * rows + row) * width + col + 1])
+    contrib = np.concatenate([dy * (1 - frac), dy * frac])
+    keys, inverse = np.unique(keys, return_inverse=True)
+    acc = np.bincount(inverse, weights=contrib, minlength=keys.size)
+
+    # Running sum along each (zone, row) - the coverage of a cell holds until
+    # the next accumulated cell of that row (or the right edge of the grid)
+    group = keys // width
+    col = keys % width
+    running = np.cumsum(acc)
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    offsets = np.repeat(running[starts] - acc[starts], np.diff(np.r_[starts, keys.size]))
+    coverage = running - offsets
+    last = np.r_[group[1:] != group[:-1], True]
+    next_col = np.where(last, cols, np.r_[col[1:], 0])
+    run = np.clip(np.minimum(next_col, cols) - col, 0, None)
+    filled = np.abs(coverage) > MIN_COVERAGE
+    run, coverage, group, col = run[filled], coverage[filled], group[filled], col[filled]
+
+    # Expand the runs into cells
+    n = run.sum()
+    first = np.repeat(np.cumsum(run) - run, run)
+    cell_col = np.repeat(col, run) + (np.arange(n) - first)
+    cell_row = np.repeat(group % rows, run)
+    cells = cell_row * cols + cell_col
+    order = np.argsort(cells, kind="stable")
+    return {"zones": np.repeat(group // rows, run).astype(np.int32)[order],
+            "cells": cells[order],
+            "weights": np.minimum(np.abs(np.repeat(coverage, run)), 1.0)[order],
+            "shape": (rows, cols)}
+
+# Coverage matrix of a shapefile on a grid, computed once and cached
+#    Args:
+#        shapefile: path to the zone shapefile
+#        grid: raster.Grid
+#        cache_folder: folder of the cached label grids / coverage matrices
+#    Returns:
+#        - coverage as polygon_coverage()
+def zone_coverage(shapefile, grid, cache_folder):
+    key = shapefile_fingerprint(shapefile) + "_" + grid_key(grid)
+    if key in _loaded:
+        return _loaded[key]
+
+    name = os.path.splitext(os.path.basename(shapefile))[0]
+    cache_file = os.path.join(cache_folder, "{0}_coverage_{1}.npz".format(name, key))
+    if not os.path.exists(cache_file):
+        geometries, records, crs = read_zones(shapefile)
+        cov = polygon_coverage(geometries, grid, crs)
+        os.makedirs(cache_folder, exist_ok=True)
+        tmp_file = cache_file + ".tmp.npz"
+        np.savez(tmp_file, zones=cov["zones"], cells=cov["cells"], weights=cov["weights"])
+        os.replace(tmp_file, cache_file)
+
+    with np.load(cache_file) as data:
+        cov = {"zones": data["zones"], "cells": data["cells"], "weights": data["weights"],
+               "shape": tuple(grid.shape)}
+
+    # Matrices cached before they were sorted by cell
+    if np.any(cov["cells"][1:] < cov["cells"][:-1]):
+        order = np.argsort(cov["cells"], kind="stable")
+        cov = dict(cov, zones=cov["zones"][order], cells=cov["cells"][order], weights=cov["weights"][order])
+    _loaded[key] = cov
+    return cov
+
+# Per-zone SUM / COUNT / MEAN with coverage weights - the counterpart of
+# zonal.zonal_stats(). COUNT is the covered number of cells (fractional)
+#    Args:
+#        cov: coverage from polygon_coverage() / zone_coverage()
+#        values: value raster on the grid of the coverage
+#        n_zones: number of zones
+#        valid: boolean mask of cells with data
+#    Returns:
+#        - dictionary of arrays of length n_zones ("SUM", "COUNT", "MEAN")
+def coverage_zonal_stats(cov, values, n_zones, valid=None):
+    z, w, v = _gather(cov, values, valid)[:3]
+    sums = np.bincount(z, weights=w * v, minlength=n_zones + 1)[1:n_zones + 1]
+    counts = np.bincount(z, weights=w, minlength=n_zones + 1)[1:n_zones + 1]
+    return stats_from_sums(sums, counts)
+
+# Total and flooded per-zone statistics with coverage weights - the
+# counterpart of zonal.flood_zonal_stats()
+def coverage_flood_zonal_stats(cov, values, flooded, n_zones, valid=None):
+    z, w, v, cells = _gather(cov, values, valid)
+    f = np.asarray(flooded).ravel()[cells]
+    size = 2 * (n_zones + 1)
+    key = z.astype(np.int64) * 2 + f
+    sums = np.bincount(key, weights=w * v, minlength=size)[:size].reshape(-1, 2)[1:]
+    counts = np.bincount(key, weights=w, minlength=size)[:size].reshape(-1, 2)[1:]
+    total = stats_from_sums(sums.sum(axis=1), counts.sum(axis=1))
+    flood = stats_from_sums(sums[:, 1], counts[:, 1])
+    return total, flood
+
+# Total and per-event flooded statistics with coverage weights - the
+# counterpart of multi_event.stream_event_zonal() (08) and, with a value class,
+# of baseline.class_baseline() and baseline.stream_flooded() (09). The layers
+# are streamed in bands of rows; the total is summed once and each band of a
+# flood layer only adds to the flooded sums of its event
+#    Args:
+#        cov: coverage from zone_coverage()
+#        value_path: raster with the values to sum (population), or the classes
+#        flood_paths: list of flood rasters (1 = flooded), one per event
+#        grid: grid of the coverage - the layers are resampled onto it
+#        n_zones: number of zones
+#        value_class: optional class that counts (e.g. cropland = 1); SUM then
+#                     adds up `weights` over the cells of the class
+#        weights: optional array on `grid` (e.g. cell_area.cell_areas)
+#        tile_size: number of rows in a band; None reads the whole grid as a
+#                   single band
+#    Returns:
+#        - (total, flooded): total is a stats dictionary and flooded a list
+#          with one per event, as coverage_flood_zonal_stats()
+def coverage_event_zonal(cov, value_path, flood_paths, grid, n_zones, value_class=None, weights=None,
+                         tile_size=TILE_SIZE):
+    rows, cols = grid.shape
+    if tile_size is None:
+        tile_size = rows
+    sums = np.zeros(n_zones + 1)
+    counts = np.zeros(n_zones + 1)
+    flood_sums = np.zeros((len(flood_paths), n_zones + 1))
+    flood_counts = np.zeros((len(flood_paths), n_zones + 1))
+
+    with rasterio.open(value_path) as value_src:
+        flood_srcs = [rasterio.open(path) for path in flood_paths]
+        try:
+            for row_off in range(0, rows, tile_size):
+                height = min(tile_size, rows - row_off)
+                first, last = np.searchsorted(cov["cells"], [row_off * cols, (row_off + height) * cols])
+                if first == last:
+                    continue
+
+                # Slice of the coverage matrix in the band, on the cells of the band
+                band = {"zones": cov["zones"][first:last], "weights": cov["weights"][first:last],
+                        "cells": cov["cells"][first:last] - row_off * cols}
+                window = Window(0, row_off, cols, height)
+                values, nodata = read_window(value_src, grid, window)
+                valid = valid_mask(values, nodata)
+                if value_class is not None:
+                    valid &= values == value_class
+                if weights is not None:
+                    values = weights[row_off:row_off + height]
+
+                z, w, v, cells = _gather(band, values, valid)
+                sums += np.bincount(z, weights=w * v, minlength=n_zones + 1)[:n_zones + 1]
+                counts += np.bincount(z, weights=w, minlength=n_zones + 1)[:n_zones + 1]
+                for k, src in enumerate(flood_srcs):
+                    f = (read_window(src, grid, window)[0] == 1).ravel()[cells]
+                    flood_sums[k] += np.bincount(z[f], weights=(w * v)[f], minlength=n_zones + 1)[:n_zones + 1]
+                    flood_counts[k] += np.bincount(z[f], weights=w[f], minlength=n_zones + 1)[:n_zones + 1]
+        finally:
+            for src in flood_srcs:
+                src.close()
+
+    total = stats_from_sums(sums[1:], counts[1:])
+    flooded = [stats_from_sums(flood_sums[k, 1:], flood_counts[k, 1:]) for k in range(len(flood_paths))]
+    return total, flooded
+
+# Arrays of a coverage matrix to share with worker processes (parallel.py),
+# named <name>_zones / _cells / _weights
+def coverage_arrays(cov, name):
+    return {name + "_" + key: cov[key] for key in ("zones", "cells", "weights")}
+
+# Zones, weights, values and cells of the coverage entries on valid cells
+def _gather(cov, values, valid):
+    z, w, cells = cov["zones"], cov["weights"], cov["cells"]
+    if valid is not None:
+        keep = np.asarray(valid).ravel()[cells]
+        z, w, cells = z[keep], w[keep], cells[keep]
+    v = np.asarray(values).ravel()[cells].astype(np.float64)
+    return z, w, v, cells
+
+# Coverage matrices are only built for grids of MIN_CELL_SIZE or coarser
+def _check_cell_size(grid):
+    try:
+        size = np.sqrt(np.median(row_areas(grid)))
+    except ValueError:
+        size = np.sqrt(abs(grid.transform.a * grid.transform.e))
+    if size < MIN_CELL_SIZE:
+        raise ValueError("Exact coverage needs a grid of {0}m cells or coarser (the native flood / cropland "
+                         "grids), not {1:.0f}m".format(MIN_CELL_SIZE, size))
+
+# Edges of all polygon rings in cell coordinates (col, row), oriented so that
+# exterior rings count +1 and holes -1
+def _edges(geometries, grid):
+    inverse = ~grid.transform
+    xs0, ys0, xs1, ys1, labels = [], [], [], [], []
+    for i, geometry in enumerate(geometries):
+        if geometry is None:
+            continue
+        if geometry["type"] == "Polygon":
+            polygons = [geometry["coordinates"]]
+        elif geometry["type"] == "MultiPolygon":
+            polygons = geometry["coordinates"]
+        else:
+            continue
+        for polygon in polygons:
+            for k, ring in enumerate(polygon):
+                ring = np.asarray(ring, dtype=np.float64)[:, :2]
+                if len(ring) < 3:
+                    continue
+                col, row = inverse * (ring[:, 0], ring[:, 1])
+                col, row = np.asarray(col), np.asarray(row)
+                area = np.sum(col[:-1] * row[1:] - col[1:] * row[:-1])
+                if (area < 0) == (k == 0):
+                    col, row = col[::-1], row[::-1]
+                xs0.append(col[:-1])
+                ys0.append(row[:-1])
+                xs1.append(col[1:])
+                ys1.append(row[1:])
+                labels.append(np.full(len(col) - 1, i + 1, dtype=np.int64))
+    if not labels:
+        empty = np.zeros(0)
+        return empty, empty, empty, empty, np.zeros(0, dtype=np.int64)
+    x0, y0 = np.concatenate(xs0), np.concatenate(ys0)
+    x1, y1 = np.concatenate(xs1), np.concatenate(ys1)
+    labels = np.concatenate(labels)
+    moving = y0 != y1
+    return x0[moving], y0[moving], x1[moving], y1[moving], labels[moving]
+
+# Cut the edges at every row and column line of the grid they cross (lines
+# outside the grid are not needed)
+def _split_edges(x0, y0, x1, y1, labels, rows, cols):
+    xcuts, xedge = _crossings(x0, x1, cols)
+    ycuts, yedge = _crossings(y0, y1, rows)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        tx = (xcuts - x0[xedge]) / (x1[xedge] - x0[xedge])
+        ty = (ycuts - y0[yedge]) / (y1[yedge] - y0[yedge])
+    n = x0.size
+    edge = np.concatenate([np.arange(n), np.arange(n), xedge, yedge])
+    t = np.concatenate([np.zeros(n), np.ones(n), tx, ty])
+    order = np.lexsort((t, edge))
+    edge, t = edge[order], t[order]
+
+    # Consecutive cut points of the same edge make a piece
+    same = edge[1:] == edge[:-1]
+    e, ta, tb = edge[:-1][same], t[:-1][same], t[1:][same]
+    dx, dy = x1[e] - x0[e], y1[e] - y0[e]
+    return (x0[e] + ta * dx, y0[e] + ta * dy, x0[e] + tb * dx, y0[e] + tb * dy, labels[e])
+
+# Integer lines 0..size strictly between the ends of each edge
+def _crossings(a, b, size):
+    lo = np.maximum(np.floor(np.minimum(a, b)) + 1, 0)
+    hi = np.minimum(np.ceil(np.maximum(a, b)) - 1, size)
+    count = np.maximum(hi - lo + 1, 0).astype(np.int64)
+    edge = np.repeat(np.arange(a.size), count)
+    first = np.repeat(np.cumsum(count) - count, count)
+    cuts = np.repeat(lo, count) + (np.arange(count.sum()) - first)
+    return cuts, edge
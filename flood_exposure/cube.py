@@ -0,0 +1,318 @@
+# Bit-packed flood event cube
+
+# Stores the flood masks of many events on one common grid. Each event is a
+# bit plane packed with np.packbits along the columns (1 bit per pixel instead
+# of 8-32), and the planes are split into chunks of rows:
+#
+#     <cube folder>/cube.json         grid, chunking and per-event metadata
+#     <cube folder>/chunk_00000.npy   uint8 (n_events, chunk rows, ceil(cols / 8))
+#     ...
+#
+# Uncompressed chunks are memory-mapped when read, so only the pages that are
+# used are loaded. With compression="zlib" the chunks are deflated on top of
+# the bit packing (chunk_00000.z) and decompressed one chunk at a time; the
+# last few decompressed chunks are kept (least recently used ones dropped),
+# so nearby queries do not decompress them again and a long run of queries
+# does not end up holding the whole cube in memory.
+#
+# The cube answers "which events flooded this location / box / posto?"
+# (point_events, bbox_events, zone_events) without opening any flood raster.
+
+import json
+import os
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.warp import transform
+from rasterio.windows import Window
+
+from flood_exposure.raster import Grid
+from flood_exposure.tiles import read_window
+
+CUBE_FILE = "cube.json"
+
+# Default number of rows per chunk
+CHUNK_ROWS = 512
+
+# Decompressed chunks kept in memory per open cube (zlib cubes)
+CACHED_CHUNKS = 4
+
+# Write a cube from flood rasters, one chunk at a time
+#    Args:
+#        cube_folder: output folder
+#        flood_paths: flood rasters (1 = flooded), one per event
+#        events: metadata of each event (e.g. events.parse_event_name) - must
+#                hold at least "id", "began", "ended" and "source"
+#        grid: common grid of the cube; the flood rasters are resampled onto it
+#        chunk_rows: number of rows per chunk
+#        compression: None (memory-mappable chunks) or "zlib"
+#    Returns:
+#        - the cube, as open_cube() returns it
+def build_cube(cube_folder, flood_paths, events, grid, chunk_rows=CHUNK_ROWS, compression=None):
+    srcs = [rasterio.open(path) for path in flood_paths]
+    try:
+        def read_rows(row_off, n_rows):
+            window = Window(0, row_off, grid.shape[1], n_rows)
+            return [read_window(src, grid, window)[0] == 1 for src in srcs]
+        return _write_cube(cube_folder, events, grid, read_rows, chunk_rows, compression)
+    finally:
+        for src in srcs:
+            src.close()
+
+# Write a cube from flood masks held in memory
+#    Args:
+#        masks: list of boolean arrays with grid.shape, one per event
+#        (other arguments as build_cube)
+def write_cube(cube_folder, masks, events, grid, chunk_rows=CHUNK_ROWS, compression=None):
+    def read_rows(row_off, n_rows):
+        return [np.asarray(m[row_off:row_off + n_rows], dtype=bool) for m in masks]
+    return _write_cube(cube_folder, events, grid, read_rows, chunk_rows, compression)
+
+def _write_cube(cube_folder, events, grid, read_rows, chunk_rows, compression):
+    if compression not in (None, "zlib"):
+        raise ValueError("'compression' options are None or 'zlib'")
+    os.makedirs(cube_folder, exist_ok=True)
+    rows = grid.shape[0]
+    n_chunks = 0
+    for row_off in range(0, rows, chunk_rows):
+        n_rows = min(chunk_rows, rows - row_off)
+        planes = np.packbits(np.stack(read_rows(row_off, n_rows)), axis=-1)
+        _save_chunk(cube_folder, n_chunks, planes, compression)
+        n_chunks += 1
+
+    meta = {"version": 1,
+            "grid": {"transform": list(grid.transform)[:6],
+                     "shape": list(grid.shape),
+                     "crs": grid.crs},
+            "chunk_rows": chunk_rows,
+            "n_chunks": n_chunks,
+            "compression": compression,
+            "events": [dict(e) for e in events]}
+    with open(os.path.join(cube_folder, CUBE_FILE), "w") as f:
+        json.dump(meta, f, indent=1)
+    return open_cube(cube_folder)
+
+def _chunk_path(cube_folder, i, compression):
+    return os.path.join(cube_folder, "chunk_{0:05d}.{1}".format(i, "z" if compression else "npy"))
+
+def _save_chunk(cube_folder, i, planes, compression):
+    path = _chunk_path(cube_folder, i, compression)
+    if compression == "zlib":
+        header = np.array(planes.shape, dtype=np.int64).tobytes()
+        with open(path, "wb") as f:
+            f.write(header + zlib.compress(np.ascontiguousarray(planes).tobytes(), 6))
+    else:
+        np.save(path, planes)
+
+# Open a cube
+#    Returns:
+#        - dictionary with the cube metadata ("events", "chunk_rows", ...), its
+#          "folder" and its "grid" as a raster.Grid
+def open_cube(cube_folder):
+    with open(os.path.join(cube_folder, CUBE_FILE)) as f:
+        cube = json.load(f)
+    g = cube["grid"]
+    cube["grid"] = Grid(Affine(*g["transform"]), tuple(g["shape"]), g["crs"])
+    cube["folder"] = cube_folder
+    cube["_chunks"] = OrderedDict()
+    return cube
+
+# Packed bit planes of one chunk - uint8 (n_events, chunk rows, ceil(cols / 8))
+def read_chunk(cube, i):
+    path = _chunk_path(cube["folder"], i, cube["compression"])
+    if cube["compression"] != "zlib":
+        return np.load(path, mmap_mode="r")
+
+    chunks = cube["_chunks"]
+    if i in chunks:
+        chunks.move_to_end(i)
+        return chunks[i]
+    with open(path, "rb") as f:
+        data = f.read()
+    shape = tuple(np.frombuffer(data[:24], dtype=np.int64))
+    planes = np.frombuffer(zlib.decompress(data[24:]), dtype=np.uint8).reshape(shape)
+    chunks[i] = planes
+    while len(chunks) > CACHED_CHUNKS:
+        chunks.popitem(last=False)
+    return planes
+
+# Position of an event in the cube
+def event_index(cube, event_id):
+    for k, event in enumerate(cube["events"]):
+        if event["id"] == event_id:
+            return k
+    raise KeyError("Event {0} is not in the cube".format(event_id))
+
+# Flood mask of one event (or a band of rows of it)
+#    Args:
+#        cube: cube from open_cube()
+#        event: event ID (e.g. "DFO_4500") or position in the cube
+#        rows: optional (first, last) rows to read, last excluded
+#    Returns:
+#        - boolean array
+def read_event(cube, event, rows=None):
+    k = event if isinstance(event, int) else event_index(cube, event)
+    n_rows, n_cols = cube["grid"].shape
+    first, last = rows if rows is not None else (0, n_rows)
+    chunk_rows = cube["chunk_rows"]
+    parts = []
+    for i in range(first // chunk_rows, (last - 1) // chunk_rows + 1):
+        chunk_off = i * chunk_rows
+        lo = max(first, chunk_off) - chunk_off
+        hi = min(last, chunk_off + chunk_rows) - chunk_off
+        parts.append(read_chunk(cube, i)[k, lo:hi])
+    packed = np.concatenate(parts) if parts else np.zeros((0, (n_cols + 7) // 8), dtype=np.uint8)
+    return np.unpackbits(packed, axis=-1, count=n_cols).astype(bool)
+
+# Queries ##################################################
+#
+# The queries only read the chunks (and the bytes of each packed row) that
+# cover the requested cells. Coordinates are lon / lat (EPSG:4326) unless a
+# CRS is given, and are transformed to the CRS of the cube if needed.
+
+# Events that flooded a point
+#    Args:
+#        cube: cube from open_cube()
+#        x, y: coordinates of the point (lon / lat by default)
+#        crs: CRS of the coordinates
+#    Returns:
+#        - list of the metadata dictionaries of the events that flooded the
+#          point (empty outside the grid)
+def point_events(cube, x, y, crs="EPSG:4326"):
+    row, col = _cell_of(cube, x, y, crs)
+    n_rows, n_cols = cube["grid"].shape
+    if not (0 <= row < n_rows and 0 <= col < n_cols):
+        return []
+    chunk_rows = cube["chunk_rows"]
+    packed = read_chunk(cube, row // chunk_rows)[:, row % chunk_rows, col // 8]
+    flooded = (packed >> (7 - col % 8)) & 1
+    return [cube["events"][k] for k in np.flatnonzero(flooded)]
+
+# Events that flooded a bounding box
+#    Args:
+#        cube: cube from open_cube()
+#        bounds: (left, bottom, right, top) of the box (lon / lat by default)
+#        crs: CRS of the bounds
+#    Returns:
+#        - dictionary with "events" (metadata of the events that flooded part
+#          of the box, each with its number of "flooded_cells"), "frequency"
+#          (number of events that flooded each cell of the box) and "window"
+#          (the box as a Window of the cube grid)
+def bbox_events(cube, bounds, crs="EPSG:4326"):
+    window = _window_of_bounds(cube, bounds, crs)
+    masks = read_block(cube, window)
+    return _summarise_block(cube, masks, window)
+
+# Events that flooded a posto
+#    Args:
+#        cube: cube from open_cube()
+#        zones: posto label grid on the cube grid (zones.zone_labels())
+#        zone: posto label (its OBJECTID)
+#        extents: optional zone_extents() of the label grid - computed on
+#                 first use and kept with the cube, for this label grid only
+#    Returns:
+#        - as bbox_events(), counting the cells of the posto only
+def zone_events(cube, zones, zone, extents=None):
+    if extents is None:
+        # Keyed by the label grid object, which is kept alive with its extents
+        # so its id cannot be reused by another grid
+        known = cube.setdefault("_extents", {})
+        if id(zones) not in known or known[id(zones)][0] is not zones:
+            known[id(zones)] = (zones, zone_extents(zones))
+        extents = known[id(zones)][1]
+    if zone >= len(extents) or extents[zone][0] < 0:
+        return {"events": [], "frequency": np.zeros((0, 0), dtype=np.int32),
+                "window": Window(0, 0, 0, 0)}
+    r0, r1, c0, c1 = extents[zone]
+    window = Window(c0, r0, c1 - c0, r1 - r0)
+    in_zone = np.asarray(zones[r0:r1, c0:c1]) == zone
+    masks = read_block(cube, window) & in_zone
+    return _summarise_block(cube, masks, window)
+
+# Row / column extent of every zone of a label grid, in one pass over the
+# grid (band by band, so memory-mapped label grids are fine)
+#    Args:
+#        zones: label grid
+#        n_zones: number of zones (highest label) - found with an extra pass
+#                 over the grid if not given
+#    Returns:
+#        - int64 array (n_zones + 1, 4) of (first row, last row + 1, first
+#          column, last column + 1); -1 for labels without cells (and for 0)
+def zone_extents(zones, n_zones=None, band_rows=CHUNK_ROWS):
+    bands = range(0, zones.shape[0], band_rows)
+    if n_zones is None:
+        n_zones = max(int(np.asarray(zones[r:r + band_rows]).max(initial=0)) for r in bands)
+    big = np.iinfo(np.int64).max
+    first_row = np.full(n_zones + 1, big)
+    first_col = np.full(n_zones + 1, big)
+    last_row = np.full(n_zones + 1, -1)
+    last_col = np.full(n_zones + 1, -1)
+    for r in bands:
+        band = np.asarray(zones[r:r + band_rows])
+        rows, cols = np.nonzero(band)
+        labels = band[rows, cols]
+        np.minimum.at(first_row, labels, rows + r)
+        np.minimum.at(first_col, labels, cols)
+        np.maximum.at(last_row, labels, rows + r + 1)
+        np.maximum.at(last_col, labels, cols + 1)
+    extents = np.stack([first_row, last_row, first_col, last_col], axis=1)
+    extents[last_row < 0] = -1
+    extents[0] = -1
+    return extents
+
+# Flood masks of all events for one window of the grid
+#    Returns:
+#        - boolean array (n_events, window rows, window columns)
+def read_block(cube, window):
+    r0, c0 = int(window.row_off), int(window.col_off)
+    r1, c1 = r0 + int(window.height), c0 + int(window.width)
+    n_events = len(cube["events"])
+    if r1 <= r0 or c1 <= c0:
+        return np.zeros((n_events, max(r1 - r0, 0), max(c1 - c0, 0)), dtype=bool)
+    chunk_rows = cube["chunk_rows"]
+    b0, b1 = c0 // 8, (c1 - 1) // 8 + 1
+    parts = []
+    for i in range(r0 // chunk_rows, (r1 - 1) // chunk_rows + 1):
+        chunk_off = i * chunk_rows
+        lo = max(r0, chunk_off) - chunk_off
+        hi = min(r1, chunk_off + chunk_rows) - chunk_off
+        parts.append(read_chunk(cube, i)[:, lo:hi, b0:b1])
+    bits = np.unpackbits(np.concatenate(parts, axis=1), axis=-1)
+    return bits[:, :, c0 - b0 * 8:c1 - b0 * 8].astype(bool)
+
+def _summarise_block(cube, masks, window):
+    flooded_cells = masks.sum(axis=(1, 2))
+    events = []
+    for k in np.flatnonzero(flooded_cells):
+        event = dict(cube["events"][k])
+        event["flooded_cells"] = int(flooded_cells[k])
+        events.append(event)
+    return {"events": events, "frequency": masks.sum(axis=0, dtype=np.int32), "window": window}
+
+def _to_cube_crs(cube, xs, ys, crs):
+    grid_crs = cube["grid"].crs
+    if crs is None or grid_crs is None or CRS.from_user_input(crs) == CRS.from_user_input(grid_crs):
+        return list(xs), list(ys)
+    return transform(crs, grid_crs, list(xs), list(ys))
+
+def _cell_of(cube, x, y, crs):
+    xs, ys = _to_cube_crs(cube, [x], [y], crs)
+    col, row = ~cube["grid"].transform * (xs[0], ys[0])
+    return int(np.floor(row)), int(np.floor(col))
+
+# Window of the cube grid covering a bounding box, clipped to the grid
+def _window_of_bounds(cube, bounds, crs):
+    left, bottom, right, top = bounds
+    xs, ys = _to_cube_crs(cube, [left, right, left, right], [bottom, bottom, top, top], crs)
+    inverse = ~cube["grid"].transform
+    cols, rows = zip(*[inverse * (x, y) for x, y in zip(xs, ys)])
+    n_rows, n_cols = cube["grid"].shape
+    r0 = min(max(int(np.floor(min(rows))), 0), n_rows)
+    r1 = min(max(int(np.ceil(max(rows))), 0), n_rows)
+    c0 = min(max(int(np.floor(min(cols))), 0), n_cols)
+    c1 = min(max(int(np.ceil(max(cols))), 0), n_cols)
+    return Window(c0, r0, c1 - c0, r1 - r0)
@@ -0,0 +1,324 @@
+# Hierarchical dissolve of the census enumeration areas (EAs)
+
+# Replaces three arcpy.management.Dissolve passes over the EA shapefile (by
+# PA_ID, ID_DIST and CodProv). The EAs are dissolved to admin 3 (posto) once;
+# admin 2 (district) is then built from the admin 3 polygons and admin 1
+# (province) from the admin 2 polygons, where the codes nest. A level whose
+# codes do not nest in the level below is dissolved from the EAs, as Dissolve
+# did.
+#
+# The EAs tile the country, so neighbouring polygons share their border
+# edges. Every ring is oriented (exteriors counter-clockwise, holes
+# clockwise), and an edge shared by two polygons of the same group appears
+# once in each direction. Those pairs cancel, and the edges left over are the
+# boundary of the group; they are stitched back into rings. Vertices are
+# matched after snapping to SNAP (map units). Where a vertex of one polygon
+# lies on an edge of its neighbour (a T-junction), that edge is split at the
+# vertex first, so the two sides cancel piece by piece. A result that is still
+# not a valid (multi)polygon is replaced by a shapely union of the group.
+
+import csv
+import warnings
+from collections import Counter, OrderedDict
+
+import fiona
+import numpy as np
+import shapely
+from shapely.geometry import mapping, shape
+from shapely.ops import unary_union
+
+# Vertex snapping tolerance, in map units (about 1 cm in degrees)
+SNAP = 1e-7
+
+# Dissolve a group of polygons into one (multi)polygon
+#    Args:
+#        geometries: GeoJSON-like Polygons / MultiPolygons
+#    Returns:
+#        - GeoJSON-like Polygon or MultiPolygon (None if nothing is left)
+def dissolve_polygons(geometries):
+    starts, ends = [], []
+    for geometry in geometries:
+        for ring, is_hole in _rings(geometry):
+            ring = _orient(ring, clockwise=is_hole)
+            starts.append(ring[:-1])
+            ends.append(ring[1:])
+    if not starts:
+        return None
+    starts, ends = np.concatenate(starts), np.concatenate(ends)
+
+    # Vertex IDs after snapping
+    points = np.concatenate([starts, ends])
+    snapped = np.round(points / SNAP).astype(np.int64)
+    keys, first, ids = np.unique(snapped, axis=0, return_index=True, return_inverse=True)
+    ids = ids.ravel()
+    coords = points[first]
+    a, b = ids[:starts.shape[0]], ids[starts.shape[0]:]
+    keep = a != b
+    a, b = _split_at_vertices(a[keep], b[keep], coords)
+
+    # Cancel edges that appear in both directions
+    n = np.int64(len(keys))
+    edge = a * n + b
+    uniq, counts = np.unique(edge, return_counts=True)
+    reverse = (uniq % n) * n + uniq // n
+    pos = np.clip(np.searchsorted(uniq, reverse), 0, len(uniq) - 1)
+    reverse_counts = np.where(uniq[pos] == reverse, counts[pos], 0)
+    net = np.maximum(counts - reverse_counts, 0)
+    boundary = np.repeat(uniq, net)
+
+    rings = _stitch(boundary // n, boundary % n, coords)
+    dissolved = _assemble(rings)
+    if dissolved is not None and not shape(dissolved).is_valid:
+        # Borders that still do not match (e.g. overlapping or slightly
+        # misaligned polygons) - fall back to a general union
+        dissolved = _union(geometries)
+    return dissolved
+
+# Dissolve EAs to nested administrative levels in one pass over the EAs
+#    Args:
+#        geometries: EA polygons (GeoJSON-like)
+#        records: EA attribute dictionaries
+#        levels: list of (code field, name field) from the finest to the
+#                coarsest level, e.g. [("PA_ID", "Posto"), ("ID_DIST",
+#                "Distrito"), ("CodProv", "Provincia")]
+#    Returns:
+#        - list with one (geometries, records) per level, sorted by code as
+#          Dissolve does. Records hold the code and the name of the level (the
+#          MAX of the EA names, as statistics_fields=[(name, "MAX")])
+def dissolve_hierarchy(geometries, records, levels):
+    out = []
+    below = None
+    for k, (code_field, name_field) in enumerate(levels):
+        # Units of this level: their EAs and names
+        members = OrderedDict()
+        names = {}
+        for i, record in enumerate(records):
+            code = record.get(code_field)
+            members.setdefault(code, []).append(i)
+            names[code] = _max_name(names.get(code), record.get(name_field))
+
+        # Build from the units of the level below where every one of them is
+        # inside a single unit of this level, otherwise from the EAs
+        groups = None
+        if below is not None:
+            lower_code = levels[k - 1][0]
+            parent = {}
+            nested = True
+            for record in records:
+                lower = record.get(lower_code)
+                if parent.setdefault(lower, record.get(code_field)) != record.get(code_field):
+                    nested = False
+                    break
+            if nested:
+                groups = OrderedDict()
+                for lower in sorted(below, key=_sort_key):
+                    groups.setdefault(parent[lower], []).append(below[lower])
+            else:
+                warnings.warn("{0} is not nested in {1} - dissolving {1} from the EAs".format(
+                    lower_code, code_field))
+        if groups is None:
+            groups = OrderedDict((code, [geometries[i] for i in members[code]]) for code in members)
+
+        below = {code: dissolve_polygons(groups[code]) for code in groups}
+        codes = sorted(below, key=_sort_key)
+        out.append(([below[c] for c in codes],
+                    [{code_field: c, name_field: names[c]} for c in codes]))
+    return out
+
+# Codes and names of the coarser levels of every unit of the finest level.
+# A unit split between several parents (codes that are not nested) goes to
+# the parent holding most of its EAs (the lowest code on a tie)
+#    Args:
+#        records: EA attribute dictionaries
+#        levels: levels passed to dissolve_hierarchy()
+#    Returns:
+#        - list of dictionaries (code and name of every level), one per unit
+#          of the finest level, sorted by code
+def code_mapping(records, levels):
+    finest_code = levels[0][0]
+    counts = OrderedDict()
+    names = [{} for _ in levels]
+    for record in records:
+        code = record.get(finest_code)
+        counts.setdefault(code, Counter())[tuple(record.get(c) for c, _ in levels[1:])] += 1
+        for k, (code_field, name_field) in enumerate(levels):
+            key = record.get(code_field)
+            names[k][key] = _max_name(names[k].get(key), record.get(name_field))
+
+    rows = []
+    for code in sorted(counts, key=_sort_key):
+        parents = min(counts[code].items(), key=lambda item: (-item[1], [_sort_key(p) for p in item[0]]))[0]
+        row = OrderedDict([(levels[0][0], code), (levels[0][1], names[0][code])])
+        for k, ((code_field, name_field), parent) in enumerate(zip(levels[1:], parents), 1):
+            row[code_field] = parent
+            row[name_field] = names[k][parent]
+        rows.append(row)
+    return rows
+
+# Table linking every admin 3 code to its admin 2 and admin 1 codes and names
+#    Args:
+#        path: output .csv file
+#        mapping: rows from code_mapping()
+#        levels: levels passed to dissolve_hierarchy()
+def write_code_mapping(path, mapping, levels):
+    fields = [f for level in levels for f in level]
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(fields)
+        for row in mapping:
+            writer.writerow([row.get(field) for field in fields])
+
+# Write polygons and their attributes to a shapefile
+#    Args:
+#        path: output .shp file
+#        geometries: GeoJSON-like geometries
+#        records: attribute dictionaries (all with the same keys)
+#        crs_wkt: CRS of the geometries
+def write_shapefile(path, geometries, records, crs_wkt):
+    properties = OrderedDict()
+    for name, value in records[0].items():
+        if isinstance(value, (int, np.integer)):
+            properties[name] = "int"
+        elif isinstance(value, (float, np.floating)):
+            properties[name] = "float"
+        else:
+            properties[name] = "str"
+    schema = {"geometry": "MultiPolygon", "properties": properties}
+    with fiona.open(path, "w", driver="ESRI Shapefile", crs_wkt=crs_wkt, schema=schema) as dst:
+        for geometry, record in zip(geometries, records):
+            if geometry is not None and geometry["type"] == "Polygon":
+                geometry = {"type": "MultiPolygon", "coordinates": [geometry["coordinates"]]}
+            dst.write({"geometry": geometry, "properties": dict(record)})
+
+def _sort_key(code):
+    return (code is None, code)
+
+# MAX of two text values, ignoring missing ones
+def _max_name(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+# Rings of a (multi)polygon as (coordinates, is_hole)
+def _rings(geometry):
+    if geometry is None:
+        return
+    if geometry["type"] == "Polygon":
+        polygons = [geometry["coordinates"]]
+    elif geometry["type"] == "MultiPolygon":
+        polygons = geometry["coordinates"]
+    else:
+        return
+    for polygon in polygons:
+        for k, ring in enumerate(polygon):
+            ring = np.asarray(ring, dtype=np.float64)[:, :2]
+            if len(ring) >= 4:
+                if not np.array_equal(ring[0], ring[-1]):
+                    ring = np.vstack([ring, ring[:1]])
+                yield ring, k > 0
+
+def _signed_area(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return np.sum(x[:-1] * y[1:] - x[1:] * y[:-1]) / 2
+
+def _orient(ring, clockwise):
+    if (_signed_area(ring) < 0) != clockwise:
+        return ring[::-1]
+    return ring
+
+# Split edges (vertex a -> vertex b) at the vertices that lie on them, within
+# SNAP - the vertices of a neighbour at a T-junction
+def _split_at_vertices(a, b, coords):
+    if len(a) == 0:
+        return a, b
+    lines = shapely.linestrings(np.stack([coords[a], coords[b]], axis=1))
+    line, point = shapely.STRtree(shapely.points(coords)).query(lines, predicate="dwithin", distance=SNAP)
+    inner = (point != a[line]) & (point != b[line])
+    line, point = line[inner], point[inner]
+    if line.size == 0:
+        return a, b
+
+    # Position of each vertex along its edge, in order along the edge
+    start, direction = coords[a[line]], coords[b[line]] - coords[a[line]]
+    t = np.einsum("ij,ij->i", coords[point] - start, direction) / np.einsum("ij,ij->i", direction, direction)
+    inner = (t > 0) & (t < 1)
+    line, point, t = line[inner], point[inner], t[inner]
+    order = np.lexsort((t, line))
+    line, point = line[order], point[order]
+
+    # Edge a -> p1 -> ... -> pk -> b for every split edge
+    first = np.r_[True, line[1:] != line[:-1]]
+    last = np.r_[line[1:] != line[:-1], True]
+    whole = np.ones(len(a), dtype=bool)
+    whole[line] = False
+    previous = np.where(first, a[line], np.r_[-1, point[:-1]])
+    return (np.concatenate([a[whole], previous, point[last]]),
+            np.concatenate([b[whole], point, b[line[last]]]))
+
+# General union of a group of polygons (shapely), as GeoJSON-like
+# (multi)polygon with its parts only
+def _union(geometries):
+    union = unary_union([shapely.make_valid(shape(g)) for g in geometries if g is not None])
+    polygons = [g for g in getattr(union, "geoms", [union]) if g.geom_type in ("Polygon", "MultiPolygon")]
+    if not polygons:
+        return None
+    return mapping(unary_union(polygons))
+
+# Chain boundary edges (vertex a -> vertex b) into closed rings. Where several
+# rings touch at a vertex, any outgoing edge that is still free is taken.
+def _stitch(a, b, coords):
+    order = np.argsort(a, kind="stable")
+    a, b = a[order], b[order]
+    first_out = np.searchsorted(a, np.arange(len(coords) + 1))
+    next_free = first_out[:-1].copy()
+    used = np.zeros(len(a), dtype=bool)
+    rings = []
+    for start in range(len(a)):
+        if used[start]:
+            continue
+        ring = [a[start]]
+        e = start
+        while True:
+            used[e] = True
+            v = b[e]
+            ring.append(v)
+            if v == ring[0]:
+                break
+            while next_free[v] < first_out[v + 1] and used[next_free[v]]:
+                next_free[v] += 1
+            if next_free[v] >= first_out[v + 1]:
+                break
+            e = next_free[v]
+        if len(ring) >= 4 and ring[0] == ring[-1]:
+            rings.append(coords[np.array(ring)])
+    return rings
+
+# Group rings into polygons: counter-clockwise rings are exteriors, clockwise
+# rings are holes of the smallest exterior that contains them
+def _assemble(rings):
+    exteriors = [r for r in rings if _signed_area(r) > 0]
+    holes = [r for r in rings if _signed_area(r) < 0]
+    if not exteriors:
+        return None
+    areas = [_signed_area(r) for r in exteriors]
+    polygons = [[r] for r in exteriors]
+    for hole in holes:
+        point = (hole[0] + hole[1]) / 2
+        inside = [i for i, r in enumerate(exteriors) if _contains(r, point)]
+        if inside:
+            polygons[min(inside, key=lambda i: areas[i])].append(hole)
+    coordinates = [[[(float(x), float(y)) for x, y in ring] for ring in polygon] for polygon in polygons]
+    if len(coordinates) == 1:
+        return {"type": "Polygon", "coordinates": coordinates[0]}
+    return {"type": "MultiPolygon", "coordinates": coordinates}
+
+# Point in ring (ray casting)
+def _contains(ring, point):
+    x, y = ring[:, 0], ring[:, 1]
+    x0, y0, x1, y1 = x[:-1], y[:-1], x[1:], y[1:]
+    crosses = (y0 > point[1]) != (y1 > point[1])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_at = x0 + (point[1] - y0) * (x1 - x0) / (y1 - y0)
+    return bool(np.sum(crosses & (point[0] < x_at)) % 2)
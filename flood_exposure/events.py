@@ -0,0 +1,37 @@
+# Flood event names
+
+# Flood layers are named as in the GFD / DFO exports:
+#     DFO_<ID>_From_<YYYYMMDD>_to_<YYYYMMDD>[_masked]
+# This module turns a name into the event metadata used by the exposure tools.
+
+import datetime
+
+# First DFO event that is not in the Global Flood Database (see 03-flood-event-list.py)
+GFD_END = datetime.date(2018, 1, 14)
+
+# EM-DAT events were given their own small IDs (1, 2, 3) in 03-flood-event-list.py,
+# DFO archive IDs are 4-digit numbers
+EMDAT_MAX_ID = 999
+
+# Event metadata from a flood layer name
+#    Args:
+#        raster_name: e.g. "DFO_4500_From_20190101_to_20190115_masked"
+#    Returns:
+#        - dictionary with "id" (e.g. "DFO_4500"), "number", "began", "ended"
+#          (ISO dates), "year" and "source" ("GFD", "DFO" or "EM-DAT")
+def parse_event_name(raster_name):
+    parts = raster_name.split("_")
+    number = int(parts[1])
+    began = datetime.datetime.strptime(raster_name.split("From_")[1][:8], "%Y%m%d").date()
+    ended = datetime.datetime.strptime(raster_name.split("_to_")[1][:8], "%Y%m%d").date()
+
+    if began < GFD_END:
+        source = "GFD"
+    elif number <= EMDAT_MAX_ID:
+        source = "EM-DAT"
+    else:
+        source = "DFO"
+
+    return {"id": "DFO_" + parts[1], "number": number, "name": raster_name,
+            "began": began.isoformat(), "ended": ended.isoformat(),
+            "year": began.year, "source": source}
@@ -0,0 +1,68 @@
+# Roll-up of posto results to districts and provinces
+
+# Postos nest in districts and districts in provinces (see the code mapping
+# written by 02-shapefile-prepare.py). Zonal SUMs and COUNTs are additive, so
+# the district and province statistics are sums of the posto statistics - no
+# raster is read again. Percentages are then recomputed from the rolled-up
+# totals, not averaged.
+
+import csv
+
+import numpy as np
+
+from flood_exposure.zonal import stats_from_sums
+
+# Read the code mapping table (PA_ID, Posto, ID_DIST, Distrito, CodProv, ...)
+#    Returns:
+#        - list of dictionaries, one per posto (values as text)
+def read_code_mapping(path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+# Parent units of a list of zones
+#    Args:
+#        zone_codes: code of every zone, in zone order (e.g. PA_ID of each posto)
+#        mapping: rows from read_code_mapping()
+#        code_field: code of the zones in the mapping (e.g. "PA_ID")
+#        parent_field: code of the parent level (e.g. "ID_DIST")
+#        parent_name: optional name field of the parent level (e.g. "Distrito")
+#    Returns:
+#        - (parents, index): parents is a dictionary of columns (parent code
+#          and name), one row per parent unit sorted by code; index gives the
+#          row of the parent of every zone (-1 for zones not in the mapping)
+def parent_units(zone_codes, mapping, code_field, parent_field, parent_name=None):
+    parent_of = {}
+    name_of = {}
+    for row in mapping:
+        parent_of[str(row[code_field])] = _code(row[parent_field])
+        if parent_name is not None:
+            name_of[_code(row[parent_field])] = row[parent_name]
+
+    codes = sorted(set(parent_of.values()), key=lambda c: (isinstance(c, str), c))
+    position = {c: i for i, c in enumerate(codes)}
+    index = np.array([position.get(parent_of.get(str(z)), -1) for z in zone_codes], dtype=np.int64)
+
+    parents = {parent_field: codes}
+    if parent_name is not None:
+        parents[parent_name] = [name_of[c] for c in codes]
+    return parents, index
+
+# Roll zonal statistics up to the parent units
+#    Args:
+#        stats: zonal_stats() dictionary of the zones
+#        index: parent row of every zone, from parent_units()
+#        n_units: number of parent units
+#    Returns:
+#        - zonal_stats() dictionary of the parent units (SUM and COUNT added
+#          up, MEAN recomputed)
+def roll_up(stats, index, n_units):
+    known = index >= 0
+    sums = np.bincount(index[known], weights=stats["SUM"][known], minlength=n_units)
+    counts = np.bincount(index[known], weights=stats["COUNT"][known], minlength=n_units)
+    return stats_from_sums(sums, counts.astype(np.asarray(stats["COUNT"]).dtype))
+
+def _code(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
@@ -0,0 +1,119 @@
+# Resumable runs of the exposure scripts
+
+# Every event of 08 / 09 is recorded in a run manifest together with a content
+# hash of its inputs (flood raster, population / cropland raster, posto
+# shapefile and parameters). The per-event zonal statistics are kept in a local
+# result store next to the manifest:
+#
+#     <run folder>/manifest.json         event -> input hash and result file
+#     <run folder>/DFO_4500.npz          SUM / COUNT arrays of the event
+#
+# On a rerun, events whose input hash is unchanged are read from the store and
+# only new or modified events are computed - adding one flood event costs one
+# event, and a run that crashed part-way resumes where it stopped.
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from flood_exposure import zonal
+from flood_exposure.zones import shapefile_fingerprint
+
+MANIFEST_FILE = "manifest.json"
+
+# Bump to invalidate every stored result (e.g. when the zonal statistics change)
+MANIFEST_VERSION = 1
+
+# File hashes already computed in this process, keyed by (path, size, mtime)
+_file_hashes = {}
+
+# Content hash of a file
+def file_fingerprint(path):
+    info = os.stat(path)
+    key = (os.path.abspath(path), info.st_size, info.st_mtime_ns)
+    if key not in _file_hashes:
+        sha = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        _file_hashes[key] = sha.hexdigest()[:16]
+    return _file_hashes[key]
+
+# Hash of the inputs of one event
+#    Args:
+#        rasters: list of raster files the event reads
+#        shapefile: zone shapefile
+#        params: dictionary of the parameters that change the results
+#    Returns:
+#        - hex digest
+def event_hash(rasters, shapefile, params=None):
+    parts = {"version": MANIFEST_VERSION,
+             "rasters": [file_fingerprint(path) for path in rasters],
+             "zones": shapefile_fingerprint(shapefile),
+             "params": params or {}}
+    text = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+# Open (or start) the manifest of a run
+#    Args:
+#        run_folder: folder of the manifest and result store
+#                    (e.g. results/runs/08-population-exposed)
+#    Returns:
+#        - dictionary with the "folder" and the manifest "events"
+def open_manifest(run_folder):
+    path = os.path.join(run_folder, MANIFEST_FILE)
+    events = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            events = json.load(f).get("events", {})
+    return {"folder": run_folder, "events": events}
+
+# Stored results of an event, if its inputs are unchanged
+#    Args:
+#        manifest: manifest from open_manifest()
+#        event_id: event ID (e.g. "DFO_4500")
+#        digest: event_hash() of the event inputs
+#    Returns:
+#        - dictionary of zonal_stats() dictionaries (e.g. {"total": ...,
+#          "flooded": ...}), or None if the event has to be computed
+def load_result(manifest, event_id, digest):
+    entry = manifest["events"].get(event_id)
+    if entry is None or entry["hash"] != digest:
+        return None
+    path = os.path.join(manifest["folder"], entry["file"])
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return {name: zonal.stats_from_sums(data[name + "_SUM"], data[name + "_COUNT"])
+                for name in entry["stats"]}
+
+# Store the results of an event and record it in the manifest
+#    Args:
+#        manifest: manifest from open_manifest()
+#        event_id: event ID
+#        digest: event_hash() of the event inputs
+#        stats: dictionary of zonal_stats() dictionaries
+def save_result(manifest, event_id, digest, stats):
+    folder = manifest["folder"]
+    os.makedirs(folder, exist_ok=True)
+    file_name = event_id + ".npz"
+    arrays = {}
+    for name, s in stats.items():
+        arrays[name + "_SUM"] = s["SUM"]
+        arrays[name + "_COUNT"] = s["COUNT"]
+    tmp_file = os.path.join(folder, event_id + ".tmp.npz")
+    np.savez(tmp_file, **arrays)
+    os.replace(tmp_file, os.path.join(folder, file_name))
+
+    manifest["events"][event_id] = {"hash": digest, "file": file_name, "stats": sorted(stats)}
+    _write_manifest(manifest)
+
+# Write the manifest atomically - a crash never leaves it half written
+def _write_manifest(manifest):
+    path = os.path.join(manifest["folder"], MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "events": manifest["events"]}, f, indent=1)
+    os.replace(tmp_path, path)
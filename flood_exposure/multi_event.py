@@ -0,0 +1,120 @@
+# Multi-event exposure over a stack of flood events
+
+# Several flood events often fall in the same year (e.g. the three 2022 EM-DAT
+# events) and share the same population raster. The flood masks of those events
+# are stacked as bit planes (bit k = event k) on the population grid, and the
+# flooded population of every event is computed in one pass over the population
+# pixels. The population raster is then read once per year, not once per event.
+
+import numpy as np
+import rasterio
+
+from flood_exposure import zonal
+from flood_exposure.raster import valid_mask
+from flood_exposure.tiles import TILE_SIZE, iter_windows, read_window, window_slice
+
+# Up to this many events, every combination of events (2 ** n codes) gets its
+# own bincount slot, so one bincount covers all events. Above it, one bincount
+# per event is used.
+MAX_COMBINED_EVENTS = 8
+
+# Smallest unsigned integer type with at least n_events bits
+def code_dtype(n_events):
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if n_events <= np.iinfo(dtype).bits:
+            return dtype
+    raise ValueError("At most 64 events can be stacked, got {0}".format(n_events))
+
+# Stack boolean flood masks as bit planes
+#    Args:
+#        flood_masks: list of boolean arrays on the same grid, one per event
+#    Returns:
+#        - array of event codes - bit k is set where event k flooded
+def stack_events(flood_masks):
+    dtype = code_dtype(len(flood_masks))
+    codes = np.zeros(flood_masks[0].shape, dtype=dtype)
+    for k, mask in enumerate(flood_masks):
+        codes |= mask.astype(dtype) << dtype(k)
+    return codes
+
+# Total and per-event flooded zonal statistics in one pass
+#    Args:
+#        zones: integer label grid, 0 = no zone
+#        values: value raster on the same grid (e.g. population counts)
+#        codes: event codes from stack_events()
+#        n_events: number of stacked events
+#        n_zones: number of zones
+#        valid: boolean mask of cells with data
+#    Returns:
+#        - (total, flooded): total is a zonal_stats() dictionary and flooded a
+#          list with one zonal_stats() dictionary per event
+def event_zonal_stats(zones, values, codes, n_events, n_zones, valid=None):
+    keep = zones > 0
+    if valid is not None:
+        keep &= valid
+    z = zones[keep].astype(np.int64)
+    c = codes[keep].astype(np.int64)
+    v = values[keep].astype(np.float64)
+
+    if n_events <= MAX_COMBINED_EVENTS:
+        # One bincount over (zone, event combination), then add up the
+        # combinations that include each event
+        n_codes = 1 << n_events
+        size = (n_zones + 1) * n_codes
+        sums = np.bincount(z * n_codes + c, weights=v, minlength=size)[:size]
+        counts = np.bincount(z * n_codes + c, minlength=size)[:size]
+        sums = sums.reshape(-1, n_codes)[1:]
+        counts = counts.reshape(-1, n_codes)[1:]
+        bits = (np.arange(n_codes)[:, None] >> np.arange(n_events)[None, :]) & 1
+        total = zonal.stats_from_sums(sums.sum(axis=1), counts.sum(axis=1))
+        flooded = [zonal.stats_from_sums(sums @ bits[:, k], counts @ bits[:, k]) for k in range(n_events)]
+        return total, flooded
+
+    total = zonal.zonal_stats(z, v, n_zones)
+    flooded = []
+    for k in range(n_events):
+        hit = ((c >> k) & 1).astype(bool)
+        flooded.append(zonal.zonal_stats(z[hit], v[hit], n_zones))
+    return total, flooded
+
+# Total and per-event flooded zonal statistics, streamed tile by tile
+#    Args:
+#        zones: label grid on `grid` (e.g. from zones.zone_labels)
+#        value_path: raster with the values to sum (population)
+#        flood_paths: list of flood rasters (1 = flooded), one per event
+#        grid: analysis grid - the layers are resampled onto it per tile
+#        n_zones: number of zones
+#        tile_size: number of cells along each side of a tile; None reads
+#                   the whole grid as a single tile
+#    Returns:
+#        - (total, flooded) as event_zonal_stats()
+def stream_event_zonal(zones, value_path, flood_paths, grid, n_zones, tile_size=TILE_SIZE):
+    n_events = len(flood_paths)
+    if tile_size is None:
+        tile_size = max(grid.shape)
+    totals = []
+    floods = [[] for k in range(n_events)]
+    with rasterio.open(value_path) as value_src:
+        flood_srcs = [rasterio.open(path) for path in flood_paths]
+        try:
+            for window in iter_windows(grid.shape, tile_size):
+                tile_zones = np.asarray(zones[window_slice(window)])
+                if not tile_zones.any():
+                    continue
+
+                values, value_nodata = read_window(value_src, grid, window)
+                masks = [read_window(src, grid, window)[0] == 1 for src in flood_srcs]
+                total, flooded = event_zonal_stats(tile_zones, values, stack_events(masks),
+                                                   n_events, n_zones,
+                                                   valid_mask(values, value_nodata))
+                totals.append(total)
+                for k in range(n_events):
+                    floods[k].append(flooded[k])
+        finally:
+            for src in flood_srcs:
+                src.close()
+
+    if not totals:
+        empty = zonal.zonal_stats(np.zeros(0, dtype=np.int32), np.zeros(0), n_zones)
+        return empty, [empty] * n_events
+    return zonal.merge_stats(totals), [zonal.merge_stats(parts) for parts in floods]
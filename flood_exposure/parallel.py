@@ -0,0 +1,206 @@
+# Parallel execution of independent events
+
+# Once the zone labels and per-year baselines exist, the events of 08 / 09 are
+# independent. run_parallel() spreads them over a ProcessPoolExecutor. The
+# large read-only inputs (zone label grid, cell-area vector, baseline masks)
+# are copied once into multiprocessing.shared_memory blocks, and every worker
+# attaches to them when it starts - tasks only carry small descriptions (paths,
+# grids and the names of the shared arrays), so no big array is pickled.
+#
+# Workers are forked, as on the Linux batch nodes. With max_workers=1 the tasks
+# run in this process, without a pool or shared memory.
+
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from flood_exposure import baseline, coverage, multi_event, pixel_index
+
+# Shared arrays of this process (a worker, or the main process when running
+# without a pool), by name
+_shared = {}
+
+# Shared memory blocks attached by this process - kept open while it runs
+_attached = []
+
+# Copy arrays into shared memory
+#    Args:
+#        arrays: dictionary name -> array
+#    Returns:
+#        - (blocks, specs): the SharedMemory blocks (to release() at the end)
+#          and a dictionary name -> (block name, shape, dtype) for attach()
+def share_arrays(arrays):
+    blocks = []
+    specs = {}
+    try:
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            specs[name] = (block.name, array.shape, array.dtype.str)
+    except BaseException:
+        release(blocks)
+        raise
+    return blocks, specs
+
+# Close and free shared memory blocks from share_arrays()
+def release(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+# Attach to arrays shared by another process (read-only views)
+#    Args:
+#        specs: dictionary from share_arrays()
+#    Returns:
+#        - dictionary name -> array
+def attach_arrays(specs):
+    arrays = {}
+    for name, (block_name, shape, dtype) in specs.items():
+        block = _open_block(block_name)
+        _attached.append(block)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        arrays[name] = array
+    return arrays
+
+# Workers are forked, so they share the resource tracker of the main process,
+# which already tracks the block and frees it in release()
+def _open_block(block_name):
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=block_name, track=False)
+    return shared_memory.SharedMemory(name=block_name)
+
+def _init_worker(specs):
+    _shared.update(attach_arrays(specs))
+
+# Shared array of a task
+def shared_array(name):
+    return _shared[name]
+
+# Run tasks in parallel
+#    Args:
+#        func: module-level function taking one task (so it can be pickled);
+#              it gets the shared arrays with shared_array(name)
+#        tasks: list of tasks (small picklable objects, e.g. dictionaries)
+#        arrays: dictionary name -> array shared with every task
+#        max_workers: number of worker processes (default: one per core)
+#        on_result: optional function(task, result), called in this process as
+#                   soon as a task finishes (e.g. to store its result, so an
+#                   interrupted run keeps the finished tasks)
+#    Returns:
+#        - list of results, in the order of the tasks
+def run_parallel(func, tasks, arrays=None, max_workers=None, on_result=None):
+    arrays = arrays or {}
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = min(max_workers, len(tasks))
+
+    if max_workers <= 1:
+        _shared.update(arrays)
+        try:
+            results = []
+            for task in tasks:
+                results.append(func(task))
+                if on_result is not None:
+                    on_result(task, results[-1])
+            return results
+        finally:
+            for name in arrays:
+                _shared.pop(name, None)
+
+    blocks, specs = share_arrays(arrays)
+    try:
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(specs,)) as pool:
+            futures = {pool.submit(func, task): i for i, task in enumerate(tasks)}
+            results = [None] * len(tasks)
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i] = future.result()
+                if on_result is not None:
+                    on_result(tasks[i], results[i])
+            return results
+    finally:
+        release(blocks)
+
+# Tasks of the exposure scripts ###########################
+
+# Total and flooded population of the events of one year (08)
+#    Task: dictionary with "zones" (name of the shared label grid), "value_path",
+#          "flood_paths", "grid", "n_zones" and "tile_size"
+#    Returns:
+#        - (total, flooded) as multi_event.stream_event_zonal()
+def population_year_task(task):
+    return multi_event.stream_event_zonal(shared_array(task["zones"]), task["value_path"],
+                                          task["flood_paths"], task["grid"], task["n_zones"],
+                                          task["tile_size"])
+
+# Cropland baseline of one year (09)
+#    Task: dictionary with "zones", "areas" (names of the shared label grid and
+#          row-area vector), "value_path", "grid", "n_zones", "value_class" and
+#          "tile_size"
+#    Returns:
+#        - baseline, as baseline.class_baseline()
+def class_baseline_task(task):
+    zones, weights = _task_zones_weights(task)
+    return baseline.class_baseline(zones, task["value_path"], task["grid"], task["n_zones"],
+                                   task["value_class"], weights, task["tile_size"])
+
+# Flooded cropland of one event (09)
+#    Task: dictionary with "zones", "areas", "mask" (name of the shared packed
+#          baseline mask), "flood_path", "grid", "n_zones" and "tile_size"
+#    Returns:
+#        - zonal_stats() dictionary, as baseline.stream_flooded()
+def flooded_task(task):
+    zones, weights = _task_zones_weights(task)
+    base = {"mask": shared_array(task["mask"]), "shape": tuple(task["grid"].shape)}
+    return baseline.stream_flooded(zones, task["flood_path"], base, task["grid"],
+                                   task["n_zones"], weights, task["tile_size"])
+
+# Total and flooded statistics of the events of one task with exact coverage
+# weights (09 with exact_coverage)
+#    Task: dictionary with "coverage" (name of the shared coverage arrays, see
+#          coverage.coverage_arrays), "value_path", "flood_paths", "grid",
+#          "n_zones", "tile_size" (rows per band) and, for a classified layer,
+#          "value_class" and "areas"
+#    Returns:
+#        - (total, flooded) as coverage.coverage_event_zonal()
+def coverage_task(task):
+    name = task["coverage"]
+    cov = {"zones": shared_array(name + "_zones"), "cells": shared_array(name + "_cells"),
+           "weights": shared_array(name + "_weights"), "shape": tuple(task["grid"].shape)}
+    weights = None
+    if task.get("areas") is not None:
+        weights = np.broadcast_to(shared_array(task["areas"])[:, None], task["grid"].shape)
+    return coverage.coverage_event_zonal(cov, task["value_path"], task["flood_paths"], task["grid"],
+                                         task["n_zones"], task.get("value_class"), weights, task["tile_size"])
+
+# Total and flooded statistics of the events of one task for a few postos,
+# gathered through the posto pixel index (08 / 09 with zone_ids)
+#    Task: dictionary with "shapefile" and "cache_folder" (the index is built
+#          beforehand and memory-mapped from the cache), "postos" (zone labels),
+#          "value_path", "flood_paths", "grid", "n_zones" and, for a classified
+#          layer, "value_class" and "areas"
+#    Returns:
+#        - (total, flooded) as pixel_index.zones_event_zonal()
+def pixel_index_task(task):
+    index = pixel_index.pixel_index(task["shapefile"], task["grid"], task["cache_folder"])
+    weights = None
+    if task.get("areas") is not None:
+        weights = np.broadcast_to(shared_array(task["areas"])[:, None], task["grid"].shape)
+    return pixel_index.zones_event_zonal(index, task["postos"], task["value_path"], task["flood_paths"],
+                                         task["grid"], task["n_zones"], task.get("value_class"), weights)
+
+def _task_zones_weights(task):
+    zones = shared_array(task["zones"])
+    weights = None
+    if task.get("areas") is not None:
+        weights = np.broadcast_to(shared_array(task["areas"])[:, None], task["grid"].shape)
+    return zones, weights
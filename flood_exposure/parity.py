@@ -0,0 +1,80 @@
+# Parity check of the NumPy exposure tables against the arcpy ones
+
+# 08 and 09 were ported from arcpy geoprocessing (Resample, ProjectRaster,
+# ZonalStatisticsAsTable, ...) to NumPy. compare_tables() checks a table
+# written by the NumPy version of a script against the table the arcpy version
+# wrote for the same events and inputs, column by column, so the port can be
+# checked on the real data. Both versions round their results and the cell-
+# centre rules can differ on the odd pixel, hence the tolerances.
+
+import csv
+
+import numpy as np
+
+# Read a csv table
+#    Returns:
+#        - dictionary column name -> list of values (as text)
+def read_table(path):
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    columns = list(rows[0]) if rows else []
+    return {name: [row[name] for row in rows] for name in columns}
+
+# Compare a table with a reference table
+#    Args:
+#        reference_path: csv written by the arcpy version (e.g. ExportTable output)
+#        table_path: csv written by the NumPy version
+#        key: column matching the rows of the two tables
+#        rtol, atol: relative / absolute tolerance for numbers
+#    Returns:
+#        - list of (column, rows that differ, largest difference), one per
+#          column of the reference table that differs. A column missing from
+#          the table has None rows; text columns have a None difference
+def compare_tables(reference_path, table_path, key="OBJECTID", rtol=1e-3, atol=1.0):
+    reference = read_table(reference_path)
+    table = read_table(table_path)
+    position = {k: i for i, k in enumerate(table[key])}
+    rows = [position.get(k) for k in reference[key]]
+    missing_rows = sum(r is None for r in rows)
+    if missing_rows:
+        return [(key, missing_rows, None)]
+
+    differences = []
+    for name, ref_values in reference.items():
+        if name not in table:
+            differences.append((name, None, None))
+            continue
+        values = [table[name][r] for r in rows]
+        ref_numbers, numbers = _numbers(ref_values), _numbers(values)
+        if ref_numbers is not None and numbers is not None:
+            close = np.isclose(numbers, ref_numbers, rtol=rtol, atol=atol, equal_nan=True)
+            if not close.all():
+                diff = np.abs(numbers - ref_numbers)[~close]
+                differences.append((name, int((~close).sum()), float(np.nanmax(diff)) if
+                                    np.isfinite(diff).any() else np.nan))
+        else:
+            n_diff = sum(a.strip() != b.strip() for a, b in zip(values, ref_values))
+            if n_diff:
+                differences.append((name, n_diff, None))
+    return differences
+
+# Print the result of compare_tables()
+def print_report(differences):
+    if not differences:
+        print("Parity check passed - the table matches the arcpy table")
+        return
+    print("Parity check - columns that differ from the arcpy table:")
+    for name, n_rows, max_diff in differences:
+        if n_rows is None:
+            print("  " + name + ": missing")
+        elif max_diff is None:
+            print("  " + name + ": " + str(n_rows) + " rows differ")
+        else:
+            print("  " + name + ": " + str(n_rows) + " rows differ, by up to " + str(round(max_diff, 4)))
+
+# Text values as floats (empty -> NaN), or None if a value is not a number
+def _numbers(values):
+    try:
+        return np.array([float(v) if v.strip() else np.nan for v in values])
+    except ValueError:
+        return None
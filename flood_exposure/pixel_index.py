@@ -0,0 +1,168 @@
+# Inverted pixel index of the postos
+
+# For every posto, the flat indices (row * cols + col) of the cells it covers
+# on a grid, stored CSR style: the pixels of zone z are
+#     pixels[offsets[z]:offsets[z + 1]]
+# The index is built once per grid (100m population, 250m flood, ...) and
+# cached on disk next to the label grids. Exposure for a few postos (e.g. a
+# rapid response for one province) then only reads the block of each layer
+# that covers them and gathers their pixels - the cost follows the area of
+# interest, not the whole country.
+
+import os
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from flood_exposure import multi_event, zonal
+from flood_exposure.raster import grid_key, valid_mask
+from flood_exposure.tiles import read_window
+from flood_exposure.zones import shapefile_fingerprint, zone_labels
+
+# Indexes already loaded in this process
+_loaded = {}
+
+# Build the index of a label grid, band by band
+#    Args:
+#        zones: label grid (e.g. from zones.zone_labels, memory-mapped)
+#        n_zones: number of zones
+#        band_rows: number of rows read at a time
+#    Returns:
+#        - dictionary with "offsets" (int64, n_zones + 2), "pixels" (int64
+#          flat indices, zone by zone and in row-major order within a zone)
+#          and the grid "shape"
+def build_pixel_index(zones, n_zones, band_rows=1024):
+    rows, cols = zones.shape
+    counts = np.zeros(n_zones + 1, dtype=np.int64)
+    for r in range(0, rows, band_rows):
+        counts += np.bincount(np.asarray(zones[r:r + band_rows]).ravel(),
+                              minlength=n_zones + 1)[:n_zones + 1]
+    counts[0] = 0
+
+    offsets = np.zeros(n_zones + 2, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    pixels = np.empty(offsets[-1], dtype=np.int64)
+    fill = offsets[:-1].copy()
+    for r in range(0, rows, band_rows):
+        band = np.asarray(zones[r:r + band_rows]).ravel()
+        flat = np.flatnonzero(band)
+        labels = band[flat]
+        order = np.argsort(labels, kind="stable")
+        labels, flat = labels[order], flat[order] + r * cols
+        band_counts = np.bincount(labels, minlength=n_zones + 1)[:n_zones + 1]
+        # Position of each pixel within its zone in this band
+        starts = np.cumsum(band_counts) - band_counts
+        within = np.arange(labels.size) - starts[labels]
+        pixels[fill[labels] + within] = flat
+        fill += band_counts
+    return {"offsets": offsets, "pixels": pixels, "shape": (rows, cols)}
+
+# Pixel index of a shapefile on a grid, built once and cached
+#    Args:
+#        shapefile: path to the zone shapefile
+#        grid: raster.Grid of the index
+#        cache_folder: folder of the cached label grids and indexes
+#    Returns:
+#        - index as build_pixel_index() (arrays memory-mapped from the cache)
+def pixel_index(shapefile, grid, cache_folder):
+    key = shapefile_fingerprint(shapefile) + "_" + grid_key(grid)
+    if key in _loaded:
+        return _loaded[key]
+
+    name = os.path.splitext(os.path.basename(shapefile))[0]
+    base = os.path.join(cache_folder, "{0}_pixels_{1}".format(name, key))
+    if not os.path.exists(base + "_pixels.npy"):
+        zones = zone_labels(shapefile, grid, cache_folder)
+        n_zones = 0
+        for r in range(0, zones.shape[0], 1024):
+            n_zones = max(n_zones, int(np.asarray(zones[r:r + 1024]).max(initial=0)))
+        index = build_pixel_index(zones, n_zones)
+        np.save(base + "_offsets.npy", index["offsets"])
+        np.save(base + "_pixels.tmp.npy", index["pixels"])
+        os.replace(base + "_pixels.tmp.npy", base + "_pixels.npy")
+
+    _loaded[key] = {"offsets": np.load(base + "_offsets.npy"),
+                    "pixels": np.load(base + "_pixels.npy", mmap_mode="r"),
+                    "shape": tuple(grid.shape)}
+    return _loaded[key]
+
+# Flat pixel indices of some zones
+#    Args:
+#        index: pixel index
+#        zone_ids: zone labels (1-based, OBJECTID)
+#    Returns:
+#        - (pixels, labels): flat indices and the zone label of each of them
+def zone_pixels(index, zone_ids):
+    offsets = index["offsets"]
+    parts = [np.asarray(index["pixels"][offsets[z]:offsets[z + 1]]) for z in zone_ids]
+    labels = [np.full(p.size, z, dtype=np.int32) for z, p in zip(zone_ids, parts)]
+    if not parts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32)
+    return np.concatenate(parts), np.concatenate(labels)
+
+# Zone labels of postos given by an attribute (e.g. PA_ID)
+#    Args:
+#        records: attribute dictionaries in shapefile order (zones.read_zones)
+#        values: attribute values to look for
+#        field: attribute name
+#    Returns:
+#        - list of zone labels (record position + 1)
+def zones_by_attribute(records, values, field="PA_ID"):
+    position = {r.get(field): i + 1 for i, r in enumerate(records)}
+    missing = [v for v in values if v not in position]
+    if missing:
+        raise KeyError("No posto with {0} {1}".format(field, missing))
+    return [position[v] for v in values]
+
+# Values of a raster at some pixels of a grid - only the block of the grid
+# that covers them is read (and resampled onto the grid)
+#    Args:
+#        dataset: open rasterio dataset
+#        grid: grid of the flat pixel indices
+#        pixels: flat pixel indices
+#    Returns:
+#        - (values, nodata)
+def read_pixels(dataset, grid, pixels, band=1):
+    rows, cols = np.divmod(np.asarray(pixels), grid.shape[1])
+    if rows.size == 0:
+        return np.zeros(0, dtype=dataset.dtypes[band - 1]), dataset.nodata
+    r0, c0 = rows.min(), cols.min()
+    window = Window(c0, r0, cols.max() + 1 - c0, rows.max() + 1 - r0)
+    block, nodata = read_window(dataset, grid, window, band)
+    return block[rows - r0, cols - c0], nodata
+
+# Total and per-event flooded zonal statistics of a few postos
+#    Args:
+#        index: pixel index on `grid`
+#        zone_ids: zone labels of the postos
+#        value_path: raster with the values to sum (population, cropland)
+#        flood_paths: flood rasters (1 = flooded), one per event
+#        grid: grid of the index
+#        n_zones: number of zones (the statistics keep one slot per posto)
+#        value_class: if set, only cells with this value count (e.g. 1 for
+#                     cropland)
+#        weights: optional array on `grid` (e.g. cell_area.cell_areas) - SUM
+#                 adds up the weights of the cells that count
+#    Returns:
+#        - (total, flooded) as multi_event.event_zonal_stats() - postos not
+#          in zone_ids get 0 / NaN; without flood_paths flooded is empty
+def zones_event_zonal(index, zone_ids, value_path, flood_paths, grid, n_zones,
+                      value_class=None, weights=None):
+    pixels, labels = zone_pixels(index, zone_ids)
+    with rasterio.open(value_path) as src:
+        values, nodata = read_pixels(src, grid, pixels)
+    valid = valid_mask(values, nodata)
+    if value_class is not None:
+        valid &= values == value_class
+    if weights is not None:
+        values = weights[np.divmod(pixels, grid.shape[1])]
+    if not flood_paths:
+        return zonal.zonal_stats(labels, values, n_zones, valid), []
+
+    masks = []
+    for path in flood_paths:
+        with rasterio.open(path) as src:
+            masks.append(read_pixels(src, grid, pixels)[0] == 1)
+    return multi_event.event_zonal_stats(labels, values, multi_event.stack_events(masks),
+                                         len(flood_paths), n_zones, valid)
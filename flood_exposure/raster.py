@@ -0,0 +1,89 @@
+# Raster helpers for the exposure scripts (08, 09)
+
+# Rasters are read with rasterio into NumPy arrays, together with a Grid that
+# describes where the pixels sit (affine transform, (rows, cols) shape and CRS
+# as WKT). Everything downstream works on plain arrays, so no ArcGIS licence
+# is needed.
+
+import hashlib
+from collections import namedtuple
+
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.warp import calculate_default_transform, reproject, Resampling
+
+# Definition of a raster grid - two rasters on the same Grid are pixel-aligned
+Grid = namedtuple("Grid", ["transform", "shape", "crs"])
+
+# Build a Grid from an open rasterio dataset
+def grid_of(dataset):
+    crs = dataset.crs.to_wkt() if dataset.crs else None
+    return Grid(dataset.transform, (dataset.height, dataset.width), crs)
+
+# Short hash identifying a grid - used to key caches of grid-dependent layers
+def grid_key(grid):
+    text = repr((tuple(grid.transform)[:6], tuple(grid.shape), grid.crs))
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+# True if two CRS (WKT, EPSG code, rasterio CRS...) are the same - the WKT
+# text of one CRS can be written in more than one way
+def same_crs(crs1, crs2):
+    if crs1 == crs2:
+        return True
+    if crs1 is None or crs2 is None:
+        return False
+    return CRS.from_user_input(crs1) == CRS.from_user_input(crs2)
+
+# Grid covering the same area in another CRS, as ProjectRaster would choose it
+def project_grid(grid, crs):
+    rows, cols = grid.shape
+    left, top = grid.transform * (0, 0)
+    right, bottom = grid.transform * (cols, rows)
+    transform, width, height = calculate_default_transform(
+        grid.crs, crs, cols, rows, left=left, bottom=bottom, right=right, top=top)
+    return Grid(transform, (height, width), crs)
+
+# Grid of a raster file, without reading its pixels
+def read_grid(path):
+    with rasterio.open(path) as src:
+        return grid_of(src)
+
+# Read one band of a raster
+#    Args:
+#        path: path to the raster file (e.g. .tif)
+#        band: band number, 1-based as in rasterio/ArcGIS
+#    Returns:
+#        - (array, nodata, grid)
+def read_raster(path, band=1):
+    with rasterio.open(path) as src:
+        return src.read(band), src.nodata, grid_of(src)
+
+# Boolean mask of the cells that hold data (i.e. not NoData / NaN). This is
+# the "DATA" option of ZonalStatisticsAsTable.
+def valid_mask(array, nodata=None):
+    valid = np.ones(array.shape, dtype=bool)
+    if np.issubdtype(array.dtype, np.floating):
+        valid &= ~np.isnan(array)
+    if nodata is not None and not np.isnan(nodata):
+        valid &= array != nodata
+    return valid
+
+# Resample a raster onto another grid, nearest neighbour by default - the
+# in-memory equivalent of arcpy.management.Resample(..., "NEAREST")
+#    Args:
+#        array: the source pixels
+#        src_grid: Grid of the source pixels
+#        dst_grid: Grid to resample onto
+#        nodata: NoData value of the source (also used to fill the output)
+#    Returns:
+#        - array with dst_grid.shape
+def resample_to_grid(array, src_grid, dst_grid, nodata=0, resampling=Resampling.nearest):
+    out = np.full(dst_grid.shape, nodata, dtype=array.dtype)
+    reproject(array, out,
+              src_transform=src_grid.transform, src_crs=src_grid.crs,
+              src_nodata=nodata,
+              dst_transform=dst_grid.transform, dst_crs=dst_grid.crs,
+              dst_nodata=nodata,
+              resampling=resampling)
+    return out
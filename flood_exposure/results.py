@@ -0,0 +1,139 @@
+# Result matrix of the exposure scripts
+
+# The per-event results of 08 / 09 are kept in one (posto x event x metric)
+# array instead of being joined and calculated into the attribute table event
+# by event. The wide table (one column per metric and event, e.g.
+# Pop_Flood_DFO_4500, Pct_P_Flood_DFO_4500, ...) is only built at the end and
+# written once - to CSV, to Parquet and / or joined to the posto polygons.
+
+import csv
+import os
+
+import fiona
+import numpy as np
+
+# Attribute table of the zones - OBJECTID (the zone label) followed by every
+# attribute of the zone shapefile, as ExportTable writes them ahead of the
+# computed fields
+#    Args:
+#        records: attribute dictionaries of the zones, from zones.read_zones()
+#    Returns:
+#        - dictionary column name -> list, one value per zone
+def zone_table(records):
+    table = {"OBJECTID": list(range(1, len(records) + 1))}
+    for name in (records[0] if records else {}):
+        if name not in table:
+            table[name] = [r.get(name) for r in records]
+    return table
+
+# Some rows of a table (or of a statistics dictionary), e.g. the postos of a
+# targeted run
+#    Args:
+#        columns: dictionary column name -> list / array
+#        rows: positions of the rows to keep
+#    Returns:
+#        - dictionary with the same columns
+def select_rows(columns, rows):
+    return {name: values[rows] if isinstance(values, np.ndarray) else [values[i] for i in rows]
+            for name, values in columns.items()}
+
+# Empty result matrix
+#    Args:
+#        n_zones: number of postos
+#        event_ids: event IDs in column order (e.g. ["DFO_3365", ...])
+#        metrics: metric names in column order (e.g. ["Pop_Flood", "Pct_P_Flood"])
+#    Returns:
+#        - dictionary with "events", "metrics" and "values", a float64 array
+#          (n_zones, n_events, n_metrics) filled with NaN
+def result_matrix(n_zones, event_ids, metrics):
+    return {"events": list(event_ids),
+            "metrics": list(metrics),
+            "values": np.full((n_zones, len(event_ids), len(metrics)), np.nan)}
+
+# Store one metric of one event (all postos)
+def set_result(matrix, event_id, metric, values):
+    e = matrix["events"].index(event_id)
+    m = matrix["metrics"].index(metric)
+    matrix["values"][:, e, m] = values
+
+# One metric of one event (all postos)
+def get_result(matrix, event_id, metric):
+    e = matrix["events"].index(event_id)
+    m = matrix["metrics"].index(metric)
+    return matrix["values"][:, e, m]
+
+# Wide columns of a result matrix - for each event, one column per metric
+# named <metric>_<event ID>
+#    Returns:
+#        - dictionary column name -> array of length n_zones
+def wide_columns(matrix):
+    columns = {}
+    for e, event_id in enumerate(matrix["events"]):
+        for m, metric in enumerate(matrix["metrics"]):
+            columns[metric + "_" + event_id] = matrix["values"][:, e, m]
+    return columns
+
+# Write a table to CSV - NaN values are left empty, as ExportTable does
+#    Args:
+#        path: output .csv file
+#        columns: dictionary column name -> list / array, all of the same length
+def write_csv(path, columns):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(list(columns))
+        for row in zip(*columns.values()):
+            writer.writerow(["" if isinstance(v, float) and np.isnan(v) else v for v in row])
+
+# Write a table to Parquet (needs pyarrow)
+#    Args:
+#        path: output .parquet file
+#        columns: dictionary column name -> list / array, all of the same length
+def write_parquet(path, columns):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Writing Parquet files needs pyarrow (pip install pyarrow)")
+    table = pa.table({name: np.asarray(values) for name, values in columns.items()})
+    pq.write_table(table, path)
+
+# Join a table to the posto polygons in one go and save them as a new layer
+#    Args:
+#        shapefile: posto shapefile - row i of the table is feature i
+#        out_path: output file (e.g. results/adm3_pop_flooded.gpkg)
+#        columns: dictionary column name -> list / array, one value per feature.
+#                 Columns already in the shapefile are left as they are
+#        driver: OGR driver of the output (GeoPackage by default - shapefiles
+#                cut field names at 10 characters)
+def join_zones(shapefile, out_path, columns, driver="GPKG"):
+    with fiona.open(shapefile) as src:
+        schema = src.schema.copy()
+        properties = dict(schema["properties"])
+        new_columns = [name for name in columns if name not in properties]
+        for name in new_columns:
+            properties[name] = _field_type(columns[name])
+        schema["properties"] = properties
+
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        with fiona.open(out_path, "w", driver=driver, crs_wkt=src.crs_wkt, schema=schema) as dst:
+            for i, feature in enumerate(src):
+                record = dict(feature["properties"])
+                for name in new_columns:
+                    record[name] = _field_value(columns[name][i])
+                dst.write({"geometry": feature["geometry"], "properties": record})
+
+def _field_type(values):
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.integer):
+        return "int"
+    if np.issubdtype(values.dtype, np.floating):
+        return "float"
+    return "str"
+
+def _field_value(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
@@ -0,0 +1,64 @@
+# Summary statistics over the events of a result matrix
+
+# The aggregates at the end of 08 / 09 (total over all events, number of
+# floods, average per flood and average % per flood) are reductions over the
+# event axis of the result matrix (see results.py), computed for all postos at
+# once. A window of years and / or event sources selects the events to
+# summarise (e.g. 2008-2017 GFD only), without re-running any zonal statistics.
+
+import numpy as np
+
+from flood_exposure.events import parse_event_name
+
+# Events of a result matrix that fall in a window
+#    Args:
+#        event_names: flood layer names of the matrix events, in matrix order
+#                     (e.g. "DFO_4500_From_20190101_to_20190115")
+#        years: optional (first, last) year of the window, both included
+#        sources: optional list of event sources ("GFD", "DFO", "EM-DAT")
+#    Returns:
+#        - boolean array, True for the events in the window
+def event_window(event_names, years=None, sources=None):
+    selected = []
+    for name in event_names:
+        event = parse_event_name(name)
+        keep = True
+        if years is not None:
+            keep &= years[0] <= event["year"] <= years[1]
+        if sources is not None:
+            keep &= event["source"] in sources
+        selected.append(keep)
+    return np.array(selected, dtype=bool)
+
+# Summary of one impact metric over the events
+#    Args:
+#        matrix: result matrix from results.result_matrix()
+#        metric: metric to add up (e.g. "Pop_Flood")
+#        pct_metric: matching % metric (e.g. "Pct_P_Flood")
+#        selected: optional boolean array over the events (see event_window());
+#                  all events by default
+#    Returns:
+#        - dictionary of arrays with one value per posto:
+#          "total": sum of the metric over the events
+#          "num_floods": number of events with a non-zero value
+#          "avg": total / num_floods, rounded to the closest integer but kept
+#                 as float64 like the DOUBLE field it replaces (0 without floods)
+#          "avg_pct": mean of the non-zero % values over num_floods, rounded to
+#                     two decimals (0 without floods)
+def summarise(matrix, metric, pct_metric, selected=None):
+    values = matrix["values"]
+    if selected is not None:
+        values = values[:, selected]
+    # Events first, so the sums add the events up one by one in table order
+    amount = np.ascontiguousarray(values[:, :, matrix["metrics"].index(metric)].T)
+    pct = np.ascontiguousarray(values[:, :, matrix["metrics"].index(pct_metric)].T)
+
+    total = amount.sum(axis=0)
+    with np.errstate(invalid="ignore"):
+        num_floods = (amount > 0).sum(axis=0)
+        pct_sum = np.where(pct > 0, pct, 0).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg = np.where(num_floods > 0, np.round(total / np.maximum(num_floods, 1)), 0)
+    avg_pct = np.round(pct_sum / np.maximum(num_floods, 1), 2)
+    return {"total": total, "num_floods": num_floods,
+            "avg": avg, "avg_pct": avg_pct}
@@ -0,0 +1,124 @@
+# Tiled (windowed) execution for national-scale rasters
+
+# The WorldPop 100m grid for Mozambique is about 17k x 12k cells. Instead of
+# reading whole rasters, the exposure scripts can walk the analysis grid in
+# tiles: each layer is read (and resampled / reclassified) for one tile only,
+# reduced to partial zonal sums, and the partial sums are merged at the end.
+# Peak memory then depends on the tile size, not on the size of the country.
+
+import numpy as np
+import rasterio
+from rasterio.warp import reproject, Resampling
+from rasterio.windows import Window, transform as window_transform
+
+from flood_exposure import align, zonal
+from flood_exposure.raster import Grid, grid_of, valid_mask
+
+# Default tile size (cells along each side)
+TILE_SIZE = 2048
+
+# Windows covering a grid, row by row
+#    Args:
+#        shape: (rows, cols) of the grid
+#        tile_size: number of cells along each side of a tile
+#    Returns:
+#        - generator of rasterio Windows
+def iter_windows(shape, tile_size=TILE_SIZE):
+    rows, cols = shape
+    for row_off in range(0, rows, tile_size):
+        for col_off in range(0, cols, tile_size):
+            yield Window(col_off, row_off, min(tile_size, cols - col_off),
+                         min(tile_size, rows - row_off))
+
+# Grid of one tile of a larger grid
+def tile_grid(grid, window):
+    return Grid(window_transform(window, grid.transform),
+                (int(window.height), int(window.width)), grid.crs)
+
+# Slice of an array (e.g. a memory-mapped label grid) for one tile
+def window_slice(window):
+    return (slice(int(window.row_off), int(window.row_off + window.height)),
+            slice(int(window.col_off), int(window.col_off + window.width)))
+
+# Read one band of an open raster onto a grid (nearest neighbour). GDAL only
+# reads the part of the raster that covers the grid, so this works tile by tile
+# and also does the reprojection / resampling when the grids differ.
+#    Args:
+#        dataset: open rasterio dataset
+#        grid: Grid to read onto (usually a tile_grid())
+#        nodata: value for cells without data (defaults to the raster NoData)
+#    Returns:
+#        - (array, nodata)
+def read_on_grid(dataset, grid, band=1, nodata=None):
+    if nodata is None:
+        nodata = 0 if dataset.nodata is None else dataset.nodata
+    out = np.full(grid.shape, nodata, dtype=dataset.dtypes[band - 1])
+    reproject(rasterio.band(dataset, band), out,
+              src_nodata=dataset.nodata,
+              dst_transform=grid.transform, dst_crs=grid.crs, dst_nodata=nodata,
+              resampling=Resampling.nearest)
+    return out, nodata
+
+# Read one window of a grid from an open raster. Rasters in the CRS of the grid
+# are resampled through a cached index map (align.read_aligned); rasters in
+# another CRS are warped with read_on_grid().
+#    Args:
+#        dataset: open rasterio dataset
+#        grid: analysis grid
+#        window: Window of the analysis grid, or None for all of it
+#    Returns:
+#        - (array, nodata)
+def read_window(dataset, grid, window=None, band=1):
+    src_grid = grid_of(dataset)
+    if align.same_crs(src_grid.crs, grid.crs):
+        return align.read_aligned(dataset, align.index_map(src_grid, grid), window, band)
+    if window is not None:
+        grid = tile_grid(grid, window)
+    return read_on_grid(dataset, grid, band)
+
+# Total and flooded zonal statistics, streamed tile by tile
+#    Args:
+#        zones: label grid on `grid` (e.g. from zones.zone_labels, memory-mapped)
+#        value_path: raster with the values to sum (population, cropland)
+#        flood_path: flood raster (1 = flooded)
+#        grid: analysis grid - the layers are resampled onto it per tile
+#        n_zones: number of zones
+#        tile_size: number of cells along each side of a tile; None reads
+#                   the whole grid as a single tile
+#        value_class: if set, only cells with this value count (reclassify,
+#                     e.g. 1 for cropland)
+#        weights: optional array on `grid` (e.g. cell_area.cell_areas) - if
+#                 set, SUM adds up the weights of the cells that count instead
+#                 of the raster values
+#    Returns:
+#        - (total, flooded) dictionaries, as zonal.flood_zonal_stats()
+def stream_flood_zonal(zones, value_path, flood_path, grid, n_zones,
+                       tile_size=TILE_SIZE, value_class=None, weights=None):
+    if tile_size is None:
+        tile_size = max(grid.shape)
+    totals = []
+    floods = []
+    with rasterio.open(value_path) as value_src, rasterio.open(flood_path) as flood_src:
+        for window in iter_windows(grid.shape, tile_size):
+            tile_zones = np.asarray(zones[window_slice(window)])
+            if not tile_zones.any():
+                continue
+
+            values, value_nodata = read_window(value_src, grid, window)
+            valid = valid_mask(values, value_nodata)
+            if value_class is not None:
+                valid &= values == value_class
+
+            if weights is not None:
+                values = weights[window_slice(window)]
+
+            flood, flood_nodata = read_window(flood_src, grid, window)
+            total, flooded = zonal.flood_zonal_stats(tile_zones, values, flood == 1,
+                                                     n_zones, valid)
+            totals.append(total)
+            floods.append(flooded)
+
+    if not totals:
+        empty = zonal.zonal_stats(np.zeros(0, dtype=np.int32), np.zeros(0), n_zones)
+        return empty, empty
+    return zonal.merge_stats(totals), zonal.merge_stats(floods)
@@ -0,0 +1,70 @@
+# NumPy zonal statistics
+
+# Replacement for arcpy.sa.ZonalStatisticsAsTable. Zones are given as an
+# integer label grid (1..n_zones, 0 = outside every zone) on the same grid as
+# the value raster. Per-zone statistics are computed with np.bincount, which is
+# a single pass over the pixels.
+
+import numpy as np
+
+# Per-zone SUM / COUNT / MEAN of a value raster
+#    Args:
+#        zones: integer label grid, 0 = no zone
+#        values: value raster on the same grid
+#        n_zones: number of zones (highest label)
+#        valid: boolean mask of cells with data (see raster.valid_mask). Cells
+#               outside the mask are ignored, like NoData in ArcGIS
+#    Returns:
+#        - dictionary of arrays of length n_zones ("SUM", "COUNT", "MEAN"),
+#          element i holds the statistic for zone i + 1
+def zonal_stats(zones, values, n_zones, valid=None):
+    keep = zones > 0
+    if valid is not None:
+        keep &= valid
+    z = zones[keep]
+    v = values[keep].astype(np.float64)
+    sums = np.bincount(z, weights=v, minlength=n_zones + 1)[1:n_zones + 1]
+    counts = np.bincount(z, minlength=n_zones + 1)[1:n_zones + 1]
+    return stats_from_sums(sums, counts)
+
+# Total and flooded per-zone statistics in one pass. This fuses "mask the value
+# raster with the flood layer, then run zonal stats" so the masked raster is
+# never written. Each pixel gets the key 2 * zone + flooded, so one bincount
+# returns both the flooded and non-flooded totals of every zone.
+#    Args:
+#        zones: integer label grid, 0 = no zone
+#        values: value raster on the same grid (e.g. population counts)
+#        flooded: boolean flood mask on the same grid
+#        n_zones: number of zones (highest label)
+#        valid: boolean mask of cells with data
+#    Returns:
+#        - (total, flooded) dictionaries, as returned by zonal_stats()
+def flood_zonal_stats(zones, values, flooded, n_zones, valid=None):
+    keep = zones > 0
+    if valid is not None:
+        keep &= valid
+    key = zones[keep].astype(np.int64) * 2 + flooded[keep]
+    v = values[keep].astype(np.float64)
+    size = 2 * (n_zones + 1)
+    sums = np.bincount(key, weights=v, minlength=size)[:size].reshape(-1, 2)[1:]
+    counts = np.bincount(key, minlength=size)[:size].reshape(-1, 2)[1:]
+    total = stats_from_sums(sums.sum(axis=1), counts.sum(axis=1))
+    flood = stats_from_sums(sums[:, 1], counts[:, 1])
+    return total, flood
+
+# Statistics dictionary from per-zone sums and counts. MEAN is NaN where a zone
+# has no cells with data
+def stats_from_sums(sums, counts):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+    return {"SUM": sums, "COUNT": counts, "MEAN": means}
+
+# Merge partial zonal statistics (e.g. from tiles) into one set of statistics
+#    Args:
+#        parts: list of dictionaries returned by zonal_stats() for the same zones
+#    Returns:
+#        - dictionary of merged "SUM", "COUNT" and "MEAN" arrays
+def merge_stats(parts):
+    sums = np.sum([p["SUM"] for p in parts], axis=0)
+    counts = np.sum([p["COUNT"] for p in parts], axis=0)
+    return stats_from_sums(sums, counts)
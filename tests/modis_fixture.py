@@ -0,0 +1,86 @@
+# Synthetic MODIS fixture for the DFO tests - the same images as a local stack
+# (for modis_local.dfo) and as assets of the local Earth Engine stand-in (for
+# modis.dfo)
+
+import numpy as np
+
+from flood_detection import local_ee
+
+ee = local_ee.install()
+
+# Grid of the fixture - 250m-like cells near Beira
+TRANSFORM = (0.0025, 0, 32.0, 0, -0.0025, -20.0)
+SHAPE = (30, 40)
+
+# Bands of the local stack, in the order they are drawn
+BANDS = ["red_250m", "nir_250m", "red_500m", "blue", "green", "swir", "state_1km"]
+
+# Build the fixture: two images a day (Terra at 10:00, Aqua at 13:00) over
+# 2019-03-01 - 2019-03-12, with a flooded block, a permanent water block,
+# cloud / shadow / snow QA bits and some missing swaths
+#    Args:
+#        seed: seed of the random reflectances
+#        missing_state: also leave some state_1km values missing
+#    Returns:
+#        - (stack, times, perm_water): the local stack (dictionary of (time,
+#          y, x) arrays), the acquisition times and the boolean permanent water
+#          mask. The same images are registered as the MOD09GQ / MOD09GA /
+#          MYD09GQ / MYD09GA collections and the JRC yearly history
+def build(seed=1, missing_state=False):
+    local_ee.reset()
+    rng = np.random.default_rng(seed)
+    days = np.arange(np.datetime64("2019-03-01"), np.datetime64("2019-03-13"))
+    water = np.zeros(SHAPE, bool)
+    water[10:20, 5:25] = True
+    perm_water = np.zeros(SHAPE, bool)
+    perm_water[12:16, 8:14] = True
+
+    stack = {band: [] for band in BANDS}
+    times = []
+    collections = {sat: {"GQ": [], "GA": []} for sat in ("MOD", "MYD")}
+    for day in days:
+        for sat, hour in (("MOD", 10), ("MYD", 13)):
+            time = (day + np.timedelta64(hour, "h")).astype("datetime64[ms]")
+            wet = water & (rng.random(SHAPE) < 0.8)
+            red = np.where(wet, rng.uniform(200, 900, SHAPE), rng.uniform(900, 3000, SHAPE)).round()
+            nir = np.where(wet, rng.uniform(50, 400, SHAPE), rng.uniform(1500, 4000, SHAPE)).round()
+            red_500m = (red * rng.uniform(0.9, 1.1, SHAPE)).round()
+            blue = rng.uniform(100, 800, SHAPE).round()
+            green = rng.uniform(200, 900, SHAPE).round()
+            swir = np.where(wet, rng.uniform(-100, 500, SHAPE), rng.uniform(700, 2500, SHAPE)).round()
+
+            # Cloud (bit 0), cloud shadow (bit 2) and snow (bit 12)
+            state = np.zeros(SHAPE, np.uint16)
+            state |= (rng.random(SHAPE) < 0.1).astype(np.uint16) * 1
+            state |= (rng.random(SHAPE) < 0.05).astype(np.uint16) * 4
+            state |= (rng.random(SHAPE) < 0.01).astype(np.uint16) * (1 << 12)
+            if rng.random() < 0.3:
+                red[:3] = np.nan
+            if missing_state:
+                state = state.astype(float)
+                state[rng.random(SHAPE) < 0.2] = np.nan
+                if rng.random() < 0.3:
+                    state[:, -6:] = np.nan
+
+            for band, values in zip(BANDS, [red, nir, red_500m, blue, green, swir, state]):
+                stack[band].append(values)
+            times.append(time)
+            properties = {"system:time_start": int(time.astype(np.int64))}
+            collections[sat]["GQ"].append(ee.Image.from_arrays(
+                {"sur_refl_b01": red, "sur_refl_b02": nir}, TRANSFORM, properties=properties))
+            collections[sat]["GA"].append(ee.Image.from_arrays(
+                {"sur_refl_b01": red_500m, "sur_refl_b03": blue, "sur_refl_b04": green, "sur_refl_b07": swir,
+                 "state_1km": np.asarray(state, dtype=float)}, TRANSFORM, properties=properties))
+
+    for sat, images in collections.items():
+        ee.add_asset("MODIS/061/{0}09GQ".format(sat), images["GQ"])
+        ee.add_asset("MODIS/061/{0}09GA".format(sat), images["GA"])
+    ee.add_asset("JRC/GSW1_4/YearlyHistory",
+                 [ee.Image.from_arrays({"waterClass": np.where(perm_water, 3.0, 1.0)}, TRANSFORM,
+                                       properties={"year": 2019})])
+    return {band: np.stack(values) for band, values in stack.items()}, np.array(times), perm_water
+
+# Area of interest covering the whole fixture grid
+def roi():
+    x0, y1 = TRANSFORM[2], TRANSFORM[5]
+    return ee.Geometry.Rectangle([x0, y1 + TRANSFORM[4] * SHAPE[0], x0 + TRANSFORM[0] * SHAPE[1], y1])
@@ -0,0 +1,74 @@
+# Nearest-neighbour index maps (flood_exposure/align.py) against rasterio
+
+import numpy as np
+import pytest
+from affine import Affine
+from rasterio.io import MemoryFile
+from rasterio.windows import Window
+
+from flood_exposure import align, raster
+
+SRC = raster.Grid(Affine(0.02, 0, 30.0, 0, -0.02, -10.0), (40, 50), "EPSG:4326")
+
+# Destination grids: (cell size, x offset, y offset, shape) relative to SRC.
+# Offsets by a destination cell only (e.g. 500m cropland on a 250m flood grid
+# that starts half a cropland cell in) must not take the nested fast path
+CASES = [
+    (0.01, 0.0, 0.0, (60, 70)),
+    (0.01, 0.01, -0.01, (60, 70)),
+    (0.01, 0.04, -0.02, (60, 70)),
+    (0.005, 0.015, -0.005, (90, 110)),
+    (0.008, 0.003, -0.007, (70, 80)),
+    (0.05, 0.01, -0.03, (12, 15)),
+    (0.01, -0.05, 0.03, (60, 70)),
+]
+
+def _src_values():
+    return np.arange(SRC.shape[0] * SRC.shape[1], dtype=np.int32).reshape(SRC.shape)
+
+def _dst_grid(case):
+    size, dx, dy, shape = case
+    origin_x, origin_y = SRC.transform.c + dx, SRC.transform.f + dy
+    return raster.Grid(Affine(size, 0, origin_x, 0, -size, origin_y), shape, "EPSG:4326")
+
+@pytest.mark.parametrize("case", CASES)
+def test_gather_matches_reproject(case):
+    dst = _dst_grid(case)
+    values = _src_values()
+    expected = raster.resample_to_grid(values, SRC, dst, nodata=-1)
+    imap = align.index_map(SRC, dst)
+    assert np.array_equal(align.gather(values, imap, fill=-1), expected)
+
+@pytest.mark.parametrize("case", CASES)
+def test_windows_match_reproject(case):
+    dst = _dst_grid(case)
+    values = _src_values()
+    expected = raster.resample_to_grid(values, SRC, dst, nodata=-1)
+    imap = align.index_map(SRC, dst)
+    rows, cols = dst.shape
+    for window in (Window(3, 5, 17, 11), Window(1, 0, cols - 1, 7), Window(0, rows - 9, 9, 9)):
+        r0, c0 = window.row_off, window.col_off
+        block = expected[r0:r0 + window.height, c0:c0 + window.width]
+        assert np.array_equal(align.gather(values, imap, fill=-1, window=window), block)
+
+@pytest.mark.parametrize("case", CASES)
+def test_read_aligned_matches_reproject(case):
+    dst = _dst_grid(case)
+    values = _src_values()
+    expected = raster.resample_to_grid(values, SRC, dst, nodata=-1)
+    profile = {"driver": "GTiff", "height": SRC.shape[0], "width": SRC.shape[1], "count": 1,
+               "dtype": "int32", "crs": SRC.crs, "transform": SRC.transform, "nodata": -1}
+    with MemoryFile() as memfile:
+        with memfile.open(**profile) as dataset:
+            dataset.write(values, 1)
+        with memfile.open() as dataset:
+            imap = align.dataset_index_map(dataset, dst)
+            window = Window(4, 2, 20, 13)
+            aligned, nodata = align.read_aligned(dataset, imap, window)
+    assert nodata == -1
+    assert np.array_equal(aligned, expected[2:15, 4:24])
+
+def test_nested_fast_path_needs_aligned_origin():
+    assert align.index_map(SRC, _dst_grid(CASES[0]))["factor"] == 2
+    assert align.index_map(SRC, _dst_grid(CASES[2]))["factor"] == 2
+    assert align.index_map(SRC, _dst_grid(CASES[1]))["factor"] is None
@@ -0,0 +1,24 @@
+# Per-year baselines (flood_exposure/baseline.py)
+
+from affine import Affine
+
+from flood_exposure import baseline
+from flood_exposure.raster import Grid
+
+GRID = Grid(Affine(0.5, 0, 10.0, 0, -0.5, 20.0), (20, 25), "EPSG:4326")
+
+def test_cache_keeps_the_last_baselines():
+    baseline.clear_baselines()
+    years = [str(2008 + k) for k in range(baseline.MAX_BASELINES + 2)]
+    for year in years:
+        baseline.keep_baseline("cropland", year, GRID, {"year": year})
+    assert baseline.cached_baseline("cropland", years[0], GRID) is None
+    assert baseline.cached_baseline("cropland", years[-1], GRID) == {"year": years[-1]}
+    assert baseline.cached_baseline("population", years[-1], GRID) is None
+
+    # A baseline read again is kept over the older ones
+    oldest = years[2]
+    assert baseline.cached_baseline("cropland", oldest, GRID) is not None
+    baseline.keep_baseline("cropland", "2030", GRID, {})
+    assert baseline.cached_baseline("cropland", oldest, GRID) is not None
+    assert baseline.cached_baseline("cropland", years[3], GRID) is None
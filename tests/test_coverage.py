@@ -0,0 +1,118 @@
+# Exact polygon coverage (flood_exposure/coverage.py) against shapely
+# intersection areas
+
+import numpy as np
+import pytest
+import rasterio
+from affine import Affine
+from shapely.geometry import MultiPolygon, Polygon, box, mapping, shape
+
+from flood_exposure import coverage
+from flood_exposure.raster import Grid
+
+GRID = Grid(Affine(0.5, 0, 10.0, 0, -0.5, 20.0), (20, 25), "EPSG:4326")
+
+POLYGONS = [
+    Polygon([(10.65, 10.6), (15.35, 11.05), (16.1, 17.75), (11.55, 19.45)],
+            [[(12.0, 12.5), (12.0, 14.0), (13.5, 14.0), (13.5, 12.5)]]),
+    # Partly outside the grid
+    Polygon([(8.5, 9.0), (25.0, 11.5), (24.0, 22.5), (15.0, 25.0)]),
+    MultiPolygon([box(17.6, 11.65, 17.95, 11.9), box(19.0, 15.0, 22.25, 19.75)]),
+    # On the cell lines
+    box(12.5, 12.5, 13.0, 13.0),
+]
+
+# Covered fraction of every (zone, cell) pair, from shapely
+def _shapely_coverage(polygons):
+    rows, cols = GRID.shape
+    cell_area = GRID.transform.a * -GRID.transform.e
+    expected = {}
+    for i, polygon in enumerate(polygons):
+        for row in range(rows):
+            for col in range(cols):
+                x0, y1 = GRID.transform * (col, row)
+                x1, y0 = GRID.transform * (col + 1, row + 1)
+                area = polygon.intersection(box(x0, y0, x1, y1)).area
+                if area > 1e-12:
+                    expected[(i + 1, row * cols + col)] = area / cell_area
+    return expected
+
+def test_coverage_matches_intersection_areas():
+    cov = coverage.polygon_coverage([mapping(p) for p in POLYGONS], GRID)
+    got = {}
+    for zone, cell, weight in zip(cov["zones"], cov["cells"], cov["weights"]):
+        got[(int(zone), int(cell))] = got.get((int(zone), int(cell)), 0.0) + weight
+    expected = _shapely_coverage(POLYGONS)
+    for key in set(got) | set(expected):
+        assert abs(got.get(key, 0.0) - expected.get(key, 0.0)) < 1e-9, key
+
+def test_zonal_sums_are_area_weighted():
+    rng = np.random.default_rng(1)
+    values = rng.random(GRID.shape)
+    flooded = rng.random(GRID.shape) < 0.4
+    cov = coverage.polygon_coverage([mapping(p) for p in POLYGONS], GRID)
+    total, flood = coverage.coverage_flood_zonal_stats(cov, values, flooded, len(POLYGONS))
+
+    expected_total = np.zeros(len(POLYGONS))
+    expected_flood = np.zeros(len(POLYGONS))
+    for (zone, cell), weight in _shapely_coverage(POLYGONS).items():
+        value = values.ravel()[cell] * weight
+        expected_total[zone - 1] += value
+        if flooded.ravel()[cell]:
+            expected_flood[zone - 1] += value
+    assert np.allclose(total["SUM"], expected_total)
+    assert np.allclose(flood["SUM"], expected_flood)
+
+def test_covered_area_of_each_zone():
+    cov = coverage.polygon_coverage([mapping(p) for p in POLYGONS], GRID)
+    stats = coverage.coverage_zonal_stats(cov, np.ones(GRID.shape), len(POLYGONS))
+    extent = box(*GRID.transform * (0, GRID.shape[0]), *GRID.transform * (GRID.shape[1], 0))
+    cell_area = GRID.transform.a * -GRID.transform.e
+    expected = [shape(mapping(p)).intersection(extent).area / cell_area for p in POLYGONS]
+    assert np.allclose(stats["COUNT"], expected)
+
+def _write(path, array):
+    profile = {"driver": "GTiff", "height": GRID.shape[0], "width": GRID.shape[1], "count": 1,
+               "dtype": array.dtype.name, "crs": GRID.crs, "transform": GRID.transform, "nodata": 255}
+    with rasterio.open(str(path), "w", **profile) as dataset:
+        dataset.write(array, 1)
+    return str(path)
+
+# Streamed in bands of rows (7 does not divide the 20 rows) or in one band
+@pytest.mark.parametrize("tile_size", [None, 7])
+def test_event_zonal_of_a_class(tmp_path, tile_size):
+    rng = np.random.default_rng(2)
+    classes = rng.integers(0, 3, GRID.shape).astype(np.uint8)
+    floods = [(rng.random(GRID.shape) < 0.5).astype(np.uint8) for _ in range(2)]
+    areas = rng.random(GRID.shape)
+    cov = coverage.polygon_coverage([mapping(p) for p in POLYGONS], GRID)
+    total, flooded = coverage.coverage_event_zonal(
+        cov, _write(tmp_path / "classes.tif", classes),
+        [_write(tmp_path / "flood_{0}.tif".format(k), f) for k, f in enumerate(floods)],
+        GRID, len(POLYGONS), value_class=1, weights=areas, tile_size=tile_size)
+
+    for flood, flood_stats in zip(floods, flooded):
+        expected_total, expected_flood = coverage.coverage_flood_zonal_stats(cov, areas, flood == 1,
+                                                                             len(POLYGONS), classes == 1)
+        assert np.allclose(total["SUM"], expected_total["SUM"])
+        assert np.allclose(flood_stats["SUM"], expected_flood["SUM"])
+
+def test_no_events(tmp_path):
+    values = np.random.default_rng(3).random(GRID.shape).astype(np.float32)
+    cov = coverage.polygon_coverage([mapping(p) for p in POLYGONS], GRID)
+    total, flooded = coverage.coverage_event_zonal(cov, _write(tmp_path / "values.tif", values), [], GRID,
+                                                   len(POLYGONS), tile_size=6)
+    assert np.allclose(total["SUM"], coverage.coverage_zonal_stats(cov, values, len(POLYGONS))["SUM"])
+    assert flooded == []
+
+def test_entries_are_sorted_by_cell():
+    cov = coverage.polygon_coverage([mapping(p) for p in POLYGONS], GRID)
+    assert np.all(np.diff(cov["cells"]) >= 0)
+
+# The 100m population grid is too fine for a coverage matrix
+def test_fine_grids_are_refused():
+    fine = Grid(Affine(0.000833, 0, 32.0, 0, -0.000833, -15.0), (100, 100), "EPSG:4326")
+    with pytest.raises(ValueError):
+        coverage.polygon_coverage([mapping(POLYGONS[0])], fine)
+    native = Grid(Affine(0.002083, 0, 32.0, 0, -0.002083, -15.0), (100, 100), "EPSG:4326")
+    coverage.polygon_coverage([mapping(box(32.01, -15.1, 32.1, -15.01))], native)
@@ -0,0 +1,43 @@
+# Bit-packed flood event cube (flood_exposure/cube.py)
+
+import numpy as np
+from affine import Affine
+
+from flood_exposure import cube, events
+from flood_exposure.raster import Grid
+
+GRID = Grid(Affine(0.01, 0, 32.0, 0, -0.01, -15.0), (20, 30), "EPSG:4326")
+
+def _cube(tmp_path, n_events=3, seed=0):
+    rng = np.random.default_rng(seed)
+    masks = [rng.random(GRID.shape) < 0.3 for _ in range(n_events)]
+    names = ["DFO_{0}_From_2019010{1}_to_2019011{1}".format(4500 + k, k + 1) for k in range(n_events)]
+    cube.write_cube(str(tmp_path), masks, [events.parse_event_name(n) for n in names], GRID, chunk_rows=7)
+    return cube.open_cube(str(tmp_path)), masks
+
+def test_read_event_round_trip(tmp_path):
+    flood_cube, masks = _cube(tmp_path)
+    for k, mask in enumerate(masks):
+        assert np.array_equal(cube.read_event(flood_cube, k), mask)
+
+def test_zone_events_follow_the_label_grid(tmp_path):
+    flood_cube, masks = _cube(tmp_path)
+    zones_a = np.zeros(GRID.shape, dtype=np.int32)
+    zones_a[2:6, 3:9] = 1
+    zones_b = np.zeros(GRID.shape, dtype=np.int32)
+    zones_b[10:18, 20:29] = 1
+
+    for zones in (zones_a, zones_b, zones_a):
+        result = cube.zone_events(flood_cube, zones, 1)
+        expected = [int((m & (zones == 1)).sum()) for m in masks]
+        assert [e["flooded_cells"] for e in result["events"]] == [n for n in expected if n]
+
+def test_decompressed_chunks_are_bounded(tmp_path):
+    rng = np.random.default_rng(3)
+    masks = [rng.random(GRID.shape) < 0.3 for _ in range(2)]
+    names = ["DFO_{0}_From_2019010{1}_to_2019011{1}".format(4500 + k, k + 1) for k in range(2)]
+    flood_cube = cube.write_cube(str(tmp_path), masks, [events.parse_event_name(n) for n in names], GRID,
+                                 chunk_rows=2, compression="zlib")
+    for k, mask in enumerate(masks):
+        assert np.array_equal(cube.read_event(flood_cube, k), mask)
+    assert len(flood_cube["_chunks"]) == cube.CACHED_CHUNKS
@@ -0,0 +1,77 @@
+# Hierarchical dissolve (flood_exposure/dissolve.py) against shapely unary_union
+
+import warnings
+
+from shapely.geometry import box, mapping, shape
+from shapely.ops import unary_union
+
+from flood_exposure import dissolve
+
+def _square(x0, y0, x1, y1):
+    return mapping(box(x0, y0, x1, y1))
+
+def _same_area(result, geometries):
+    expected = unary_union([shape(g) for g in geometries])
+    dissolved = shape(result)
+    assert dissolved.is_valid
+    assert dissolved.symmetric_difference(expected).area < 1e-9
+
+def test_shared_borders_cancel():
+    geometries = [_square(x, y, x + 1, y + 1) for x in range(3) for y in range(2)]
+    result = dissolve.dissolve_polygons(geometries)
+    _same_area(result, geometries)
+    assert result["type"] == "Polygon"
+    assert len(result["coordinates"]) == 1
+
+def test_t_junctions_are_split():
+    # Two small squares next to one tall square: the vertex at (1, 1) lies in
+    # the middle of the tall square's left edge
+    geometries = [_square(0, 0, 1, 1), _square(0, 1, 1, 2), _square(1, 0, 2, 2)]
+    result = dissolve.dissolve_polygons(geometries)
+    _same_area(result, geometries)
+    assert result["type"] == "Polygon"
+    assert len(result["coordinates"]) == 1
+
+def test_holes_and_separate_parts():
+    ring = [_square(0, 0, 3, 1), _square(0, 2, 3, 3), _square(0, 1, 1, 2), _square(2, 1, 3, 2)]
+    geometries = ring + [_square(5, 0, 6, 1)]
+    result = dissolve.dissolve_polygons(geometries)
+    _same_area(result, geometries)
+    assert result["type"] == "MultiPolygon"
+
+def test_coordinates_are_plain_floats():
+    result = dissolve.dissolve_polygons([_square(0, 0, 1, 1), _square(1, 0, 2, 1)])
+    x, y = result["coordinates"][0][0]
+    assert type(x) is float and type(y) is float
+
+def _eas():
+    geometries = [_square(x, 0, x + 1, 1) for x in range(4)]
+    records = [{"PA_ID": 1, "Posto": "A", "ID_DIST": 10, "Distrito": "D1"},
+               {"PA_ID": 1, "Posto": "A", "ID_DIST": 10, "Distrito": "D1"},
+               {"PA_ID": 2, "Posto": "B", "ID_DIST": 10, "Distrito": "D1"},
+               {"PA_ID": 2, "Posto": "B", "ID_DIST": 20, "Distrito": "D2"}]
+    return geometries, records
+
+def test_hierarchy_keeps_the_level_schema():
+    geometries, records = _eas()
+    records[3]["ID_DIST"], records[3]["Distrito"] = 10, "D1"
+    levels = [("PA_ID", "Posto"), ("ID_DIST", "Distrito")]
+    (admin3, admin3_records), (admin2, admin2_records) = dissolve.dissolve_hierarchy(geometries, records, levels)
+    assert admin3_records == [{"PA_ID": 1, "Posto": "A"}, {"PA_ID": 2, "Posto": "B"}]
+    assert admin2_records == [{"ID_DIST": 10, "Distrito": "D1"}]
+    _same_area(admin2[0], geometries)
+
+def test_codes_that_do_not_nest_are_dissolved_from_the_eas():
+    geometries, records = _eas()
+    levels = [("PA_ID", "Posto"), ("ID_DIST", "Distrito")]
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        levels_out = dissolve.dissolve_hierarchy(geometries, records, levels)
+    assert caught
+    admin2, admin2_records = levels_out[1]
+    assert [r["ID_DIST"] for r in admin2_records] == [10, 20]
+    _same_area(admin2[0], geometries[:3])
+    _same_area(admin2[1], geometries[3:])
+
+    mapping_rows = dissolve.code_mapping(records, levels)
+    assert [(r["PA_ID"], r["ID_DIST"]) for r in mapping_rows] == [(1, 10), (2, 10)]
@@ -0,0 +1,28 @@
+# Asset exports (flood_detection/utils/export.py) on the local Earth Engine
+# stand-in
+
+from flood_detection import local_ee
+
+ee = local_ee.install()
+
+from flood_detection.utils import export, scheduler  # noqa: E402
+
+FOLDER = "projects/test/assets"
+
+def _event(event_id):
+    return {"ID": event_id, "began_ymd": "20220120", "ended_ymd": "20220203", "MAINCAUSE": "Heavy rain",
+            "region": [[[33, -20], [34, -20], [34, -19], [33, -19], [33, -20]]]}
+
+def test_existing_assets_are_not_exported_again(tmp_path):
+    local_ee.reset()
+    ee.add_asset(FOLDER + "/DFO_1_From_20220120_to_20220203", ee.Image.constant(1))
+    queue = scheduler.open_queue(str(tmp_path / "queue.json"))
+    image = ee.Image.constant(1)
+
+    assert not export.to_asset(image, None, FOLDER, 250, _event(1), queue=queue)
+    assert export.to_asset(image, None, FOLDER, 250, _event(2), queue=queue)
+    assert list(queue["tasks"]) == [FOLDER + "/DFO_2_From_20220120_to_20220203"]
+
+    # Listed once by the caller
+    existing = {FOLDER + "/DFO_2_From_20220120_to_20220203"}
+    assert not export.to_asset(image, None, FOLDER, 250, _event(2), queue=queue, existing_assets=existing)
@@ -0,0 +1,54 @@
+# Batched, cached event table (flood_detection/utils/fetch.py) on the local
+# Earth Engine stand-in
+
+from flood_detection import local_ee
+
+ee = local_ee.install()
+
+from flood_detection.utils import fetch  # noqa: E402
+
+ASSET = "projects/test/assets/events"
+
+def _add_events(cause):
+    ee.add_asset(ASSET, [{"type": "Feature", "geometry": None,
+                          "properties": {"ID": i, "BEGAN": "2022-01-0{0}".format(i),
+                                         "ENDED": "2022-01-0{0}".format(i + 1), "MAINCAUSE": cause}}
+                         for i in (1, 2, 3)])
+
+def _extras(flood_event):
+    return {"double_id": ee.Number(flood_event.get("ID")).multiply(2)}
+
+def test_event_table(tmp_path):
+    _add_events("Heavy rain")
+    table = fetch.event_table(ee.FeatureCollection(ASSET).sort("ID"), _extras, str(tmp_path), chunk_size=2)
+    assert sorted(table) == [1, 2, 3]
+    assert table[2]["began"] == "2022-01-02" and table[2]["ended_ymd"] == "20220103"
+    assert [table[i]["double_id"] for i in (1, 2, 3)] == [2, 4, 6]
+
+def test_failed_extras_only_lose_their_event(monkeypatch):
+    _add_events("Heavy rain")
+    event_extras = fetch._event_extras
+
+    def failing(event_db, ids, extras, cache_folder, version):
+        if 2 in ids:
+            raise RuntimeError("Computation timed out")
+        return event_extras(event_db, ids, extras, cache_folder, version)
+
+    monkeypatch.setattr(fetch, "_event_extras", failing)
+    table = fetch.event_table(ee.FeatureCollection(ASSET).sort("ID"), _extras, chunk_size=2)
+    assert table[1]["double_id"] == 2 and table[3]["double_id"] == 6
+    assert table[2]["extras_error"] == "Computation timed out"
+    assert "double_id" not in table[2]
+
+def test_cache_follows_the_asset_version(tmp_path):
+    _add_events("Heavy rain")
+    version = fetch.asset_version(ASSET)
+    table = fetch.event_table(ee.FeatureCollection(ASSET).sort("ID"), None, str(tmp_path), version)
+    assert fetch.event_table(ee.FeatureCollection(ASSET).sort("ID"), None, str(tmp_path), version) == table
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # The asset is made again - the new version is fetched, not read from the cache
+    _add_events("Heavy rain")
+    assert fetch.asset_version(ASSET) != version
+    fetch.event_table(ee.FeatureCollection(ASSET).sort("ID"), None, str(tmp_path), fetch.asset_version(ASSET))
+    assert len(list(tmp_path.iterdir())) == 2
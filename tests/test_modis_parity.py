@@ -0,0 +1,29 @@
+# modis.dfo on the local Earth Engine stand-in against modis_local.dfo, on the
+# synthetic MODIS fixture (tests/modis_fixture.py)
+
+import numpy as np
+import pytest
+
+import modis_fixture
+from flood_detection import modis, modis_local
+
+BEGAN, ENDED = "2019-03-03", "2019-03-08"
+
+@pytest.mark.parametrize("threshold", ["standard", "otsu"])
+@pytest.mark.parametrize("missing_state", [False, True])
+def test_dfo_matches_the_local_version(threshold, missing_state):
+    stack, times, perm_water = modis_fixture.build(missing_state=missing_state)
+    flood_img = modis.dfo(modis_fixture.roi(), BEGAN, ENDED, threshold, get_max=True)
+    local = modis_local.dfo(stack, times, BEGAN, ENDED, threshold, perm_water=perm_water.astype(int),
+                            get_max=True)
+
+    for band in ["flooded", "duration", "clear_views", "clear_perc", "max_img"]:
+        expected = np.nan_to_num(local[band].astype(float))
+        assert np.allclose(np.nan_to_num(flood_img.to_array(band)), expected), band
+    assert flood_img.to_array("flooded").sum() > 0
+
+    properties = flood_img.getInfo()["properties"]
+    assert properties["threshold_type"] == threshold
+    assert properties["max_img_date"] == local["max_img_date"]
+    for name in ("threshold_b1b2", "threshold_b7"):
+        assert properties[name] == pytest.approx(local[name])
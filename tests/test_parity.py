@@ -0,0 +1,26 @@
+# Parity check of the NumPy tables against arcpy tables (flood_exposure/parity.py)
+
+from flood_exposure import parity
+
+def _write(path, text):
+    path.write_text(text)
+    return str(path)
+
+def test_matching_tables_pass(tmp_path):
+    reference = _write(tmp_path / "arcpy.csv", "OBJECTID,PA_ID,Posto,Crop_Flood_ha_DFO_1\n1,101,P1,12\n2,102,P2,\n")
+    # Rows in another order, a rounding difference and an extra column
+    table = _write(tmp_path / "numpy.csv", "OBJECTID,PA_ID,Posto,Crop_Flood_ha_DFO_1,CodProv\n2,102,P2,,1\n1,101,P1,12.4,1\n")
+    assert parity.compare_tables(reference, table) == []
+
+def test_differences_are_reported(tmp_path):
+    reference = _write(tmp_path / "arcpy.csv", "OBJECTID,Posto,Crop_Flood_ha_DFO_1,Pct_C_Flood_DFO_1\n1,P1,12,5.0\n2,P2,30,1.0\n")
+    table = _write(tmp_path / "numpy.csv", "OBJECTID,Posto,Crop_Flood_ha_DFO_1\n1,P1,12\n2,P9,40\n")
+    differences = parity.compare_tables(reference, table)
+    assert ("Posto", 1, None) in differences
+    assert ("Crop_Flood_ha_DFO_1", 1, 10.0) in differences
+    assert ("Pct_C_Flood_DFO_1", None, None) in differences
+
+def test_missing_rows_are_reported(tmp_path):
+    reference = _write(tmp_path / "arcpy.csv", "OBJECTID,Posto\n1,P1\n2,P2\n")
+    table = _write(tmp_path / "numpy.csv", "OBJECTID,Posto\n1,P1\n")
+    assert parity.compare_tables(reference, table) == [("OBJECTID", 1, None)]
@@ -0,0 +1,80 @@
+# Posto pixel index (flood_exposure/pixel_index.py) against full-grid zonal
+# statistics
+
+import numpy as np
+import pytest
+import rasterio
+from affine import Affine
+
+from flood_exposure import multi_event, pixel_index, raster, zonal
+
+# Population grid (100m-like) and flood grid (250m-like, offset from it)
+POP = raster.Grid(Affine(0.01, 0, 32.0, 0, -0.01, -15.0), (30, 40), "EPSG:4326")
+FLOOD = raster.Grid(Affine(0.025, 0, 31.99, 0, -0.025, -14.985), (14, 18), "EPSG:4326")
+
+N_ZONES = 8
+
+# Postos asked for - not in label order, and one without any pixel
+ZONE_IDS = [5, 2, 8]
+
+def _write(path, array, grid, nodata):
+    profile = {"driver": "GTiff", "height": grid.shape[0], "width": grid.shape[1], "count": 1,
+               "dtype": array.dtype.name, "crs": grid.crs, "transform": grid.transform, "nodata": nodata}
+    with rasterio.open(str(path), "w", **profile) as dataset:
+        dataset.write(array, 1)
+    return str(path)
+
+def _inputs(tmp_path, n_events=3):
+    rng = np.random.default_rng(4)
+    zones = rng.integers(0, N_ZONES, POP.shape).astype(np.int32)
+    population = rng.random(POP.shape).astype(np.float32) * 10
+    population[rng.random(POP.shape) < 0.1] = -99999
+    floods = [(rng.random(FLOOD.shape) < 0.3).astype(np.uint8) for _ in range(n_events)]
+    value_path = _write(tmp_path / "pop.tif", population, POP, -99999)
+    flood_paths = [_write(tmp_path / "flood_{0}.tif".format(k), f, FLOOD, 255) for k, f in enumerate(floods)]
+    return zones, value_path, flood_paths
+
+@pytest.mark.parametrize("band_rows", [1024, 7])
+def test_index_lists_the_pixels_of_each_zone(band_rows):
+    zones = np.random.default_rng(5).integers(0, N_ZONES, POP.shape).astype(np.int32)
+    index = pixel_index.build_pixel_index(zones, N_ZONES, band_rows)
+    pixels, labels = pixel_index.zone_pixels(index, ZONE_IDS)
+    expected = np.concatenate([np.flatnonzero(zones.ravel() == z) for z in ZONE_IDS])
+    assert np.array_equal(pixels, expected)
+    assert np.array_equal(labels, zones.ravel()[expected])
+
+def test_read_pixels_matches_the_full_grid(tmp_path):
+    zones, value_path, flood_paths = _inputs(tmp_path)
+    pixels, labels = pixel_index.zone_pixels(pixel_index.build_pixel_index(zones, N_ZONES), ZONE_IDS)
+    with rasterio.open(flood_paths[0]) as src:
+        values, nodata = pixel_index.read_pixels(src, POP, pixels)
+        full = raster.resample_to_grid(src.read(1), FLOOD, POP, nodata=255)
+    assert np.array_equal(values, full.ravel()[pixels])
+
+def test_zones_match_full_grid_zonal_stats(tmp_path):
+    zones, value_path, flood_paths = _inputs(tmp_path)
+    zones[zones == 8] = 0
+    index = pixel_index.build_pixel_index(zones, N_ZONES)
+    total, flooded = pixel_index.zones_event_zonal(index, ZONE_IDS, value_path, flood_paths, POP, N_ZONES)
+    expected_total, expected_flooded = multi_event.stream_event_zonal(zones, value_path, flood_paths, POP,
+                                                                      N_ZONES, None)
+
+    rows = np.array(ZONE_IDS) - 1
+    assert np.allclose(total["SUM"][rows], expected_total["SUM"][rows])
+    assert np.array_equal(total["COUNT"][rows], expected_total["COUNT"][rows])
+    for flood_stats, expected in zip(flooded, expected_flooded):
+        assert np.allclose(flood_stats["SUM"][rows], expected["SUM"][rows])
+        assert np.array_equal(flood_stats["COUNT"][rows], expected["COUNT"][rows])
+    # Postos not asked for are left empty
+    assert not total["COUNT"][np.setdiff1d(np.arange(N_ZONES), rows)].any()
+
+def test_no_events(tmp_path):
+    zones, value_path, flood_paths = _inputs(tmp_path)
+    index = pixel_index.build_pixel_index(zones, N_ZONES)
+    total, flooded = pixel_index.zones_event_zonal(index, ZONE_IDS, value_path, [], POP, N_ZONES)
+    assert flooded == []
+    with rasterio.open(value_path) as src:
+        population = src.read(1)
+    expected = zonal.zonal_stats(zones, population, N_ZONES, population != -99999)
+    rows = np.array(ZONE_IDS) - 1
+    assert np.allclose(total["SUM"][rows], expected["SUM"][rows])
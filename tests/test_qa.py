@@ -0,0 +1,37 @@
+# Lookup-table decoding of state_1km (flood_detection/utils/qa.py) and the
+# clear views of the local DFO algorithm
+
+import numpy as np
+
+from flood_detection import modis_local
+from flood_detection.utils import qa
+
+def test_decode_matches_bit_extraction():
+    state = np.arange(1 << 16, dtype=np.uint16)
+    flags = qa.decode(state)
+    planes = qa.flag_planes(flags)
+    assert np.array_equal(planes["cloud_state"], state & 3)
+    assert np.array_equal(planes["cloud_shadow"], (state >> 2) & 1)
+    assert np.array_equal(planes["ice_flag"], (state >> 12) & 1)
+    assert np.array_equal(planes["snow_flag"], (state >> 15) & 1)
+    cloudy = ((state & 3) == 1) | ((state & 3) == 2)
+    assert np.array_equal(qa.usable(flags), ~(cloudy | (((state >> 2) & 1) == 1)
+                                               | (((state >> 12) & 1) == 1) | (((state >> 15) & 1) == 1)))
+    assert qa.valid(flags).all()
+
+def test_missing_state_is_not_clear():
+    flags = qa.decode(np.array([0.0, np.nan, 4.0]))
+    assert qa.valid(flags).tolist() == [True, False, True]
+    assert qa.usable(flags).tolist() == [True, False, False]
+    assert qa.clear_view(flags).tolist() == [True, False, True]
+
+def test_clear_views_over_valid_observations():
+    # 4 images of 3 pixels: the second pixel has 2 observations, the third none
+    state = np.array([[0, 0, np.nan],
+                      [1, np.nan, np.nan],
+                      [5, 5, np.nan],
+                      [0, np.nan, np.nan]])
+    clear_views, clear_perc = modis_local.get_clear_views(modis_local.add_qa_bands({"state_1km": state}))
+    assert clear_views.tolist() == [3, 1, 0]
+    assert np.allclose(clear_perc[:2], [0.75, 0.5])
+    assert np.isnan(clear_perc[2])
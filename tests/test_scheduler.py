@@ -0,0 +1,78 @@
+# Export task scheduler (flood_detection/utils/scheduler.py) with a fake task
+# service
+
+from flood_detection.utils import scheduler
+
+# Task service whose tasks complete at the first poll, except the ones listed
+# in `fail` (FAILED), the starts listed in `refuse` (a quota error) and the
+# ones in `invalid` (an error at every start)
+def _service(fail=(), refuse=(), invalid=()):
+    started = []
+    refused = list(refuse)
+
+    def start(kind, params):
+        if params["description"] in refused:
+            refused.remove(params["description"])
+            raise scheduler.QuotaError("Too many tasks")
+        if params["description"] in invalid:
+            raise ValueError("Invalid argument")
+        started.append(params["description"])
+        return "task_{0}".format(len(started))
+
+    def status(task_ids):
+        return {task_id: {"state": "FAILED" if started[int(task_id.split("_")[1]) - 1] in fail
+                          else "COMPLETED", "error_message": "Export failed"}
+                for task_id in task_ids}
+
+    return scheduler.TaskService(start, status), started
+
+def _run(queue, service):
+    clock = [0.0]
+
+    def sleep(seconds):
+        clock[0] += seconds
+
+    return scheduler.run_queue(queue, service, poll_interval=30, clock=lambda: clock[0], sleep=sleep)
+
+def _queue(path):
+    return scheduler.open_queue(str(path), rate=1, burst=5, max_running=5, max_retries=2, backoff=10, now=0)
+
+def test_failed_tasks_are_tried_again_on_the_next_run(tmp_path):
+    path = tmp_path / "queue.json"
+    queue = _queue(path)
+    service, started = _service(fail=("b",))
+    for key in ("a", "b"):
+        scheduler.submit(queue, key, "image.toAsset", {"description": key})
+    assert _run(queue, service) == {"completed": 1, "failed": 1}
+    assert started.count("b") == 3
+    assert scheduler.failed_tasks(queue) == [("b", "Export failed")]
+
+    queue = _queue(path)
+    service, started = _service()
+    assert scheduler.submit(queue, "a", "image.toAsset", {"description": "a"}) == "completed"
+    assert scheduler.submit(queue, "b", "image.toAsset", {"description": "b"}) == "pending"
+    assert _run(queue, service) == {"completed": 2}
+    assert started == ["b"]
+
+def test_quota_errors_do_not_use_up_retries(tmp_path):
+    queue = _queue(tmp_path / "queue.json")
+    service, started = _service(refuse=("a",) * 4)
+    scheduler.submit(queue, "a", "image.toAsset", {"description": "a"})
+    assert _run(queue, service) == {"completed": 1}
+    assert started == ["a"]
+    assert queue["tasks"]["a"]["attempts"] == 0
+
+def test_other_start_errors_use_up_retries(tmp_path):
+    queue = _queue(tmp_path / "queue.json")
+    service, started = _service(invalid=("a",))
+    for key in ("a", "b"):
+        scheduler.submit(queue, key, "image.toAsset", {"description": key})
+    assert _run(queue, service) == {"completed": 1, "failed": 1}
+    assert started == ["b"]
+    assert queue["tasks"]["a"]["attempts"] == 3
+    assert scheduler.failed_tasks(queue) == [("a", "Invalid argument")]
+
+def test_ee_quota_errors():
+    assert scheduler._is_quota_error(Exception("Too many tasks already in the queue (3000)"))
+    assert scheduler._is_quota_error(Exception("Quota exceeded for project"))
+    assert not scheduler._is_quota_error(Exception("Cannot overwrite asset"))
@@ -0,0 +1,22 @@
+# Summary statistics over the events of a result matrix (flood_exposure/summary.py)
+
+import numpy as np
+
+from flood_exposure import results, summary
+
+def test_summarise_keeps_the_average_as_a_double():
+    matrix = results.result_matrix(3, ["DFO_1", "DFO_2", "DFO_3"], ["Pop_Flood", "Pct_P_Flood"])
+    results.set_result(matrix, "DFO_1", "Pop_Flood", [10, 0, 0])
+    results.set_result(matrix, "DFO_2", "Pop_Flood", [5, 3, 0])
+    results.set_result(matrix, "DFO_3", "Pop_Flood", [0, 4, 0])
+    for event in ("DFO_1", "DFO_2", "DFO_3"):
+        results.set_result(matrix, event, "Pct_P_Flood", [1.5, 2.25, 0])
+    result = summary.summarise(matrix, "Pop_Flood", "Pct_P_Flood")
+    assert result["avg"].dtype == np.float64
+    assert result["avg"].tolist() == [8.0, 4.0, 0.0]
+    assert result["num_floods"].tolist() == [2, 2, 0]
+    assert result["total"].tolist() == [15, 7, 0]
+
+def test_event_window():
+    names = ["DFO_1_From_20080101_to_20080110", "DFO_4500_From_20190101_to_20190115"]
+    assert summary.event_window(names, years=(2008, 2017)).tolist() == [True, False]